@@ -1,13 +1,32 @@
 import pygame
 import pygame_gui
-import json
 import os
+import time
 from datetime import datetime
-from PIL import Image, ImageDraw
-import io
+import numpy as np
+from canvas import MAX_CANVAS_SIZE, TiledFrame, set_pixel, line_points
+from fill import flood_fill
+from history import History, PixelChange, FrameInsert, FrameRemove, LayerInsert, LayerRemove, LayerSwap
+from layers import BLEND_MODES, new_layer, new_layered_frame
+from palette import PALETTES, TRANSPARENT_INDEX, Palette, index_pixels, remap_layers, to_indexed, to_direct
+from importer import IMAGE_TYPES, RESAMPLE, import_frames
+import export
+from project import Project, load_project as read_project, save_binary, save_json, frame_durations
+from atlas import build_atlas
+from jobs import JobQueue
+from journal import AUTOSAVE_DIR, Journal
+import transform
+from scaler import FILTERS
+from stroke import BRUSH_SHAPES, MAX_BRUSH_SIZE, Stroke, brush_offsets, stamp
+from profiler import HUD_INTERVAL, Profiler, traced, frames_nbytes
+from view import ACTIVE_FPS, IDLE_FPS, UI_GRACE, ZOOM_LEVELS, REGION_CACHE_BUDGET, ONION_PREV, ONION_NEXT, DirtyRenderer, SurfaceCache, TextCache, make_grid, make_region, make_ghost, make_patch, make_outline
+
+JOB_DONE = pygame.event.custom_type()
+IMPORT_MODES = tuple(RESAMPLE) + ("sheet",)
+
 
 class PixelArtEditor:
-    def __init__(self):
+    def __init__(self, autosave=AUTOSAVE_DIR):
         pygame.init()
         
         self.WIDTH = 1200
@@ -25,47 +44,78 @@ class PixelArtEditor:
         
         self.manager = pygame_gui.UIManager((self.WIDTH, self.HEIGHT))
         
-        self.canvas_surface = pygame.Surface((self.CANVAS_WIDTH, self.CANVAS_WIDTH))
-        self.canvas_surface.fill((255, 255, 255))
         self.canvas_rect = pygame.Rect(20, 20, self.CANVAS_WIDTH, self.CANVAS_WIDTH)
         
+        self.font = pygame.font.Font(None, 24)
+        self.text_cache = TextCache(self.font)
+        self.renderer = DirtyRenderer(self.screen)
+        self.profiler = Profiler()
+        self.hud_font = pygame.font.Font(None, 18)
+        self.hud_surface = None
+        self.hud_updated = 0
+        self.show_hud = False
+        self.clock = pygame.time.Clock()
+        self.jobs = JobQueue(lambda job: pygame.event.post(pygame.event.Event(JOB_DONE, job=job)))
+        self.canvas_dirty = []
+        self.ui_active_until = 0
+        self.hovered_swatch = None
+        self.pan_anchor = None
+        self.view_x = 0
+        self.view_y = 0
+        self.view_cells = self.CANVAS_SIZE
+        self.display_cache = SurfaceCache()
+        self.region_cache = SurfaceCache(REGION_CACHE_BUDGET)
+        self.onion_frames = 0
+        self.onion_opacity = 0.4
+        self.onion_canvas = None
+        self.selection = None
+        self.selection_bounds = None
+        self.selection_surface = None
+        self.selection_key = None
+        self.selection_mode = None
+        self.selection_points = []
+        self.selection_pending = False
+        self.transform_scope = "frame"
+        self.shift_wrap = True
+        self.build_layers()
+        
         self.current_color = pygame.Color(0, 0, 0)
         self.current_tool = "brush"
+        self.fill_tolerance = 0
+        self.fill_contiguous = True
         self.is_drawing = False
         self.last_pos = None
+        self.brush_size = 1
+        self.brush_shape = "square"
+        self.pixel_perfect = False
+        self.stroke = None
+        self.stroke_samples = []
         
-        self.history = []
-        self.save_state()
+        self.frames = [new_layered_frame(self.CANVAS_SIZE)]
+        self.current_frame = 0
+        self.current_layer = 0
+        self.render_canvas()
+        
+        self.journal = Journal(autosave)
+        self.history = History(listener=self.journal_changes)
+        self.edit_snapshot = None
         
-        self.palettes = {
-            "Basic": [
-                (0, 0, 0), (255, 255, 255), (255, 0, 0), (0, 255, 0),
-                (0, 0, 255), (255, 255, 0), (255, 0, 255), (0, 255, 255),
-                (128, 0, 0), (0, 128, 0), (0, 0, 128), (128, 128, 0)
-            ],
-            "Pastel": [
-                (255, 209, 220), (204, 255, 229), (204, 229, 255),
-                (255, 255, 204), (229, 204, 255), (255, 229, 204),
-                (220, 255, 209), (209, 220, 255), (255, 204, 229)
-            ],
-            "Game Boy": [
-                (15, 56, 15), (48, 98, 48), (139, 172, 15),
-                (155, 188, 15), (48, 98, 48)
-            ],
-            "NES": [
-                (124, 124, 124), (0, 0, 252), (0, 0, 188), (68, 40, 188),
-                (148, 0, 132), (168, 0, 32), (168, 16, 0), (136, 20, 0)
-            ]
-        }
+        self.palettes = {name: list(colors) for name, colors in PALETTES.items()}
         
         self.current_palette = "Basic"
+        self.current_swatch = 0
+        self.indexed_palette = None
+        self.dither = 0.0
         
-        self.frames = [self.canvas_surface.copy()]
-        self.current_frame = 0
         self.is_animating = False
         self.animation_speed = 5
+        self.export_scale = export.DEFAULT_SCALE
+        self.import_method = "nearest"
+        self.animation_format = "gif"
+        self.scale_filter = "nearest"
         
         self.create_ui()
+        self.recover_session()
         
     def create_ui(self):
         tool_panel_rect = pygame.Rect(self.CANVAS_WIDTH + 40, 20, self.WIDTH - self.CANVAS_WIDTH - 60, 200)
@@ -84,10 +134,26 @@ class PixelArtEditor:
         color_btn_rect = pygame.Rect(220, 60, 50, 30)
         self.color_picker = pygame_gui.elements.UIButton(relative_rect=color_btn_rect, text="", manager=self.manager, container=self.tool_panel, object_id='#color_picker')
         
+        self.indexed_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(280, 60, 100, 30), text="RGB", manager=self.manager, container=self.tool_panel)
+        
+        self.remap_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(390, 60, 100, 30), text="Remap", manager=self.manager, container=self.tool_panel)
+        
         self.palette_label = pygame_gui.elements.UILabel(relative_rect=pygame.Rect(10, 100, 200, 30), text="Palette:", manager=self.manager, container=self.tool_panel)
         
         self.palette_dropdown = pygame_gui.elements.UIDropDownMenu(options_list=list(self.palettes.keys()), starting_option=self.current_palette, relative_rect=pygame.Rect(120, 100, 150, 30), manager=self.manager, container=self.tool_panel)
         
+        self.dither_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(280, 100, 100, 30), text="No dither", manager=self.manager, container=self.tool_panel)
+        
+        self.brush_shape_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(390, 100, 100, 30), text="Square", manager=self.manager, container=self.tool_panel)
+        
+        self.tolerance_label = pygame_gui.elements.UILabel(relative_rect=pygame.Rect(10, 145, 100, 30), text="Tolerance:", manager=self.manager, container=self.tool_panel)
+        
+        self.tolerance_slider = pygame_gui.elements.UIHorizontalSlider(relative_rect=pygame.Rect(120, 145, 150, 30), start_value=self.fill_tolerance, value_range=(0, 255), manager=self.manager, container=self.tool_panel)
+        
+        self.fill_mode_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(280, 145, 120, 30), text="Contiguous", manager=self.manager, container=self.tool_panel)
+        
+        self.pixel_perfect_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(410, 145, 80, 30), text="PP: off", manager=self.manager, container=self.tool_panel)
+        
         anim_panel_rect = pygame.Rect(self.CANVAS_WIDTH + 40, 230, self.WIDTH - self.CANVAS_WIDTH - 60, 200)
         self.anim_panel = pygame_gui.elements.UIPanel(relative_rect=anim_panel_rect, manager=self.manager, object_id="anim_panel")
         
@@ -97,12 +163,37 @@ class PixelArtEditor:
         
         self.play_anim_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(270, 10, 120, 40), text="▶ Play", manager=self.manager, container=self.anim_panel)
         
-        self.frame_label = pygame_gui.elements.UILabel(relative_rect=pygame.Rect(10, 60, 200, 30), text=f"Frame: {self.current_frame + 1}/{len(self.frames)}", manager=self.manager, container=self.anim_panel)
+        self.onion_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(400, 10, 90, 40), text="Onion: off", manager=self.manager, container=self.anim_panel)
+        
+        self.frame_label = pygame_gui.elements.UILabel(relative_rect=pygame.Rect(10, 60, 120, 30), text=f"Frame: {self.current_frame + 1}/{len(self.frames)}", manager=self.manager, container=self.anim_panel)
+        
+        self.duration_entry = pygame_gui.elements.UITextEntryLine(relative_rect=pygame.Rect(130, 60, 70, 30), manager=self.manager, container=self.anim_panel)
+        self.duration_entry.set_allowed_characters('numbers')
+        
+        self.onion_slider = pygame_gui.elements.UIHorizontalSlider(relative_rect=pygame.Rect(205, 60, 80, 30), start_value=int(self.onion_opacity * 100), value_range=(10, 90), manager=self.manager, container=self.anim_panel)
         
         self.speed_label = pygame_gui.elements.UILabel(relative_rect=pygame.Rect(10, 100, 100, 30), text="Speed:", manager=self.manager, container=self.anim_panel)
         
         self.speed_slider = pygame_gui.elements.UIHorizontalSlider(relative_rect=pygame.Rect(120, 100, 150, 30), start_value=self.animation_speed, value_range=(1, 30), manager=self.manager, container=self.anim_panel)
         
+        self.layer_mode_dropdown = pygame_gui.elements.UIDropDownMenu(options_list=list(BLEND_MODES), starting_option=BLEND_MODES[0], relative_rect=pygame.Rect(290, 60, 100, 30), manager=self.manager, container=self.anim_panel)
+        
+        self.link_layer_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(400, 60, 90, 30), text="Link", manager=self.manager, container=self.anim_panel)
+        
+        self.opacity_slider = pygame_gui.elements.UIHorizontalSlider(relative_rect=pygame.Rect(290, 100, 200, 30), start_value=100, value_range=(0, 100), manager=self.manager, container=self.anim_panel)
+        
+        self.add_layer_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(10, 145, 80, 30), text="+ Layer", manager=self.manager, container=self.anim_panel)
+        
+        self.remove_layer_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(95, 145, 80, 30), text="- Layer", manager=self.manager, container=self.anim_panel)
+        
+        self.layer_down_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(180, 145, 30, 30), text="<", manager=self.manager, container=self.anim_panel)
+        
+        self.layer_label = pygame_gui.elements.UILabel(relative_rect=pygame.Rect(210, 145, 100, 30), text="Layer: 1/1", manager=self.manager, container=self.anim_panel)
+        
+        self.layer_up_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(310, 145, 30, 30), text=">", manager=self.manager, container=self.anim_panel)
+        
+        self.layer_visible_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(350, 145, 140, 30), text="Visible", manager=self.manager, container=self.anim_panel)
+        
         export_panel_rect = pygame.Rect(self.CANVAS_WIDTH + 40, 440, self.WIDTH - self.CANVAS_WIDTH - 60, 200)
         self.export_panel = pygame_gui.elements.UIPanel(relative_rect=export_panel_rect, manager=self.manager, object_id="export_panel")
         
@@ -110,97 +201,491 @@ class PixelArtEditor:
         
         self.export_gif_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(140, 10, 120, 40), text="GIF", manager=self.manager, container=self.export_panel)
         
+        self.export_json_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(270, 10, 120, 40), text="JSON", manager=self.manager, container=self.export_panel)
+        
+        self.export_sheet_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(400, 10, 90, 40), text="Sheet", manager=self.manager, container=self.export_panel)
+        
         self.save_project_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(10, 60, 120, 40), text="Save", manager=self.manager, container=self.export_panel)
         
         self.load_project_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(140, 60, 120, 40), text="Load", manager=self.manager, container=self.export_panel)
         
+        self.import_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(400, 60, 90, 40), text="Import", manager=self.manager, container=self.export_panel)
+        
+        self.import_method_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(400, 110, 90, 30), text="Nearest", manager=self.manager, container=self.export_panel)
+        
         self.undo_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(270, 60, 120, 40), text="Undo (Ctrl+Z)", manager=self.manager, container=self.export_panel)
         
-        self.size_label = pygame_gui.elements.UILabel(relative_rect=pygame.Rect(10, 110, 120, 30), text="Size:", manager=self.manager, container=self.export_panel)
+        self.redo_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(270, 110, 120, 40), text="Redo (Ctrl+Y)", manager=self.manager, container=self.export_panel)
+        
+        self.size_label = pygame_gui.elements.UILabel(relative_rect=pygame.Rect(10, 110, 50, 30), text="Size:", manager=self.manager, container=self.export_panel)
+        
+        self.size_entry = pygame_gui.elements.UITextEntryLine(relative_rect=pygame.Rect(60, 110, 70, 30), manager=self.manager, container=self.export_panel)
+        self.size_entry.set_allowed_characters('numbers')
+        self.size_entry.set_text(str(self.CANVAS_SIZE))
         
         self.size_16_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(140, 110, 50, 30), text="16x16", manager=self.manager, container=self.export_panel)
         
         self.size_32_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(200, 110, 50, 30), text="32x32", manager=self.manager, container=self.export_panel)
         
+        transform_panel_rect = pygame.Rect(20, self.CANVAS_WIDTH + 90, self.CANVAS_WIDTH, 68)
+        self.transform_panel = pygame_gui.elements.UIPanel(relative_rect=transform_panel_rect, manager=self.manager, object_id="transform_panel")
+        
+        self.select_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(5, 4, 70, 28), text="Select", manager=self.manager, container=self.transform_panel)
+        
+        self.lasso_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(80, 4, 70, 28), text="Lasso", manager=self.manager, container=self.transform_panel)
+        
+        self.replace_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(155, 4, 75, 28), text="Replace", manager=self.manager, container=self.transform_panel)
+        
+        self.flip_h_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(235, 4, 65, 28), text="Flip H", manager=self.manager, container=self.transform_panel)
+        
+        self.flip_v_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(305, 4, 65, 28), text="Flip V", manager=self.manager, container=self.transform_panel)
+        
+        self.rotate_90_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(375, 4, 65, 28), text="Rot 90", manager=self.manager, container=self.transform_panel)
+        
+        self.outline_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(445, 4, 75, 28), text="Outline", manager=self.manager, container=self.transform_panel)
+        
+        self.scope_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(525, 4, 105, 28), text="Frame", manager=self.manager, container=self.transform_panel)
+        
+        self.angle_entry = pygame_gui.elements.UITextEntryLine(relative_rect=pygame.Rect(5, 34, 50, 28), manager=self.manager, container=self.transform_panel)
+        self.angle_entry.set_text("45")
+        
+        self.rotate_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(60, 34, 65, 28), text="Rotate", manager=self.manager, container=self.transform_panel)
+        
+        self.scale_entry = pygame_gui.elements.UITextEntryLine(relative_rect=pygame.Rect(130, 34, 50, 28), manager=self.manager, container=self.transform_panel)
+        self.scale_entry.set_text("2")
+        
+        self.scale_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(185, 34, 60, 28), text="Scale", manager=self.manager, container=self.transform_panel)
+        
+        self.shift_entry = pygame_gui.elements.UITextEntryLine(relative_rect=pygame.Rect(250, 34, 70, 28), manager=self.manager, container=self.transform_panel)
+        self.shift_entry.set_text("1,0")
+        
+        self.shift_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(325, 34, 60, 28), text="Shift", manager=self.manager, container=self.transform_panel)
+        
+        self.wrap_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(390, 34, 75, 28), text="Wrap: on", manager=self.manager, container=self.transform_panel)
+        
+        self.range_label = pygame_gui.elements.UILabel(relative_rect=pygame.Rect(470, 34, 55, 28), text="Range:", manager=self.manager, container=self.transform_panel)
+        
+        self.range_entry = pygame_gui.elements.UITextEntryLine(relative_rect=pygame.Rect(525, 34, 105, 28), manager=self.manager, container=self.transform_panel)
+        self.range_entry.set_text("1-1")
+        
+        self.transform_buttons = (self.flip_h_btn, self.flip_v_btn, self.rotate_90_btn, self.outline_btn, self.rotate_btn, self.scale_btn, self.shift_btn)
+        
+        self.job_bar = pygame_gui.elements.UIProgressBar(relative_rect=pygame.Rect(self.CANVAS_WIDTH + 40, 650, 400, 30), manager=self.manager)
+        
+        self.cancel_job_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(self.WIDTH - 110, 650, 90, 30), text="Cancel", manager=self.manager)
+        
+        self.job_label = pygame_gui.elements.UILabel(relative_rect=pygame.Rect(self.CANVAS_WIDTH + 40, 685, 400, 25), text="", manager=self.manager)
+        
+        for element in (self.job_bar, self.cancel_job_btn, self.job_label):
+            element.hide()
+            
+        self.ui_rects = [self.tool_panel.rect.unionall([self.anim_panel.rect, self.export_panel.rect, self.job_bar.rect, self.cancel_job_btn.rect, self.job_label.rect]), self.transform_panel.rect]
+        
+        self.scale_label = pygame_gui.elements.UILabel(relative_rect=pygame.Rect(10, 155, 120, 30), text=f"Scale: {self.export_scale}x", manager=self.manager, container=self.export_panel)
+        
+        self.scale_slider = pygame_gui.elements.UIHorizontalSlider(relative_rect=pygame.Rect(140, 155, 160, 30), start_value=self.export_scale, value_range=(1, 32), manager=self.manager, container=self.export_panel)
+        
+        self.scale_filter_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(305, 155, 90, 30), text="Nearest", manager=self.manager, container=self.export_panel)
+        
+        self.anim_format_btn = pygame_gui.elements.UIButton(relative_rect=pygame.Rect(400, 155, 90, 30), text="Format", manager=self.manager, container=self.export_panel)
+        
+    def build_layers(self):
+        self.grid_surface = make_grid(self.view_cells, self.PIXEL_SIZE, self.GRID_COLOR) if self.PIXEL_SIZE >= 4 else None
+        self.palette_rect = pygame.Rect(self.CANVAS_WIDTH + 40, self.HEIGHT - 150, 400, 130)
+        self.palette_surface = None
+        self.status_text = None
+        self.status_rect = None
+        self.renderer.invalidate()
+        
+    def fit_view(self):
+        self.PIXEL_SIZE = max(1, self.CANVAS_WIDTH // self.CANVAS_SIZE)
+        self.view_x = 0
+        self.view_y = 0
+        self.update_view()
+        
+    def update_view(self):
+        self.view_cells = min(self.CANVAS_SIZE, -(-self.CANVAS_WIDTH // self.PIXEL_SIZE))
+        view_width = min(self.CANVAS_WIDTH, self.CANVAS_SIZE * self.PIXEL_SIZE)
+        self.canvas_rect = pygame.Rect(20, 20, view_width, view_width)
+        self.display_cache.clear()
+        self.build_layers()
+        self.set_view(self.view_x, self.view_y)
+        
+    def set_view(self, view_x, view_y):
+        max_offset = max(0, self.CANVAS_SIZE - self.CANVAS_WIDTH // self.PIXEL_SIZE)
+        self.view_x = max(0, min(view_x, max_offset))
+        self.view_y = max(0, min(view_y, max_offset))
+        self.render_canvas()
+        
+    def zoom_at(self, pos, step):
+        index = min(range(len(ZOOM_LEVELS)), key=lambda i: abs(ZOOM_LEVELS[i] - self.PIXEL_SIZE))
+        zoom = ZOOM_LEVELS[max(0, min(len(ZOOM_LEVELS) - 1, index + step))]
+        if zoom == self.PIXEL_SIZE:
+            return
+        if not self.canvas_rect.collidepoint(pos):
+            pos = self.canvas_rect.center
+        offset_x = pos[0] - self.canvas_rect.x
+        offset_y = pos[1] - self.canvas_rect.y
+        cell_x = offset_x / self.PIXEL_SIZE + self.view_x
+        cell_y = offset_y / self.PIXEL_SIZE + self.view_y
+        self.PIXEL_SIZE = zoom
+        self.view_x = int(cell_x - offset_x / zoom)
+        self.view_y = int(cell_y - offset_y / zoom)
+        self.update_view()
+        
+    def view_bounds(self):
+        x1 = min(self.CANVAS_SIZE, self.view_x + self.view_cells)
+        y1 = min(self.CANVAS_SIZE, self.view_y + self.view_cells)
+        return self.view_x, self.view_y, x1, y1
+        
+    def frame_surface(self, index, tint=None):
+        frame = self.frames[index]
+        revision = frame.revision
+        key = (id(frame), self.view_bounds(), tint)
+        surface = self.display_cache.get(key + (self.PIXEL_SIZE,), revision)
+        if surface is None:
+            small = self.region_cache.get(key, revision)
+            if small is None:
+                region = frame.read(*key[1])
+                small = self.region_cache.put(key, revision, make_region(region) if tint is None else make_ghost(region, tint))
+            size = (small.get_width() * self.PIXEL_SIZE, small.get_height() * self.PIXEL_SIZE)
+            surface = self.display_cache.put(key + (self.PIXEL_SIZE,), revision, pygame.transform.scale(small, size))
+        return surface
+        
+    @traced("render")
+    def render_canvas(self):
+        self.frames[self.current_frame].active = self.current_layer
+        surface = self.frame_surface(self.current_frame)
+        if self.onion_frames and not self.is_animating:
+            if self.onion_canvas is None or self.onion_canvas.get_size() != surface.get_size():
+                self.onion_canvas = pygame.Surface(surface.get_size())
+            self.onion_canvas.blit(surface, (0, 0))
+            for distance in range(self.onion_frames, 0, -1):
+                alpha = int(255 * self.onion_opacity * (self.onion_frames - distance + 1) / self.onion_frames)
+                for index, tint in ((self.current_frame - distance, ONION_PREV), (self.current_frame + distance, ONION_NEXT)):
+                    if 0 <= index < len(self.frames):
+                        ghost = self.frame_surface(index, tint)
+                        ghost.set_alpha(alpha)
+                        self.onion_canvas.blit(ghost, (0, 0))
+            surface = self.onion_canvas
+        self.canvas_surface = surface
+        self.invalidate_canvas()
+        
+    def invalidate_canvas(self, rect=None):
+        if rect is None:
+            rect = pygame.Rect(0, 0, self.canvas_rect.w + 1, self.canvas_rect.h + 1)
+        self.canvas_dirty.append(rect)
+        
+    def touch_ui(self):
+        self.ui_active_until = time.monotonic() + UI_GRACE
+        
+    def set_text(self, element, text):
+        current = element.get_text() if hasattr(element, "get_text") else element.text
+        if current != text:
+            element.set_text(text)
+            
+    def select_frame(self, index):
+        self.profiler.mark("select_frame", frame=index)
+        self.current_frame = index
+        self.current_layer = min(self.current_layer, len(self.frames[index].layers) - 1)
+        self.render_canvas()
+        self.set_text(self.frame_label, f"Frame: {self.current_frame + 1}/{len(self.frames)}")
+        self.set_text(self.duration_entry, str(self.frames[index].duration or ""))
+        self.update_layer_ui()
+        self.touch_ui()
+        
+    def active_layer(self):
+        return self.frames[self.current_frame].layers[self.current_layer]
+        
+    def select_layer(self, index):
+        self.current_layer = max(0, min(index, len(self.frames[self.current_frame].layers) - 1))
+        self.render_canvas()
+        self.update_layer_ui()
+        self.touch_ui()
+        
+    def update_layer_ui(self):
+        layer = self.active_layer()
+        self.set_text(self.layer_label, f"Layer: {self.current_layer + 1}/{len(self.frames[self.current_frame].layers)}")
+        self.set_text(self.layer_visible_btn, f"{layer.name}: {'on' if layer.visible else 'off'}")
+        self.set_text(self.link_layer_btn, "Unlink" if layer.linked else "Link")
+        self.layer_mode_dropdown.selected_option = layer.mode
+        if self.opacity_slider.get_current_value() != int(round(layer.opacity * 100)):
+            self.opacity_slider.set_current_value(int(round(layer.opacity * 100)))
+        
+    def set_layer_props(self, **props):
+        for frame in self.frames:
+            for name, value in props.items():
+                setattr(frame.layers[self.current_layer], name, value)
+        self.journal.record_props(self.current_layer, props)
+        self.render_canvas()
+        self.update_layer_ui()
+        
+    @traced("project")
+    def add_layer(self):
+        index = self.current_layer + 1
+        name = f"Layer {len(self.frames[self.current_frame].layers) + 1}"
+        if self.indexed_palette is None:
+            layers = [new_layer(self.CANVAS_SIZE, name) for _ in self.frames]
+        else:
+            layers = [new_layer(self.CANVAS_SIZE, name, (TRANSPARENT_INDEX,), self.indexed_palette) for _ in self.frames]
+        change = LayerInsert(self.current_frame, index, layers)
+        change.redo(self.frames)
+        self.history.push([change])
+        self.select_layer(index)
+        
+    @traced("project")
+    def remove_layer(self):
+        if len(self.frames[self.current_frame].layers) > 1:
+            change = LayerRemove(self.current_frame, self.current_layer, [frame.layers[self.current_layer] for frame in self.frames])
+            change.redo(self.frames)
+            self.history.push([change])
+            self.select_layer(self.current_layer)
+            
+    def toggle_link(self):
+        old = [frame.layers[self.current_layer] for frame in self.frames]
+        layer = self.active_layer()
+        if layer.linked:
+            new = [layer.copy(linked=False) for _ in self.frames]
+        else:
+            new = [layer.copy(linked=True)] * len(self.frames)
+        change = LayerSwap(self.current_frame, self.current_layer, old, new)
+        change.redo(self.frames)
+        self.history.push([change])
+        self.select_layer(self.current_layer)
+        
+    def begin_edit(self):
+        self.edit_snapshot = self.active_layer().pixels.copy()
+        self.edit_started = time.perf_counter()
+        
+    @traced("history")
     def save_state(self):
-        if len(self.history) > 20:
-            self.history.pop(0)
-        self.history.append(self.canvas_surface.copy())
+        if self.edit_snapshot is not None:
+            self.history.push([PixelChange.diff(self.current_frame, self.current_layer, self.edit_snapshot, self.active_layer().pixels)])
+            self.edit_snapshot = None
+            self.profiler.record("edit", "tool", self.edit_started, time.perf_counter(), {"tool": self.current_tool})
+            if self.onion_frames:
+                self.render_canvas()
+            
+    def reset_history(self):
+        self.history.clear()
+        self.edit_snapshot = None
+        self.journal.checkpoint(self.current_project(), reset=True)
+        
+    def journal_changes(self, changes, undo):
+        self.journal.record_changes(changes, self.frames, undo)
+        if self.journal.needs_compaction():
+            self.journal.checkpoint(self.current_project())
+            
+    def recover_session(self):
+        if self.journal.has_recovery():
+            try:
+                project, count = self.journal.recover()
+                self.open_project(project)
+                print(f"Recovered unsaved session ({count} edits)")
+                self.show_message("Recovery", f"Recovered the unsaved session from the last run ({count} edits replayed).")
+                return
+            except Exception as e:
+                print(f"Recovery error: {e}")
+                self.show_message("Error", f"Failed to recover the last session:\n{str(e)}")
+                self.journal.quarantine()
+        self.journal.checkpoint(self.current_project(), reset=True)
         
+    @traced("history")
     def undo(self):
-        if len(self.history) > 1:
-            self.history.pop()
-            self.canvas_surface = self.history[-1].copy()
-            self.frames[self.current_frame] = self.canvas_surface.copy()
+        self.save_state()
+        index = self.history.undo(self.frames)
+        if index is not None:
+            self.select_frame(min(index, len(self.frames) - 1))
+            
+    @traced("history")
+    def redo(self):
+        self.save_state()
+        index = self.history.redo(self.frames)
+        if index is not None:
+            self.select_frame(min(index, len(self.frames) - 1))
             
     def get_pixel_pos(self, pos):
-        x = (pos[0] - self.canvas_rect.x) // self.PIXEL_SIZE
-        y = (pos[1] - self.canvas_rect.y) // self.PIXEL_SIZE
+        x = (pos[0] - self.canvas_rect.x) // self.PIXEL_SIZE + self.view_x
+        y = (pos[1] - self.canvas_rect.y) // self.PIXEL_SIZE + self.view_y
         return x, y
         
+    def draw_color(self):
+        if self.indexed_palette is not None:
+            return (self.current_swatch,)
+        return self.current_color
+        
     def draw_pixel(self, x, y, color=None):
-        if 0 <= x < self.CANVAS_SIZE and 0 <= y < self.CANVAS_SIZE:
-            if color is None:
-                color = self.current_color
-            elif isinstance(color, tuple):
-                color = pygame.Color(color)
-                
-            if self.current_tool == "erase":
-                color = pygame.Color(255, 255, 255)
-                
-            rect = pygame.Rect(x * self.PIXEL_SIZE, y * self.PIXEL_SIZE, self.PIXEL_SIZE, self.PIXEL_SIZE)
-            pygame.draw.rect(self.canvas_surface, color, rect)
-            self.frames[self.current_frame] = self.canvas_surface.copy()
+        if color is None:
+            color = self.draw_color()
+            
+        pixels = self.active_layer().pixels
+        if self.current_tool == "erase":
+            color = pixels.background
             
-    def flood_fill(self, x, y, target_color, replacement_color):
-        if target_color == replacement_color:
+        if set_pixel(pixels, x, y, color):
+            shown = self.frames[self.current_frame].read(x, y, x + 1, y + 1)[0, 0]
+            rect = pygame.Rect((x - self.view_x) * self.PIXEL_SIZE, (y - self.view_y) * self.PIXEL_SIZE, self.PIXEL_SIZE, self.PIXEL_SIZE)
+            pygame.draw.rect(self.canvas_surface, tuple(int(c) for c in shown), rect)
+            self.invalidate_canvas(rect)
+            
+    @traced("tool")
+    def flood_fill(self, x, y, replacement_color):
+        mask = flood_fill(self.active_layer().pixels, x, y, replacement_color, self.fill_tolerance, self.fill_contiguous)
+        if mask.any():
+            self.render_canvas()
+            
+    def paint_color(self):
+        if self.current_tool == "erase":
+            return self.active_layer().pixels.background
+        return self.draw_color()
+        
+    def paint_cells(self, points, color=None):
+        pixels = self.active_layer().pixels
+        cells = stamp(points, brush_offsets(self.brush_size, self.brush_shape), pixels.width, pixels.height) if points else None
+        if cells is None:
+            return False
+        x0, y0, mask = cells
+        pixels.write_mask(mask, self.paint_color() if color is None else color, x0, y0)
+        self.show_cells(x0, y0, mask)
+        return True
+        
+    def restore_cells(self, points):
+        pixels = self.active_layer().pixels
+        cells = stamp(points, brush_offsets(1), pixels.width, pixels.height)
+        if cells is None or self.edit_snapshot is None:
+            return
+        x0, y0, mask = cells
+        ys, xs = np.nonzero(mask)
+        indices = (ys + y0) * pixels.width + xs + x0
+        pixels.put(indices, self.edit_snapshot.take(indices))
+        self.show_cells(x0, y0, mask)
+        
+    def show_cells(self, x0, y0, mask):
+        vx0, vy0, vx1, vy1 = self.view_bounds()
+        ix0, iy0 = max(x0, vx0), max(y0, vy0)
+        ix1, iy1 = min(x0 + mask.shape[1], vx1), min(y0 + mask.shape[0], vy1)
+        if ix1 <= ix0 or iy1 <= iy0:
             return
-        if not (0 <= x < self.CANVAS_SIZE and 0 <= y < self.CANVAS_SIZE):
+        region = self.frames[self.current_frame].read(ix0, iy0, ix1, iy1)
+        patch = make_patch(region, mask[iy0 - y0:iy1 - y0, ix0 - x0:ix1 - x0])
+        patch = pygame.transform.scale(patch, ((ix1 - ix0) * self.PIXEL_SIZE, (iy1 - iy0) * self.PIXEL_SIZE))
+        self.invalidate_canvas(self.canvas_surface.blit(patch, ((ix0 - self.view_x) * self.PIXEL_SIZE, (iy0 - self.view_y) * self.PIXEL_SIZE)))
+        
+    def begin_stroke(self, x, y):
+        self.begin_edit()
+        self.stroke = Stroke(self.brush_size, self.brush_shape, self.pixel_perfect)
+        self.stroke_samples = [(x, y)]
+        self.flush_stroke()
+        
+    def flush_stroke(self):
+        if self.stroke is None or not self.stroke_samples:
             return
+        samples, self.stroke_samples = self.stroke_samples, []
+        added, removed = self.stroke.extend(samples)
+        self.paint_cells(added)
+        if removed:
+            self.restore_cells(removed)
             
-        if isinstance(target_color, pygame.Color):
-            target_tuple = (target_color.r, target_color.g, target_color.b)
-        else:
-            target_tuple = target_color
+    def end_stroke(self):
+        self.flush_stroke()
+        self.stroke = None
+        
+    def set_brush_size(self, size):
+        self.brush_size = max(1, min(size, MAX_BRUSH_SIZE))
+        
+    @traced("tool")
+    def draw_line(self, start, end):
+        self.paint_cells(line_points(start, end))
+        
+    def selection_mask(self):
+        if self.selection is not None:
+            return self.selection
+        return np.ones((self.CANVAS_SIZE, self.CANVAS_SIZE), dtype=bool)
+        
+    def set_selection(self, mask):
+        self.selection = mask if mask is not None and mask.any() else None
+        self.selection_bounds = None if self.selection is None else transform.bounds(self.selection)
+        self.selection_surface = None
+        self.invalidate_canvas()
+        
+    def selection_overlay(self):
+        if self.selection is None:
+            return None
+        key = (self.view_bounds(), self.PIXEL_SIZE)
+        if self.selection_surface is None or self.selection_key != key:
+            x0, y0, x1, y1 = key[0]
+            self.selection_surface = make_outline(self.selection[y0:y1, x0:x1], self.PIXEL_SIZE)
+            self.selection_key = key
+        return self.selection_surface
+        
+    def begin_selection(self, x, y):
+        inside = self.selection is not None and 0 <= x < self.CANVAS_SIZE and 0 <= y < self.CANVAS_SIZE and self.selection[y, x]
+        self.selection_mode = "move" if inside else self.current_tool
+        self.selection_points = [(x, y)]
+        
+    def update_selection(self):
+        self.selection_pending = False
+        if self.selection_mode == "select":
+            self.set_selection(transform.rect_mask(self.CANVAS_SIZE, self.CANVAS_SIZE, self.selection_points[0], self.selection_points[-1]))
+        elif self.selection_mode == "lasso":
+            self.set_selection(transform.lasso_mask(self.CANVAS_SIZE, self.CANVAS_SIZE, self.selection_points))
             
-        if isinstance(replacement_color, pygame.Color):
-            replacement_tuple = (replacement_color.r, replacement_color.g, replacement_color.b)
+    def end_selection(self):
+        start, end = self.selection_points[0], self.selection_points[-1]
+        if self.selection_mode == "move":
+            if start != end:
+                self.apply_transform(transform.shift, end[0] - start[0], end[1] - start[1])
+        elif start == end or (self.selection_mode == "lasso" and len(set(self.selection_points)) < 3):
+            self.set_selection(None)
         else:
-            replacement_tuple = replacement_color
-            
-        stack = [(x, y)]
-        while stack:
-            x, y = stack.pop()
-            if not (0 <= x < self.CANVAS_SIZE and 0 <= y < self.CANVAS_SIZE):
-                continue
-                
-            pixel_color = self.canvas_surface.get_at((x * self.PIXEL_SIZE + self.PIXEL_SIZE // 2, y * self.PIXEL_SIZE + self.PIXEL_SIZE // 2))[:3]
+            self.update_selection()
+        self.selection_mode = None
+        self.selection_points = []
+        
+    def target_frames(self):
+        if self.transform_scope == "all":
+            return list(range(len(self.frames)))
+        if self.transform_scope == "range":
+            return transform.parse_range(self.range_entry.get_text(), len(self.frames))
+        return [self.current_frame]
+        
+    @traced("tool")
+    def apply_transform(self, operation, *args):
+        result = operation(self.selection_mask(), *args)
+        if result is None:
+            return False
+        region, op, selection = result
+        self.history.push(transform.apply(self.frames, self.target_frames(), self.current_layer, region, op))
+        if self.selection is not None:
+            self.set_selection(selection)
+        self.render_canvas()
+        return True
+        
+    def transform_command(self, element):
+        try:
+            if element == self.flip_h_btn:
+                self.apply_transform(transform.flip, True)
+            elif element == self.flip_v_btn:
+                self.apply_transform(transform.flip, False)
+            elif element == self.rotate_90_btn:
+                self.apply_transform(transform.rotate, 90)
+            elif element == self.outline_btn:
+                self.apply_transform(transform.outline, self.draw_color())
+            elif element == self.rotate_btn:
+                self.apply_transform(transform.rotate, float(self.angle_entry.get_text()))
+            elif element == self.scale_btn:
+                self.apply_transform(transform.scale, *transform.parse_pair(self.scale_entry.get_text()))
+            elif element == self.shift_btn:
+                self.apply_transform(transform.shift, *transform.parse_pair(self.shift_entry.get_text(), int), self.shift_wrap)
+        except ValueError as e:
+            self.show_message("Error", f"Transform failed:\n{str(e)}")
             
-            if pixel_color == target_tuple:
-                self.draw_pixel(x, y, replacement_color)
-                stack.extend([(x+1, y), (x-1, y), (x, y+1), (x, y-1)])
-                
-    def draw_line(self, start, end):
-        x1, y1 = start
-        x2, y2 = end
-        
-        dx = abs(x2 - x1)
-        dy = abs(y2 - y1)
-        sx = 1 if x1 < x2 else -1
-        sy = 1 if y1 < y2 else -1
-        err = dx - dy
-        
-        while True:
-            self.draw_pixel(x1, y1)
-            if x1 == x2 and y1 == y2:
-                break
-            e2 = 2 * err
-            if e2 > -dy:
-                err -= dy
-                x1 += sx
-            if e2 < dx:
-                err += dx
-                y1 += sy
+    def replace_color(self, x, y):
+        if 0 <= x < self.CANVAS_SIZE and 0 <= y < self.CANVAS_SIZE:
+            try:
+                self.apply_transform(transform.replace_color, self.active_layer().pixels.get_pixel(x, y), self.draw_color(), self.fill_tolerance)
+            except ValueError as e:
+                self.show_message("Error", f"Transform failed:\n{str(e)}")
     
     def update_color_picker(self):
         temp_surface = pygame.Surface((46, 26))
@@ -214,78 +699,324 @@ class PixelArtEditor:
         self.color_picker.colours['active_bg'] = self.current_color
         
         self.color_picker.rebuild()
+        self.palette_surface = None
+        
+    def palette_colors(self):
+        if self.indexed_palette is not None:
+            return [tuple(color) for color in self.indexed_palette.colors.tolist()]
+        return self.palettes[self.current_palette]
+        
+    def select_swatch(self, index):
+        self.current_swatch = index
+        self.current_color = pygame.Color(self.palette_colors()[index])
+        self.update_color_picker()
+        
+    def pick_color(self, color):
+        self.current_color = pygame.Color(color)
+        if self.indexed_palette is not None:
+            self.indexed_palette.set_color(self.current_swatch, self.current_color)
+            self.journal.record_palette(self.current_swatch, self.current_color)
+            self.render_canvas()
+        self.update_color_picker()
+        
+    @traced("tool")
+    def toggle_indexed(self):
+        self.save_state()
+        if self.indexed_palette is None:
+            palette = Palette(self.palettes[self.current_palette])
+            to_indexed(self.frames, palette, self.dither)
+            self.indexed_palette = palette
+            self.select_swatch(min(self.current_swatch, len(palette) - 1))
+        else:
+            to_direct(self.frames)
+            self.indexed_palette = None
+        self.reset_history()
+        self.indexed_btn.set_text("RGB" if self.indexed_palette is None else "Indexed")
+        self.palette_surface = None
+        self.render_canvas()
+        
+    @traced("tool")
+    def remap_to_palette(self):
+        self.save_state()
+        palette = Palette(self.palettes[self.current_palette])
+        if self.indexed_palette is not None:
+            to_direct(self.frames)
+            to_indexed(self.frames, palette, self.dither)
+            self.indexed_palette = palette
+            self.select_swatch(min(self.current_swatch, len(palette) - 1))
+            self.reset_history()
+        else:
+            changes = []
+            for frame_index, layer_index, pixels in remap_layers(self.frames, palette, self.dither):
+                change = PixelChange.diff(frame_index, layer_index, self.frames[frame_index].layers[layer_index].pixels, pixels)
+                if change is not None:
+                    change.redo(self.frames)
+                    changes.append(change)
+            self.history.push(changes)
+        self.palette_surface = None
+        self.render_canvas()
+        
+    def swatch_at(self, pos):
+        for i in range(len(self.palette_colors())):
+            rect = pygame.Rect(self.palette_rect.x + 10 + (i % 6) * 35, self.palette_rect.y + 40 + (i // 6) * 35, 30, 30)
+            if rect.collidepoint(pos):
+                return i
+        return None
+        
+    def render_palette_panel(self):
+        self.palette_surface = pygame.Surface(self.palette_rect.size)
+        self.palette_surface.fill(self.UI_BG_COLOR)
+        self.palette_surface.blit(self.text_cache.render("Palette:", (255, 255, 255)), (10, 10))
+        
+        for i, color in enumerate(self.palette_colors()):
+            rect = pygame.Rect(10 + (i % 6) * 35, 40 + (i // 6) * 35, 30, 30)
+            pygame.draw.rect(self.palette_surface, color, rect)
+            pygame.draw.rect(self.palette_surface, (100, 100, 100), rect, 1)
+            if i == self.hovered_swatch or (self.indexed_palette is not None and i == self.current_swatch):
+                pygame.draw.rect(self.palette_surface, (255, 255, 255), rect, 2)
                 
-    def export_png(self):
+        color_display = pygame.Rect(250, 40, 60, 60)
+        pygame.draw.rect(self.palette_surface, self.current_color, color_display)
+        pygame.draw.rect(self.palette_surface, (200, 200, 200), color_display, 2)
+        
+    def draw(self):
+        windows = self.manager.get_window_stack().get_stack()
+        ui_active = time.monotonic() < self.ui_active_until
+        if windows and ui_active:
+            self.renderer.invalidate()
+            
+        if self.renderer.full:
+            self.screen.fill(self.BG_COLOR)
+            self.invalidate_canvas()
+            self.palette_surface = None
+            self.status_text = None
+            hints = "Ctrl+Z: Undo | Ctrl+Y: Redo | Left/Right: Frames | Up/Down: Layers | [ ]: Brush size | Ctrl+A/Esc: Select all/none | Wheel: Zoom | MMB: Pan | F3: Profiler | F4: Trace"
+            self.screen.blit(self.text_cache.render(hints, (150, 150, 150)), (20, self.CANVAS_WIDTH + 60))
+            
+        canvas_clip = pygame.Rect(self.canvas_rect.x, self.canvas_rect.y, self.canvas_rect.w + 1, self.canvas_rect.h + 1)
+        self.screen.set_clip(canvas_clip)
+        selection = self.selection_overlay() if self.canvas_dirty else None
+        for rect in self.canvas_dirty:
+            screen_rect = rect.move(self.canvas_rect.topleft)
+            self.screen.blit(self.canvas_surface, screen_rect, rect)
+            if self.grid_surface is not None:
+                self.screen.blit(self.grid_surface, screen_rect, rect)
+            if selection is not None:
+                self.screen.blit(selection, screen_rect, rect)
+            self.renderer.invalidate(screen_rect.clip(canvas_clip))
+        self.screen.set_clip(None)
+        self.canvas_dirty = []
+        
+        if self.palette_surface is None:
+            self.render_palette_panel()
+            self.screen.blit(self.palette_surface, self.palette_rect)
+            self.renderer.invalidate(self.palette_rect)
+            
+        layer = self.active_layer()
+        status = f"Tool: {self.current_tool} | Brush: {self.brush_size}px {self.brush_shape}{' pixel-perfect' if self.pixel_perfect else ''} | Size: {self.CANVAS_SIZE}x{self.CANVAS_SIZE} | Zoom: {self.PIXEL_SIZE}x | {layer.name} ({layer.mode}, {int(round(layer.opacity * 100))}%)"
+        if self.selection_bounds is not None:
+            x0, y0, x1, y1 = self.selection_bounds
+            status += f" | Selection: {x1 - x0}x{y1 - y0} at {x0},{y0}"
+        if self.onion_frames:
+            status += f" | Onion: {self.onion_frames} @ {int(round(self.onion_opacity * 100))}%"
+        if status != self.status_text:
+            if self.status_rect is not None:
+                self.screen.fill(self.BG_COLOR, self.status_rect)
+                self.renderer.invalidate(self.status_rect)
+            self.status_rect = self.screen.blit(self.text_cache.render(status, (200, 200, 200)), (20, self.CANVAS_WIDTH + 30))
+            self.renderer.invalidate(self.status_rect)
+            self.status_text = status
+            
+        if self.hud_surface is not None:
+            self.renderer.invalidate(self.screen.blit(self.hud_surface, (self.canvas_rect.x + 4, self.canvas_rect.y + 4)))
+            
+        if self.renderer.full or ui_active:
+            with self.profiler.span("draw_ui", "ui"):
+                self.manager.draw_ui(self.screen)
+            for rect in self.ui_rects:
+                self.renderer.invalidate(rect)
+            
+        self.renderer.present()
+                
+    def update_profiler(self):
+        now = time.monotonic()
+        if now - self.hud_updated < HUD_INTERVAL:
+            return
+        self.hud_updated = now
+        frames_mb = frames_nbytes(self.frames) / (1024 * 1024)
+        history_mb = self.history.nbytes / (1024 * 1024)
+        self.profiler.counter("memory (MB)", frames=round(frames_mb, 2), history=round(history_mb, 2))
+        if not self.show_hud:
+            return
+        
+        average, peak = self.profiler.average, self.profiler.peak
+        lines = [
+            f"Frame {average('frame'):.2f} ms (max {peak('frame'):.2f})  {self.clock.get_fps():.0f} FPS",
+            f"Events {average('events'):.2f} ms  Render {average('draw'):.2f} ms",
+            f"UI update {average('manager.update'):.2f} ms  draw_ui {average('draw_ui'):.2f} ms",
+            f"Frames {frames_mb:.1f} MB  History {history_mb:.1f} MB ({len(self.history)} steps)"
+        ]
+        texts = [self.hud_font.render(line, True, (220, 220, 220)) for line in lines]
+        size = (max(text.get_width() for text in texts) + 12, sum(text.get_height() for text in texts) + 10)
+        if self.hud_surface is not None and self.hud_surface.get_size() != size:
+            self.invalidate_canvas(pygame.Rect((4, 4), self.hud_surface.get_size()))
+        self.hud_surface = pygame.Surface(size)
+        self.hud_surface.fill((20, 22, 26))
+        y = 5
+        for text in texts:
+            self.hud_surface.blit(text, (6, y))
+            y += text.get_height()
+            
+    def toggle_hud(self):
+        self.show_hud = not self.show_hud
+        self.hud_updated = 0
+        if not self.show_hud:
+            self.hud_surface = None
+            self.invalidate_canvas()
+            
+    def save_trace(self):
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"pixel_art_{timestamp}.png"
+        filename = f"trace_{timestamp}.json"
+        
+        self.profiler.save_trace(filename)
+        print(f"Trace saved as: {filename}")
+        self.show_message("Profiler", f"Chrome trace saved as:\n{filename}\nOpen it in chrome://tracing or ui.perfetto.dev")
+        
+    def frame_delay(self, index):
+        return self.frames[index].duration or 1000 // self.animation_speed
+        
+    def frame_delays(self):
+        return [duration or 1000 // self.animation_speed for duration in frame_durations(self.frames)]
         
-        img = Image.new('RGB', (self.CANVAS_SIZE, self.CANVAS_SIZE), (255, 255, 255))
+    def set_frame_duration(self, text):
+        self.frames[self.current_frame].duration = max(10, min(int(text), 10000)) if text.isdigit() else None
+        self.journal.record_duration(self.current_frame, self.frames[self.current_frame].duration)
+        self.set_text(self.duration_entry, str(self.frames[self.current_frame].duration or ""))
         
-        for x in range(self.CANVAS_SIZE):
-            for y in range(self.CANVAS_SIZE):
-                pixel_color = self.canvas_surface.get_at((x * self.PIXEL_SIZE + self.PIXEL_SIZE // 2, y * self.PIXEL_SIZE + self.PIXEL_SIZE // 2))[:3]
-                if pixel_color != (255, 255, 255):
-                    img.putpixel((x, y), pixel_color)
+    def cycle_onion(self):
+        self.onion_frames = (self.onion_frames + 1) % 4
+        self.onion_btn.set_text(f"Onion: {self.onion_frames or 'off'}")
+        self.render_canvas()
         
-        img = img.resize((self.CANVAS_SIZE * 10, self.CANVAS_SIZE * 10), Image.NEAREST)
-        img.save(filename)
-        print(f"Saved as: {filename}")
+    @traced("export")
+    def export_png(self):
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = f"pixel_art_{timestamp}.png"
+        frame = Project([self.frames[self.current_frame]], self.CANVAS_SIZE).snapshot().frames[0]
+        scale, method = self.export_scale, self.scale_filter
         
-        self.show_message("Export", f"PNG saved as:\n{filename}")
+        def task(job):
+            export.export_png(frame, filename, scale, method, job.report)
+            print(f"Saved as: {filename}")
+            return f"PNG saved as:\n{filename}"
+            
+        self.start_job("Export PNG", task)
         
-    def export_gif(self):
+    @traced("export")
+    def export_animation(self):
+        name = self.animation_format.upper()
         if len(self.frames) < 2:
-            self.show_message("Error", "Minimum 2 frames required for GIF!")
+            self.show_message("Error", f"Minimum 2 frames required for {name}!")
             return
             
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"animation_{timestamp}.gif"
-        
-        images = []
-        for frame in self.frames:
-            img_str = pygame.image.tostring(frame, 'RGB')
-            img = Image.frombytes('RGB', (self.CANVAS_WIDTH, self.CANVAS_WIDTH), img_str)
+        filename = f"animation_{timestamp}{export.ANIMATION_FORMATS[self.animation_format]}"
+        frames = self.current_project().snapshot().frames
+        scale, delays, fmt, method = self.export_scale, self.frame_delays(), self.animation_format, self.scale_filter
+        
+        def task(job):
+            export.export_animation(frames, filename, scale, delays, fmt, progress=job.report, method=method)
+            print(f"Animation saved as: {filename}")
+            return f"{name} saved as:\n{filename}"
             
-            small_img = Image.new('RGB', (self.CANVAS_SIZE, self.CANVAS_SIZE), (255, 255, 255))
-            
-            for x in range(self.CANVAS_SIZE):
-                for y in range(self.CANVAS_SIZE):
-                    pixel_color = frame.get_at((x * self.PIXEL_SIZE + self.PIXEL_SIZE // 2, y * self.PIXEL_SIZE + self.PIXEL_SIZE // 2))[:3]
-                    if pixel_color != (255, 255, 255):
-                        small_img.putpixel((x, y), pixel_color)
+        self.start_job(f"Export {name}", task)
+        
+    @traced("export")
+    def export_sheet(self):
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = f"sheet_{timestamp}.png"
+        frames = self.current_project().snapshot().frames
+        scale, delays, method = self.export_scale, self.frame_delays(), self.scale_filter
+        
+        def task(job):
+            sheet = build_atlas([("frame", frames, delays)], scale, method=method, progress=job.report)
+            image_name, meta_name = sheet.save(filename)
+            print(f"Sprite sheet saved as: {image_name} ({sheet.cells} unique of {len(frames)} frames)")
+            return f"Sprite sheet saved as:\n{image_name}\n{meta_name}"
             
-            scaled_img = small_img.resize((self.CANVAS_SIZE * 10, self.CANVAS_SIZE * 10), Image.NEAREST)
-            images.append(scaled_img)
+        self.start_job("Export sheet", task)
         
-        images[0].save(filename, save_all=True, append_images=images[1:], duration=1000//self.animation_speed, loop=0)
-        print(f"Animation saved as: {filename}")
-        self.show_message("Export", f"GIF saved as:\n{filename}")
+    def current_project(self):
+        return Project(self.frames, self.CANVAS_SIZE, self.PIXEL_SIZE, self.current_palette, self.indexed_palette)
         
+    @traced("export")
     def save_project(self):
-        project = {
-            "canvas_size": self.CANVAS_SIZE,
-            "pixel_size": self.PIXEL_SIZE,
-            "frames": [],
-            "palette": self.current_palette
-        }
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = f"project_{timestamp}.slp"
+        project = self.current_project().snapshot()
         
-        for frame in self.frames:
-            frame_data = []
-            for x in range(self.CANVAS_SIZE):
-                row = []
-                for y in range(self.CANVAS_SIZE):
-                    color = frame.get_at((x * self.PIXEL_SIZE + self.PIXEL_SIZE // 2, y * self.PIXEL_SIZE + self.PIXEL_SIZE // 2))[:3]
-                    row.append(list(color))
-                frame_data.append(row)
-            project["frames"].append(frame_data)
+        def task(job):
+            save_binary(filename, project, job.report, reattach=False)
+            print(f"Project saved: {filename}")
+            return f"Project saved:\n{filename}"
+            
+        self.start_job("Save", task)
         
+    @traced("export")
+    def export_json(self):
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"project_{timestamp}.json"
+        project = self.current_project().snapshot()
         
-        with open(filename, 'w') as f:
-            json.dump(project, f, indent=2)
-        print(f"Project saved: {filename}")
-        self.show_message("Save", f"Project saved:\n{filename}")
+        def task(job):
+            save_json(filename, project, job.report)
+            print(f"Project exported: {filename}")
+            return f"JSON saved as:\n{filename}"
+            
+        self.start_job("Export JSON", task)
+        
+    def start_job(self, name, task):
+        def run(job):
+            with self.profiler.span(name, "job"):
+                return task(job)
+                
+        job = self.jobs.submit(name, run)
+        self.update_job_ui()
+        return job
+        
+    def finish_job(self, job):
+        self.jobs.collect(job)
+        self.update_job_ui()
+        self.profiler.mark(job.name, status="cancelled" if job.cancelled else "failed" if job.error is not None else "done")
+        if job.cancelled:
+            print(f"{job.name} cancelled")
+            self.show_message(job.name, "Cancelled")
+        elif job.error is not None:
+            print(f"{job.name} error: {job.error}")
+            self.show_message("Error", f"{job.name} failed:\n{str(job.error)}")
+        else:
+            self.show_message(job.name, job.result)
+            
+    def update_job_ui(self):
+        job = self.jobs.current
+        if job is None:
+            if self.job_bar.visible:
+                self.job_bar.hide()
+                self.job_label.hide()
+                self.cancel_job_btn.hide()
+                self.renderer.invalidate()
+            return
+            
+        if not self.job_bar.visible:
+            self.job_bar.show()
+            self.job_label.show()
+            self.cancel_job_btn.show()
+        queued = len(self.jobs) - 1
+        self.set_text(self.job_label, f"{job.name}..." + (f" ({queued} queued)" if queued else ""))
+        percent = int(job.progress * 100)
+        if percent != int(self.job_bar.current_progress):
+            self.job_bar.set_current_progress(percent)
+        self.touch_ui()
         
     def load_project(self):
         import tkinter as tk
@@ -293,43 +1024,11 @@ class PixelArtEditor:
         
         root = tk.Tk()
         root.withdraw()
-        filename = filedialog.askopenfilename(title="Select project", filetypes=[("JSON files", "*.json"), ("All files", "*.*")])
+        filename = filedialog.askopenfilename(title="Select project", filetypes=[("SpriteLab projects", "*.slp"), ("JSON files", "*.json"), ("All files", "*.*")])
         
         if filename:
             try:
-                with open(filename, 'r') as f:
-                    project = json.load(f)
-                
-                if project["canvas_size"] != self.CANVAS_SIZE:
-                    self.CANVAS_SIZE = project["canvas_size"]
-                    self.PIXEL_SIZE = project["pixel_size"]
-                    self.CANVAS_WIDTH = self.CANVAS_SIZE * self.PIXEL_SIZE
-                    
-                    self.canvas_surface = pygame.Surface((self.CANVAS_WIDTH, self.CANVAS_WIDTH))
-                    self.canvas_rect = pygame.Rect(20, 20, self.CANVAS_WIDTH, self.CANVAS_WIDTH)
-                
-                self.frames = []
-                for frame_data in project["frames"]:
-                    frame_surface = pygame.Surface((self.CANVAS_WIDTH, self.CANVAS_WIDTH))
-                    frame_surface.fill((255, 255, 255))
-                    
-                    for x, row in enumerate(frame_data):
-                        for y, color in enumerate(row):
-                            if color != [255, 255, 255]:
-                                rect = pygame.Rect(x * self.PIXEL_SIZE, y * self.PIXEL_SIZE, self.PIXEL_SIZE, self.PIXEL_SIZE)
-                                pygame.draw.rect(frame_surface, color, rect)
-                    
-                    self.frames.append(frame_surface)
-                
-                self.canvas_surface = self.frames[0].copy()
-                self.current_frame = 0
-                self.frame_label.set_text(f"Frame: {self.current_frame + 1}/{len(self.frames)}")
-                
-                if "palette" in project:
-                    self.current_palette = project["palette"]
-                    self.palette_dropdown.selected_option = self.current_palette
-                
-                self.history = [self.canvas_surface.copy()]
+                self.open_project(read_project(filename))
                 print(f"Project loaded: {filename}")
                 self.show_message("Load", f"Project loaded:\n{os.path.basename(filename)}")
                 
@@ -337,92 +1036,208 @@ class PixelArtEditor:
                 print(f"Load error: {e}")
                 self.show_message("Error", f"Failed to load project:\n{str(e)}")
                 
+    def import_image(self):
+        import tkinter as tk
+        from tkinter import filedialog
+        
+        root = tk.Tk()
+        root.withdraw()
+        patterns = " ".join("*" + ext for ext in IMAGE_TYPES)
+        filename = filedialog.askopenfilename(title="Select image or animation", filetypes=[("Images", patterns), ("All files", "*.*")])
+        
+        if filename:
+            try:
+                count = self.import_file(filename)
+                print(f"Imported {count} frames: {filename}")
+                self.show_message("Import", f"Imported {count} frames from:\n{os.path.basename(filename)}")
+                
+            except Exception as e:
+                print(f"Import error: {e}")
+                self.show_message("Error", f"Failed to import image:\n{str(e)}")
+                
+    @traced("project")
+    def import_file(self, filename):
+        if self.active_layer().linked:
+            raise ValueError("Unlink the current layer before importing into it")
+        self.save_state()
+        size = self.CANVAS_SIZE
+        sheet = (size, size) if self.import_method == "sheet" else None
+        method = "nearest" if sheet else self.import_method
+        
+        template = self.frames[self.current_frame]
+        palette = self.indexed_palette
+        changes = []
+        index = self.current_frame + 1
+        for pixels, duration in import_frames(filename, size, method, sheet=sheet):
+            frame = template.blank_like()
+            layer = frame.layers[self.current_layer]
+            if palette is not None:
+                pixels = index_pixels(pixels, palette, self.dither)
+            layer.pixels = TiledFrame.from_array(pixels, layer.pixels.background, layer.pixels.tile_size)
+            frame.duration = duration
+            change = FrameInsert(index + len(changes), frame)
+            change.redo(self.frames)
+            changes.append(change)
+        self.history.push(changes)
+        if changes:
+            self.select_frame(index)
+        return len(changes)
+        
+    @traced("project")
+    def open_project(self, project):
+        self.CANVAS_SIZE = project.canvas_size
+        self.size_entry.set_text(str(self.CANVAS_SIZE))
+        self.frames = project.frames
+        self.current_frame = 0
+        self.current_layer = 0
+        self.indexed_palette = project.indexed
+        self.indexed_btn.set_text("RGB" if self.indexed_palette is None else "Indexed")
+        self.palette_surface = None
+        self.set_selection(None)
+        self.fit_view()
+        self.select_frame(0)
+        
+        if project.palette in self.palettes:
+            self.current_palette = project.palette
+            self.palette_dropdown.selected_option = self.current_palette
+            
+        self.reset_history()
+        
     def show_message(self, title, message):
         message_rect = pygame.Rect(0, 0, 400, 200)
         message_rect.center = (self.WIDTH // 2, self.HEIGHT // 2)
         
         message_box = pygame_gui.windows.UIMessageWindow(rect=message_rect, window_title=title, html_message=message, manager=self.manager)
+        self.touch_ui()
         
+    @traced("project")
     def add_frame(self):
-        new_frame = pygame.Surface((self.CANVAS_WIDTH, self.CANVAS_WIDTH))
-        new_frame.fill((255, 255, 255))
-        self.frames.append(new_frame)
-        self.current_frame = len(self.frames) - 1
-        self.canvas_surface = new_frame.copy()
-        self.frame_label.set_text(f"Frame: {self.current_frame + 1}/{len(self.frames)}")
-        self.save_state()
+        self.frames.append(self.frames[self.current_frame].blank_like())
+        self.history.push([FrameInsert(len(self.frames) - 1, self.frames[-1])])
+        self.select_frame(len(self.frames) - 1)
         
+    @traced("project")
     def remove_frame(self):
         if len(self.frames) > 1:
-            self.frames.pop(self.current_frame)
-            if self.current_frame >= len(self.frames):
-                self.current_frame = len(self.frames) - 1
-            self.canvas_surface = self.frames[self.current_frame].copy()
-            self.frame_label.set_text(f"Frame: {self.current_frame + 1}/{len(self.frames)}")
-            self.save_state()
+            self.history.push([FrameRemove(self.current_frame, self.frames.pop(self.current_frame))])
+            self.select_frame(min(self.current_frame, len(self.frames) - 1))
             
+    @traced("project")
     def change_canvas_size(self, new_size):
-        self.CANVAS_SIZE = new_size
-        self.CANVAS_WIDTH = self.CANVAS_SIZE * self.PIXEL_SIZE
+        self.CANVAS_SIZE = max(1, min(new_size, MAX_CANVAS_SIZE))
+        self.size_entry.set_text(str(self.CANVAS_SIZE))
         
-        self.canvas_surface = pygame.Surface((self.CANVAS_WIDTH, self.CANVAS_WIDTH))
-        self.canvas_surface.fill((255, 255, 255))
-        self.canvas_rect = pygame.Rect(20, 20, self.CANVAS_WIDTH, self.CANVAS_WIDTH)
-        
-        self.frames = [self.canvas_surface.copy()]
+        self.frames = [new_layered_frame(self.CANVAS_SIZE)]
         self.current_frame = 0
-        self.frame_label.set_text(f"Frame: {self.current_frame + 1}/{len(self.frames)}")
-        self.history = [self.canvas_surface.copy()]
+        self.current_layer = 0
+        self.indexed_palette = None
+        self.indexed_btn.set_text("RGB")
+        self.palette_surface = None
+        self.set_selection(None)
+        self.fit_view()
+        self.select_frame(0)
+        self.reset_history()
         
     def run(self):
-        clock = pygame.time.Clock()
+        clock = self.clock
         running = True
         animation_timer = 0
         
         while running:
-            time_delta = clock.tick(60) / 1000.0
-            
+            if self.is_animating or self.is_drawing or time.monotonic() < self.ui_active_until:
+                time_delta = clock.tick(ACTIVE_FPS) / 1000.0
+                events = pygame.event.get()
+            else:
+                event = pygame.event.wait(1000 // IDLE_FPS)
+                time_delta = clock.tick() / 1000.0
+                events = ([event] if event.type != pygame.NOEVENT else []) + pygame.event.get()
+            frame_start = time.perf_counter()
+                
             if self.is_animating and len(self.frames) > 1:
                 animation_timer += time_delta
-                if animation_timer >= 1.0 / self.animation_speed:
-                    animation_timer = 0
-                    self.current_frame = (self.current_frame + 1) % len(self.frames)
-                    self.canvas_surface = self.frames[self.current_frame].copy()
-                    self.frame_label.set_text(f"Frame: {self.current_frame + 1}/{len(self.frames)}")
+                delay = self.frame_delay(self.current_frame) / 1000.0
+                if animation_timer >= delay:
+                    animation_timer = min(animation_timer - delay, delay)
+                    self.select_frame((self.current_frame + 1) % len(self.frames))
             
-            for event in pygame.event.get():
+            events_start = time.perf_counter()
+            for event in events:
                 if event.type == pygame.QUIT:
                     running = False
                     
+                if event.type == JOB_DONE:
+                    self.finish_job(event.job)
+                    
                 self.manager.process_events(event)
                 
+                if not (hasattr(event, "pos") and self.canvas_rect.collidepoint(event.pos)):
+                    self.touch_ui()
+                    
+                if event.type in (pygame.WINDOWEXPOSED, pygame.WINDOWRESTORED, pygame_gui.UI_WINDOW_CLOSE):
+                    self.renderer.invalidate()
+                    
+                if event.type == pygame.MOUSEWHEEL and self.canvas_rect.collidepoint(pygame.mouse.get_pos()):
+                    self.zoom_at(pygame.mouse.get_pos(), 1 if event.y > 0 else -1)
+                    
+                if event.type == pygame.MOUSEBUTTONDOWN and event.button == 2 and self.canvas_rect.collidepoint(event.pos):
+                    self.pan_anchor = (event.pos, self.view_x, self.view_y)
+                elif event.type == pygame.MOUSEBUTTONUP and event.button == 2:
+                    self.pan_anchor = None
+                elif event.type == pygame.MOUSEMOTION and self.pan_anchor is not None:
+                    (anchor_x, anchor_y), view_x, view_y = self.pan_anchor
+                    self.set_view(view_x - (event.pos[0] - anchor_x) // self.PIXEL_SIZE, view_y - (event.pos[1] - anchor_y) // self.PIXEL_SIZE)
+                    
+                if event.type == pygame.MOUSEMOTION:
+                    hovered = self.swatch_at(event.pos)
+                    if hovered != self.hovered_swatch:
+                        self.hovered_swatch = hovered
+                        self.palette_surface = None
+                        
+                if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                    swatch = self.swatch_at(event.pos)
+                    if swatch is not None:
+                        self.select_swatch(swatch)
+                
                 if event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_z and (pygame.key.get_mods() & pygame.KMOD_CTRL):
                         self.undo()
+                    elif event.key == pygame.K_y and (pygame.key.get_mods() & pygame.KMOD_CTRL):
+                        self.redo()
                     elif event.key == pygame.K_s and (pygame.key.get_mods() & pygame.KMOD_CTRL):
                         self.export_png()
+                    elif event.key == pygame.K_a and (pygame.key.get_mods() & pygame.KMOD_CTRL):
+                        self.set_selection(np.ones((self.CANVAS_SIZE, self.CANVAS_SIZE), dtype=bool))
+                    elif event.key == pygame.K_ESCAPE:
+                        self.set_selection(None)
                     elif event.key == pygame.K_LEFT:
                         if self.current_frame > 0:
-                            self.current_frame -= 1
-                            self.canvas_surface = self.frames[self.current_frame].copy()
-                            self.frame_label.set_text(f"Frame: {self.current_frame + 1}/{len(self.frames)}")
+                            self.select_frame(self.current_frame - 1)
                     elif event.key == pygame.K_RIGHT:
                         if self.current_frame < len(self.frames) - 1:
-                            self.current_frame += 1
-                            self.canvas_surface = self.frames[self.current_frame].copy()
-                            self.frame_label.set_text(f"Frame: {self.current_frame + 1}/{len(self.frames)}")
+                            self.select_frame(self.current_frame + 1)
+                    elif event.key == pygame.K_UP:
+                        self.select_layer(self.current_layer + 1)
+                    elif event.key == pygame.K_DOWN:
+                        self.select_layer(self.current_layer - 1)
+                    elif event.key == pygame.K_LEFTBRACKET:
+                        self.set_brush_size(self.brush_size - 1)
+                    elif event.key == pygame.K_RIGHTBRACKET:
+                        self.set_brush_size(self.brush_size + 1)
+                    elif event.key == pygame.K_F3:
+                        self.toggle_hud()
+                    elif event.key == pygame.K_F4:
+                        self.save_trace()
                         
-                if event.type == pygame.MOUSEBUTTONDOWN and self.canvas_rect.collidepoint(event.pos):
+                if event.type == pygame.MOUSEBUTTONDOWN and event.button in (1, 3) and self.canvas_rect.collidepoint(event.pos):
                     x, y = self.get_pixel_pos(event.pos)
                     
                     if self.current_tool == "brush":
                         self.is_drawing = True
-                        self.draw_pixel(x, y)
-                        self.save_state()
+                        self.begin_stroke(x, y)
                         
                     elif self.current_tool == "fill":
-                        target_color = self.canvas_surface.get_at((x * self.PIXEL_SIZE + self.PIXEL_SIZE // 2, y * self.PIXEL_SIZE + self.PIXEL_SIZE // 2))[:3]
-                        self.flood_fill(x, y, target_color, self.current_color)
+                        self.begin_edit()
+                        self.flood_fill(x, y, self.draw_color())
                         self.save_state()
                         
                     elif self.current_tool == "line":
@@ -431,19 +1246,31 @@ class PixelArtEditor:
                         
                     elif self.current_tool == "erase":
                         self.is_drawing = True
-                        self.draw_pixel(x, y)
-                        self.save_state()
+                        self.begin_stroke(x, y)
+                        
+                    elif self.current_tool in ("select", "lasso"):
+                        self.is_drawing = True
+                        self.begin_selection(x, y)
+                        
+                    elif self.current_tool == "replace":
+                        self.replace_color(x, y)
                         
                 elif event.type == pygame.MOUSEMOTION and self.is_drawing:
-                    if self.current_tool in ["brush", "erase"]:
-                        x, y = self.get_pixel_pos(event.pos)
-                        self.draw_pixel(x, y)
+                    if self.stroke is not None:
+                        self.stroke_samples.append(self.get_pixel_pos(event.pos))
+                    elif self.selection_mode is not None:
+                        self.selection_points.append(self.get_pixel_pos(event.pos))
+                        self.selection_pending = True
                         
-                elif event.type == pygame.MOUSEBUTTONUP:
+                elif event.type == pygame.MOUSEBUTTONUP and event.button in (1, 3):
+                    self.end_stroke()
+                    if self.selection_mode is not None:
+                        self.end_selection()
                     if self.current_tool == "line" and self.is_drawing and self.last_pos:
                         x, y = self.get_pixel_pos(event.pos)
+                        self.begin_edit()
                         self.draw_line(self.last_pos, (x, y))
-                        self.save_state()
+                    self.save_state()
                     self.is_drawing = False
                     self.last_pos = None
                     
@@ -456,6 +1283,36 @@ class PixelArtEditor:
                         self.current_tool = "line"
                     elif event.ui_element == self.erase_btn:
                         self.current_tool = "erase"
+                    elif event.ui_element == self.select_btn:
+                        self.current_tool = "select"
+                    elif event.ui_element == self.lasso_btn:
+                        self.current_tool = "lasso"
+                    elif event.ui_element == self.replace_btn:
+                        self.current_tool = "replace"
+                    elif event.ui_element in self.transform_buttons:
+                        self.transform_command(event.ui_element)
+                    elif event.ui_element == self.scope_btn:
+                        self.transform_scope = transform.SCOPES[(transform.SCOPES.index(self.transform_scope) + 1) % len(transform.SCOPES)]
+                        self.scope_btn.set_text({"frame": "Frame", "range": "Range", "all": "All frames"}[self.transform_scope])
+                    elif event.ui_element == self.wrap_btn:
+                        self.shift_wrap = not self.shift_wrap
+                        self.wrap_btn.set_text("Wrap: on" if self.shift_wrap else "Wrap: off")
+                    elif event.ui_element == self.indexed_btn:
+                        self.toggle_indexed()
+                    elif event.ui_element == self.remap_btn:
+                        self.remap_to_palette()
+                    elif event.ui_element == self.dither_btn:
+                        self.dither = 0.0 if self.dither else 1.0
+                        self.dither_btn.set_text("Dither" if self.dither else "No dither")
+                    elif event.ui_element == self.brush_shape_btn:
+                        self.brush_shape = BRUSH_SHAPES[(BRUSH_SHAPES.index(self.brush_shape) + 1) % len(BRUSH_SHAPES)]
+                        self.brush_shape_btn.set_text(self.brush_shape.capitalize())
+                    elif event.ui_element == self.pixel_perfect_btn:
+                        self.pixel_perfect = not self.pixel_perfect
+                        self.pixel_perfect_btn.set_text("PP: on" if self.pixel_perfect else "PP: off")
+                    elif event.ui_element == self.fill_mode_btn:
+                        self.fill_contiguous = not self.fill_contiguous
+                        self.fill_mode_btn.set_text("Contiguous" if self.fill_contiguous else "Global")
                     elif event.ui_element == self.color_picker:
                         import tkinter as tk
                         from tkinter import colorchooser
@@ -463,18 +1320,39 @@ class PixelArtEditor:
                         root.withdraw()
                         color_code = colorchooser.askcolor(title="Choose color")
                         if color_code[0]:
-                            self.current_color = pygame.Color(color_code[0])
-                            self.update_color_picker()
+                            self.pick_color(color_code[0])
                     elif event.ui_element == self.export_png_btn:
                         self.export_png()
                     elif event.ui_element == self.export_gif_btn:
-                        self.export_gif()
+                        self.export_animation()
+                    elif event.ui_element == self.anim_format_btn:
+                        formats = list(export.ANIMATION_FORMATS)
+                        self.animation_format = formats[(formats.index(self.animation_format) + 1) % len(formats)]
+                        self.export_gif_btn.set_text({"gif": "GIF", "apng": "APNG", "webp": "WebP"}[self.animation_format])
+                    elif event.ui_element == self.scale_filter_btn:
+                        filters = list(FILTERS)
+                        self.scale_filter = filters[(filters.index(self.scale_filter) + 1) % len(filters)]
+                        self.scale_filter_btn.set_text({"nearest": "Nearest", "epx": "EPX", "xbr": "xBR"}[self.scale_filter])
+                    elif event.ui_element == self.export_json_btn:
+                        self.export_json()
+                    elif event.ui_element == self.export_sheet_btn:
+                        self.export_sheet()
                     elif event.ui_element == self.save_project_btn:
                         self.save_project()
                     elif event.ui_element == self.load_project_btn:
                         self.load_project()
+                    elif event.ui_element == self.cancel_job_btn:
+                        if self.jobs.current is not None:
+                            self.jobs.current.cancel()
+                    elif event.ui_element == self.import_btn:
+                        self.import_image()
+                    elif event.ui_element == self.import_method_btn:
+                        self.import_method = IMPORT_MODES[(IMPORT_MODES.index(self.import_method) + 1) % len(IMPORT_MODES)]
+                        self.import_method_btn.set_text(self.import_method.capitalize())
                     elif event.ui_element == self.undo_btn:
                         self.undo()
+                    elif event.ui_element == self.redo_btn:
+                        self.redo()
                     elif event.ui_element == self.add_frame_btn:
                         self.add_frame()
                     elif event.ui_element == self.remove_frame_btn:
@@ -482,67 +1360,71 @@ class PixelArtEditor:
                     elif event.ui_element == self.play_anim_btn:
                         self.is_animating = not self.is_animating
                         self.play_anim_btn.set_text("⏸ Stop" if self.is_animating else "▶ Play")
+                        self.render_canvas()
+                    elif event.ui_element == self.onion_btn:
+                        self.cycle_onion()
+                    elif event.ui_element == self.add_layer_btn:
+                        self.add_layer()
+                    elif event.ui_element == self.remove_layer_btn:
+                        self.remove_layer()
+                    elif event.ui_element == self.layer_up_btn:
+                        self.select_layer(self.current_layer + 1)
+                    elif event.ui_element == self.layer_down_btn:
+                        self.select_layer(self.current_layer - 1)
+                    elif event.ui_element == self.layer_visible_btn:
+                        self.set_layer_props(visible=not self.active_layer().visible)
+                    elif event.ui_element == self.link_layer_btn:
+                        self.toggle_link()
                     elif event.ui_element == self.size_16_btn:
                         self.change_canvas_size(16)
                     elif event.ui_element == self.size_32_btn:
                         self.change_canvas_size(32)
                         
+                if event.type == pygame_gui.UI_TEXT_ENTRY_FINISHED:
+                    if event.ui_element == self.size_entry and event.text.isdigit():
+                        self.change_canvas_size(int(event.text))
+                    elif event.ui_element == self.duration_entry:
+                        self.set_frame_duration(event.text)
+                        
                 if event.type == pygame_gui.UI_DROP_DOWN_MENU_CHANGED:
                     if event.ui_element == self.palette_dropdown:
                         self.current_palette = event.text
+                        self.palette_surface = None
+                    elif event.ui_element == self.layer_mode_dropdown:
+                        self.set_layer_props(mode=event.text)
                         
                 if event.type == pygame_gui.UI_HORIZONTAL_SLIDER_MOVED:
                     if event.ui_element == self.speed_slider:
                         self.animation_speed = int(event.value)
+                    elif event.ui_element == self.tolerance_slider:
+                        self.fill_tolerance = int(event.value)
+                    elif event.ui_element == self.scale_slider:
+                        self.export_scale = int(event.value)
+                        self.scale_label.set_text(f"Scale: {self.export_scale}x")
+                    elif event.ui_element == self.onion_slider:
+                        self.onion_opacity = int(event.value) / 100
+                        self.render_canvas()
+                    elif event.ui_element == self.opacity_slider:
+                        self.set_layer_props(opacity=int(event.value) / 100)
             
-            self.manager.update(time_delta)
-            
-            self.screen.fill(self.BG_COLOR)
-            
-            self.screen.blit(self.canvas_surface, self.canvas_rect)
-            
-            if self.PIXEL_SIZE >= 4:
-                for i in range(self.CANVAS_SIZE + 1):
-                    pygame.draw.line(self.screen, self.GRID_COLOR, (self.canvas_rect.x + i * self.PIXEL_SIZE, self.canvas_rect.y), (self.canvas_rect.x + i * self.PIXEL_SIZE, self.canvas_rect.y + self.CANVAS_WIDTH), 1)
-                    pygame.draw.line(self.screen, self.GRID_COLOR, (self.canvas_rect.x, self.canvas_rect.y + i * self.PIXEL_SIZE), (self.canvas_rect.x + self.CANVAS_WIDTH, self.canvas_rect.y + i * self.PIXEL_SIZE), 1)
-            
-            palette_x = self.CANVAS_WIDTH + 40
-            palette_y = self.HEIGHT - 150
-            pygame.draw.rect(self.screen, self.UI_BG_COLOR, (palette_x, palette_y, 400, 130))
-            
-            font = pygame.font.Font(None, 24)
-            text = font.render("Palette:", True, (255, 255, 255))
-            self.screen.blit(text, (palette_x + 10, palette_y + 10))
-            
-            colors = self.palettes[self.current_palette]
-            for i, color in enumerate(colors):
-                rect = pygame.Rect(palette_x + 10 + (i % 6) * 35, palette_y + 40 + (i // 6) * 35, 30, 30)
-                pygame.draw.rect(self.screen, color, rect)
-                pygame.draw.rect(self.screen, (100, 100, 100), rect, 1)
-                
-                mouse_pos = pygame.mouse.get_pos()
-                if rect.collidepoint(mouse_pos):
-                    pygame.draw.rect(self.screen, (255, 255, 255), rect, 2)
-                    if pygame.mouse.get_pressed()[0]:
-                        self.current_color = pygame.Color(color)
-                        self.update_color_picker()
-            
-            color_display = pygame.Rect(palette_x + 250, palette_y + 40, 60, 60)
-            pygame.draw.rect(self.screen, self.current_color, color_display)
-            pygame.draw.rect(self.screen, (200, 200, 200), color_display, 2)
-            
-            info_text = f"Tool: {self.current_tool} | Size: {self.CANVAS_SIZE}x{self.CANVAS_SIZE}"
-            text = font.render(info_text, True, (200, 200, 200))
-            self.screen.blit(text, (20, self.CANVAS_WIDTH + 30))
-            
-            hints = "Ctrl+Z: Undo | Arrows: Frames | LMB: Draw | RMB: Erase"
-            hint_text = font.render(hints, True, (150, 150, 150))
-            self.screen.blit(hint_text, (20, self.CANVAS_WIDTH + 60))
-            
-            self.manager.draw_ui(self.screen)
+            self.flush_stroke()
+            if self.selection_pending:
+                self.update_selection()
+            self.profiler.record("events", "frame", events_start, time.perf_counter(), {"count": len(events)})
             
-            pygame.display.flip()
+            with self.profiler.span("manager.update", "ui"):
+                self.manager.update(time_delta)
+            self.update_profiler()
+            if len(self.jobs):
+                self.update_job_ui()
+            with self.profiler.span("draw", "render"):
+                self.draw()
+            self.profiler.record("frame", "frame", frame_start, time.perf_counter())
             
+        if len(self.jobs):
+            print(f"Waiting for {len(self.jobs)} background jobs...")
+        self.jobs.shutdown()
+        self.journal.close()
         pygame.quit()
 
 if __name__ == "__main__":
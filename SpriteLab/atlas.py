@@ -0,0 +1,146 @@
+import json
+import math
+import os
+from xml.etree import ElementTree
+
+import numpy as np
+from PIL import Image
+
+from scaler import frame_hash, scale_frames
+
+
+def _fit(skyline, index, width, atlas_width):
+    x = skyline[index][0]
+    if x + width > atlas_width:
+        return None
+    y = 0
+    remaining = width
+    while remaining > 0:
+        if index >= len(skyline):
+            return None
+        y = max(y, skyline[index][1])
+        remaining -= skyline[index][2]
+        index += 1
+    return y
+
+
+def _place(skyline, index, x, y, width, height):
+    skyline.insert(index, [x, y + height, width])
+    end = x + width
+    i = index + 1
+    while i < len(skyline) and skyline[i][0] < end:
+        seg = skyline[i]
+        shrink = end - seg[0]
+        if seg[2] <= shrink:
+            del skyline[i]
+            continue
+        seg[0] += shrink
+        seg[2] -= shrink
+        break
+    i = 0
+    while i < len(skyline) - 1:
+        if skyline[i][1] == skyline[i + 1][1]:
+            skyline[i][2] += skyline[i + 1][2]
+            del skyline[i + 1]
+        else:
+            i += 1
+
+
+def pack_skyline(sizes, atlas_width):
+    skyline = [[0, 0, atlas_width]]
+    positions = [None] * len(sizes)
+    order = sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0]))
+    for i in order:
+        width, height = sizes[i]
+        best = None
+        for index in range(len(skyline)):
+            y = _fit(skyline, index, width, atlas_width)
+            if y is None:
+                continue
+            candidate = (y + height, skyline[index][0], index, y)
+            if best is None or candidate < best:
+                best = candidate
+        if best is None:
+            raise ValueError(f"Frame of width {width} does not fit an atlas {atlas_width} pixels wide")
+        _, x, index, y = best
+        positions[i] = (x, y)
+        _place(skyline, index, x, y, width, height)
+    return positions
+
+
+def next_power_of_two(value):
+    return 1 << max(0, math.ceil(math.log2(max(1, value))))
+
+
+class Atlas:
+    def __init__(self, image, frames, cells):
+        self.image = image
+        self.frames = frames
+        self.cells = cells
+    
+    def meta(self, image_name):
+        return {
+            "meta": {"image": image_name, "size": {"w": self.image.width, "h": self.image.height}, "cells": self.cells},
+            "frames": self.frames
+        }
+    
+    def save(self, filename, meta_format="json"):
+        self.image.save(filename)
+        meta_name = os.path.splitext(filename)[0] + "." + meta_format
+        image_name = os.path.basename(filename)
+        if meta_format == "json":
+            with open(meta_name, "w") as f:
+                json.dump(self.meta(image_name), f, indent=2)
+        elif meta_format == "xml":
+            root = ElementTree.Element("TextureAtlas", imagePath=image_name, width=str(self.image.width), height=str(self.image.height))
+            for frame in self.frames:
+                rect = frame["frame"]
+                ElementTree.SubElement(root, "SubTexture", name=frame["name"], x=str(rect["x"]), y=str(rect["y"]), width=str(rect["w"]), height=str(rect["h"]), duration=str(frame["duration"]))
+            ElementTree.ElementTree(root).write(meta_name, encoding="utf-8", xml_declaration=True)
+        else:
+            raise ValueError(f"Unknown metadata format: {meta_format}")
+        return filename, meta_name
+
+
+def build_atlas(sources, scale=1, padding=1, extrude=0, max_width=None, power_of_two=False, method="nearest", progress=None):
+    cells = []
+    cell_index = {}
+    frames = []
+    for name, source_frames, durations in sources:
+        if isinstance(durations, int):
+            durations = [durations] * len(source_frames)
+        for i, frame in enumerate(source_frames):
+            frame = np.asarray(frame)
+            key = frame_hash(frame)
+            if key not in cell_index:
+                cell_index[key] = len(cells)
+                cells.append(frame)
+            frames.append({"name": f"{name}_{i:04d}", "cell": cell_index[key], "duration": durations[i]})
+    
+    sizes = [(frame.shape[1] * scale + 2 * extrude + padding, frame.shape[0] * scale + 2 * extrude + padding) for frame in cells]
+    area = sum(w * h for w, h in sizes)
+    atlas_width = max_width or max(max(w for w, h in sizes), next_power_of_two(math.ceil(math.sqrt(area))))
+    positions = pack_skyline(sizes, atlas_width)
+    
+    width = max(x + w for (x, y), (w, h) in zip(positions, sizes)) - padding
+    height = max(y + h for (x, y), (w, h) in zip(positions, sizes)) - padding
+    if power_of_two:
+        width, height = next_power_of_two(width), next_power_of_two(height)
+    
+    total = 2 * len(cells)
+    report = None if progress is None else lambda done, count: progress(done, total)
+    pixels = np.zeros((height, width, 4), dtype=np.uint8)
+    rects = []
+    for i, (cell, (x, y)) in enumerate(zip(scale_frames(cells, method, scale, progress=report), positions)):
+        if extrude:
+            cell = np.pad(cell, ((extrude, extrude), (extrude, extrude), (0, 0)), mode="edge")
+        h, w = cell.shape[:2]
+        pixels[y:y + h, x:x + w, :3] = cell
+        pixels[y:y + h, x:x + w, 3] = 255
+        rects.append({"x": x + extrude, "y": y + extrude, "w": w - 2 * extrude, "h": h - 2 * extrude})
+        if progress is not None:
+            progress(len(cells) + i + 1, total)
+    
+    for frame in frames:
+        frame["frame"] = rects[frame["cell"]]
+    return Atlas(Image.fromarray(pixels, "RGBA"), frames, len(cells))
@@ -0,0 +1,295 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import numpy as np
+
+import export
+import scaler
+import transform
+from layers import LayeredFrame
+from project import load_project, save_binary
+
+CANVAS_SIZES = (16, 64, 256, 512)
+FRAME_COUNTS = (1, 50, 500)
+MAX_SWEEP_PIXELS = 64 * 1024 * 1024
+DEFAULT_BASELINE = "bench_baseline.json"
+DEFAULT_TOLERANCE = 0.25
+MIN_TIME_DELTA = 0.001
+MIN_PEAK_DELTA = 256 * 1024
+TARGET_TIME = 0.2
+PIXEL_OPS = 1000
+STROKE_POINTS = 256
+COLORS = ((0, 0, 0), (255, 0, 0), (0, 128, 255), (255, 255, 0))
+
+
+def sample_frames(size, count, seed=0):
+    rng = np.random.default_rng(seed)
+    block = max(1, size // 8)
+    cells = rng.integers(0, len(COLORS), (size // block + 1, size // block + 1))
+    pattern = np.asarray(COLORS, dtype=np.uint8)[cells].repeat(block, axis=0).repeat(block, axis=1)[:size, :size]
+    return [LayeredFrame.from_array(np.roll(pattern, i, axis=1)) for i in range(count)]
+
+
+def stroke_path(size, count=STROKE_POINTS):
+    angles = np.linspace(0, 4 * np.pi, count)
+    radius = (size - 1) / 2
+    xs = np.rint(radius + radius * np.cos(angles) * np.linspace(1, 0.2, count)).astype(int)
+    ys = np.rint(radius + radius * np.sin(angles) * np.linspace(1, 0.2, count)).astype(int)
+    return list(zip(xs.tolist(), ys.tolist()))
+
+
+def bench_draw_pixel(editor, workdir):
+    rng = np.random.default_rng(1)
+    points = rng.integers(0, editor.CANVAS_SIZE, (PIXEL_OPS, 2)).tolist()
+    colors = [COLORS[i % len(COLORS)] for i in range(PIXEL_OPS)]
+    
+    def run():
+        for (x, y), color in zip(points, colors):
+            editor.draw_pixel(x, y, color)
+    return run
+
+
+def bench_brush_stroke(editor, workdir):
+    path = stroke_path(editor.CANVAS_SIZE)
+    
+    def run():
+        editor.begin_stroke(*path[0])
+        editor.stroke_samples.extend(path[1:])
+        editor.end_stroke()
+        editor.save_state()
+    return run
+
+
+def bench_draw_line(editor, workdir):
+    end = editor.CANVAS_SIZE - 1
+    
+    def run():
+        editor.draw_line((0, 0), (end, end))
+        editor.draw_line((0, end), (end, 0))
+    return run
+
+
+def bench_flood_fill(editor, workdir):
+    turn = [0]
+    
+    def run():
+        turn[0] += 1
+        editor.begin_edit()
+        editor.flood_fill(0, 0, COLORS[turn[0] % len(COLORS)])
+        editor.save_state()
+    return run
+
+
+def bench_undo(editor, workdir):
+    path = stroke_path(editor.CANVAS_SIZE)
+    
+    def run():
+        editor.begin_edit()
+        for x, y in path:
+            editor.draw_pixel(x, y)
+        editor.save_state()
+        editor.undo()
+    return run
+
+
+def bench_flip_frames(editor, workdir):
+    editor.transform_scope = "all"
+    
+    def run():
+        editor.apply_transform(transform.flip, True)
+    return run
+
+
+def bench_export_png(editor, workdir):
+    filename = os.path.join(workdir, "frame.png")
+    
+    def run():
+        export.export_png(editor.frames[editor.current_frame], filename, editor.export_scale)
+    return run
+
+
+def bench_export_gif(editor, workdir):
+    if len(editor.frames) < 2:
+        return None
+    filename = os.path.join(workdir, "animation.gif")
+    
+    def run():
+        export.export_gif(editor.frames, filename, editor.export_scale, editor.frame_delays())
+    return run
+
+
+def bench_upscale_frames(editor, workdir):
+    scale = max(editor.export_scale, 2)
+    
+    def run():
+        scaler.scale_frames(editor.frames, editor.scale_filter, scale, cache=None)
+    return run
+
+
+def bench_save_project(editor, workdir):
+    filename = os.path.join(workdir, "project.slp")
+    
+    def run():
+        save_binary(filename, editor.current_project())
+    return run
+
+
+def bench_load_project(editor, workdir):
+    filename = save_binary(os.path.join(workdir, "load.slp"), editor.current_project())
+    
+    def run():
+        editor.open_project(load_project(filename))
+        for frame in editor.frames:
+            np.asarray(frame)
+    return run
+
+
+BENCHMARKS = {
+    "draw_pixel": (bench_draw_pixel, False),
+    "brush_stroke": (bench_brush_stroke, False),
+    "draw_line": (bench_draw_line, False),
+    "flood_fill": (bench_flood_fill, False),
+    "save_state_undo": (bench_undo, False),
+    "flip_frames": (bench_flip_frames, True),
+    "export_png": (bench_export_png, False),
+    "export_gif": (bench_export_gif, True),
+    "upscale_frames": (bench_upscale_frames, True),
+    "save_project": (bench_save_project, True),
+    "load_project": (bench_load_project, True),
+}
+
+
+def settle(editor):
+    for job in list(editor.journal.jobs.jobs):
+        job.future.result()
+
+
+def measure(run, repeat, before=None):
+    run()
+    times = []
+    started = time.perf_counter()
+    while len(times) < repeat and (len(times) < 1 or time.perf_counter() - started < TARGET_TIME):
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"time": min(times), "median": float(np.median(times)), "runs": len(times), "peak": peak}
+
+
+def cases(names, sizes, counts):
+    for name in names:
+        sweeps_frames = BENCHMARKS[name][1]
+        for size in sizes:
+            for count in (counts if sweeps_frames else (1,)):
+                yield name, size, count
+
+
+def run_benchmarks(names, sizes, counts, scale=1, repeat=5, baseline=None, method="xbr"):
+    from SpriyeLab import PixelArtEditor
+    
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        editor = PixelArtEditor(autosave=os.path.join(workdir, "autosave"))
+        editor.export_scale = scale
+        editor.scale_filter = method
+        for name, size, count in cases(names, sizes, counts):
+            key = f"{name}/{size}/{count}"
+            if size * size * count > MAX_SWEEP_PIXELS:
+                print(f"{key:<28} skipped (over {MAX_SWEEP_PIXELS // (1024 * 1024)}M pixels)")
+                continue
+            editor.change_canvas_size(size)
+            editor.frames = sample_frames(size, count)
+            editor.select_frame(0)
+            editor.reset_history()
+            run = BENCHMARKS[name][0](editor, workdir)
+            if run is None:
+                continue
+            results[key] = measure(run, repeat, lambda: settle(editor))
+            print(format_result(key, results[key], (baseline or {}).get(key)), flush=True)
+        editor.journal.close()
+    return results
+
+
+def format_result(key, result, baseline=None):
+    line = f"{key:<28} {result['time'] * 1000:>10.3f} ms  {result['peak'] / 1024:>10.1f} KB"
+    if baseline is not None:
+        line += f"  ({ratio(result['time'], baseline['time']):+.0%} time, {ratio(result['peak'], baseline['peak']):+.0%} memory)"
+    return line
+
+
+def ratio(value, base):
+    return value / base - 1 if base else 0.0
+
+
+def regressions(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    failed = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        if result["time"] > base["time"] * (1 + tolerance) and result["time"] - base["time"] > MIN_TIME_DELTA:
+            failed.append(f"{key}: time {base['time'] * 1000:.3f} ms -> {result['time'] * 1000:.3f} ms")
+        if result["peak"] > base["peak"] * (1 + tolerance) and result["peak"] - base["peak"] > MIN_PEAK_DELTA:
+            failed.append(f"{key}: peak memory {base['peak'] // 1024} KB -> {result['peak'] // 1024} KB")
+    return failed
+
+
+def read_baseline(filename):
+    with open(filename, "r") as f:
+        return json.load(f)["results"]
+
+
+def write_baseline(filename, results, merge=True):
+    if merge and os.path.exists(filename):
+        results = {**read_baseline(filename), **results}
+    data = {
+        "meta": {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(), "created": time.strftime("%Y-%m-%d %H:%M:%S")},
+        "results": dict(sorted(results.items()))
+    }
+    with open(filename, "w") as f:
+        json.dump(data, f, indent=2)
+    return filename
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="bench", description="Benchmark SpriteLab editor operations headless and check them against a baseline")
+    parser.add_argument("-b", "--bench", nargs="+", choices=tuple(BENCHMARKS), default=list(BENCHMARKS), help="Benchmarks to run")
+    parser.add_argument("-s", "--sizes", nargs="+", type=int, default=list(CANVAS_SIZES), help="Canvas sizes to sweep")
+    parser.add_argument("-f", "--frames", nargs="+", type=int, default=list(FRAME_COUNTS), help="Frame counts to sweep for whole-animation operations")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Timed runs per case; the fastest one is reported")
+    parser.add_argument("--scale", type=int, default=1, help="Export scale factor")
+    parser.add_argument("--filter", choices=tuple(scaler.FILTERS), default="xbr", help="Upscaling filter for upscale_frames (scale 1 runs at 2x)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline file to compare against and save to")
+    parser.add_argument("--save", action="store_true", help="Save the results as the new baseline")
+    parser.add_argument("-t", "--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Allowed slowdown or memory growth before a case fails")
+    args = parser.parse_args(argv)
+    
+    baseline = read_baseline(args.baseline) if os.path.exists(args.baseline) and not args.save else {}
+    results = run_benchmarks(args.bench, args.sizes, args.frames, args.scale, max(1, args.repeat), baseline, args.filter)
+    
+    if args.save:
+        print(f"Baseline saved: {write_baseline(args.baseline, results)}")
+        return 0
+    failed = regressions(results, baseline, args.tolerance)
+    for line in failed:
+        print(f"REGRESSION {line}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
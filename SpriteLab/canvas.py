@@ -0,0 +1,228 @@
+import itertools
+
+import numpy as np
+
+WHITE = (255, 255, 255)
+TILE_SIZE = 64
+MAX_CANVAS_SIZE = 2048
+
+_serials = itertools.count(1)
+
+
+def to_color(color, channels=3):
+    color = tuple(int(c) for c in tuple(color))
+    if len(color) < channels:
+        color += (255,) * (channels - len(color))
+    return color[:channels]
+
+
+class TiledFrame:
+    def __init__(self, width, height, background=WHITE, tile_size=TILE_SIZE):
+        self.width = width
+        self.height = height
+        self.background = tuple(int(c) for c in background)
+        self.tile_size = tile_size
+        self.tiles = {}
+        self.versions = {}
+        self.revision = 0
+        self.serial = next(_serials)
+    
+    @property
+    def channels(self):
+        return len(self.background)
+    
+    @property
+    def shape(self):
+        return (self.height, self.width, self.channels)
+    
+    @property
+    def nbytes(self):
+        return sum(tile.nbytes for tile in self.tiles.values())
+    
+    def __array__(self, dtype=None, copy=None):
+        array = self.read(0, 0, self.width, self.height)
+        return array if dtype is None else array.astype(dtype)
+    
+    @classmethod
+    def from_array(cls, array, background=WHITE, tile_size=TILE_SIZE):
+        frame = cls(array.shape[1], array.shape[0], background, tile_size)
+        bg = np.array(frame.background, dtype=np.uint8)
+        for ty in range(0, frame.height, tile_size):
+            for tx in range(0, frame.width, tile_size):
+                block = array[ty:ty + tile_size, tx:tx + tile_size]
+                if np.any(block != bg):
+                    frame.tiles[(tx // tile_size, ty // tile_size)] = np.array(block, dtype=np.uint8)
+        return frame
+    
+    def copy(self):
+        frame = TiledFrame(self.width, self.height, self.background, self.tile_size)
+        frame.tiles = {key: tile.copy() for key, tile in self.tiles.items()}
+        return frame
+    
+    def tile_bounds(self, key):
+        x0 = key[0] * self.tile_size
+        y0 = key[1] * self.tile_size
+        return x0, y0, min(x0 + self.tile_size, self.width), min(y0 + self.tile_size, self.height)
+    
+    def tile(self, key, create=False):
+        tile = self.tiles.get(key)
+        if tile is None and create:
+            x0, y0, x1, y1 = self.tile_bounds(key)
+            tile = np.empty((y1 - y0, x1 - x0, self.channels), dtype=np.uint8)
+            tile[:] = self.background
+            self.tiles[key] = tile
+        if create:
+            self.versions[key] = self.revision = next(_serials)
+        return tile
+    
+    def tile_keys(self, x0=0, y0=0, x1=None, y1=None):
+        x1 = self.width if x1 is None else x1
+        y1 = self.height if y1 is None else y1
+        t = self.tile_size
+        for ty in range(y0 // t, (y1 - 1) // t + 1):
+            for tx in range(x0 // t, (x1 - 1) // t + 1):
+                yield (tx, ty)
+    
+    def read(self, x0, y0, x1, y1):
+        region = np.empty((y1 - y0, x1 - x0, self.channels), dtype=np.uint8)
+        region[:] = self.background
+        if x1 <= x0 or y1 <= y0:
+            return region
+        for key in self.tile_keys(x0, y0, x1, y1):
+            tile = self.tiles.get(key)
+            if tile is None:
+                continue
+            tx0, ty0, tx1, ty1 = self.tile_bounds(key)
+            ix0, iy0, ix1, iy1 = max(x0, tx0), max(y0, ty0), min(x1, tx1), min(y1, ty1)
+            region[iy0 - y0:iy1 - y0, ix0 - x0:ix1 - x0] = tile[iy0 - ty0:iy1 - ty0, ix0 - tx0:ix1 - tx0]
+        return region
+    
+    def write(self, x0, y0, array):
+        x1 = min(self.width, x0 + array.shape[1])
+        y1 = min(self.height, y0 + array.shape[0])
+        x0c, y0c = max(0, x0), max(0, y0)
+        if x1 <= x0c or y1 <= y0c:
+            return
+        bg = np.array(self.background, dtype=np.uint8)
+        for key in self.tile_keys(x0c, y0c, x1, y1):
+            tx0, ty0, tx1, ty1 = self.tile_bounds(key)
+            ix0, iy0, ix1, iy1 = max(x0c, tx0), max(y0c, ty0), min(x1, tx1), min(y1, ty1)
+            block = array[iy0 - y0:iy1 - y0, ix0 - x0:ix1 - x0]
+            if key not in self.tiles and not np.any(block != bg):
+                continue
+            self.tile(key, create=True)[iy0 - ty0:iy1 - ty0, ix0 - tx0:ix1 - tx0] = block
+    
+    def get_pixel(self, x, y):
+        tile = self.tiles.get((x // self.tile_size, y // self.tile_size))
+        if tile is None:
+            return self.background
+        return to_color(tile[y % self.tile_size, x % self.tile_size], self.channels)
+    
+    def set_pixel(self, x, y, color):
+        key = (x // self.tile_size, y // self.tile_size)
+        color = to_color(color, self.channels)
+        if key not in self.tiles and color == self.background:
+            return
+        self.tile(key, create=True)[y % self.tile_size, x % self.tile_size] = color
+    
+    def write_mask(self, mask, color, x=0, y=0):
+        rows = np.flatnonzero(mask.any(axis=1))
+        cols = np.flatnonzero(mask.any(axis=0))
+        if not len(rows):
+            return
+        color = to_color(color, self.channels)
+        h, w = mask.shape
+        for key in self.tile_keys(x + int(cols[0]), y + int(rows[0]), x + int(cols[-1]) + 1, y + int(rows[-1]) + 1):
+            x0, y0, x1, y1 = self.tile_bounds(key)
+            ix0, iy0, ix1, iy1 = max(x0, x), max(y0, y), min(x1, x + w), min(y1, y + h)
+            sub = mask[iy0 - y:iy1 - y, ix0 - x:ix1 - x]
+            if sub.any() and (key in self.tiles or color != self.background):
+                self.tile(key, create=True)[iy0 - y0:iy1 - y0, ix0 - x0:ix1 - x0][sub] = color
+    
+    def _group(self, indices):
+        ys, xs = np.divmod(indices, self.width)
+        t = self.tile_size
+        tile_ids = (ys // t) * ((self.width + t - 1) // t) + xs // t
+        order = np.argsort(tile_ids, kind="stable")
+        tile_ids = tile_ids[order]
+        splits = np.flatnonzero(np.diff(tile_ids)) + 1
+        for group in np.split(order, splits):
+            if len(group):
+                key = (int(xs[group[0]]) // t, int(ys[group[0]]) // t)
+                yield key, group, ys[group] - key[1] * t, xs[group] - key[0] * t
+    
+    def take(self, indices):
+        values = np.empty((len(indices), self.channels), dtype=np.uint8)
+        values[:] = self.background
+        for key, group, ly, lx in self._group(indices):
+            tile = self.tiles.get(key)
+            if tile is not None:
+                values[group] = tile[ly, lx]
+        return values
+    
+    def put(self, indices, values):
+        for key, group, ly, lx in self._group(indices):
+            self.tile(key, create=True)[ly, lx] = values[group]
+    
+    def diff(self, other):
+        indices, old, new = [], [], []
+        for key in sorted(set(self.tiles) | set(other.tiles)):
+            x0, y0, x1, y1 = self.tile_bounds(key)
+            a = self.tiles.get(key)
+            b = other.tiles.get(key)
+            if a is None:
+                a = self.read(x0, y0, x1, y1)
+            if b is None:
+                b = other.read(x0, y0, x1, y1)
+            ly, lx = np.nonzero(np.any(a != b, axis=-1))
+            if len(ly):
+                indices.append((ly + y0) * self.width + lx + x0)
+                old.append(a[ly, lx])
+                new.append(b[ly, lx])
+        if not indices:
+            return None
+        return np.concatenate(indices).astype(np.int32), np.concatenate(old), np.concatenate(new)
+
+
+def in_bounds(frame, x, y):
+    return 0 <= x < frame.shape[1] and 0 <= y < frame.shape[0]
+
+
+def set_pixel(frame, x, y, color):
+    if in_bounds(frame, x, y):
+        frame.set_pixel(x, y, color)
+        return True
+    return False
+
+
+def line_points(start, end):
+    x1, y1 = start
+    x2, y2 = end
+    
+    dx = abs(x2 - x1)
+    dy = abs(y2 - y1)
+    sx = 1 if x1 < x2 else -1
+    sy = 1 if y1 < y2 else -1
+    err = dx - dy
+    
+    points = []
+    while True:
+        points.append((x1, y1))
+        if x1 == x2 and y1 == y2:
+            break
+        e2 = 2 * err
+        if e2 > -dy:
+            err -= dy
+            x1 += sx
+        if e2 < dx:
+            err += dx
+            y1 += sy
+    return points
+
+
+def frame_to_columns(frame):
+    return np.asarray(frame).swapaxes(0, 1).tolist()
+
+
+def frame_from_columns(columns):
+    return TiledFrame.from_array(np.array(columns, dtype=np.uint8).reshape(len(columns), -1, 3).swapaxes(0, 1))
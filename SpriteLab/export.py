@@ -0,0 +1,248 @@
+import io
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import GifImagePlugin, Image
+
+from scaler import scale_frame
+
+DEFAULT_SCALE = 10
+ANIMATION_FORMATS = {"gif": ".gif", "apng": ".png", "webp": ".webp"}
+MAX_COLORS = 255
+PALETTE_SAMPLES = 1 << 20
+MAX_OUTPUT_PIXELS = 1 << 28
+MAX_SIDE = {"png": 0x7FFFFFFF, "gif": 0xFFFF, "apng": 0x7FFFFFFF, "webp": 16383}
+
+
+def check_output_size(shape, scale, fmt):
+    width, height = shape[1] * scale, shape[0] * scale
+    if max(width, height) > MAX_SIDE[fmt]:
+        raise ValueError(f"{fmt.upper()} output is limited to {MAX_SIDE[fmt]} pixels per side, got {width}x{height}; lower the scale")
+    if width * height > MAX_OUTPUT_PIXELS:
+        raise ValueError(f"Output of {width}x{height} pixels exceeds the {MAX_OUTPUT_PIXELS // (1 << 20)}M pixel limit; lower the scale")
+
+
+def frame_to_image(frame, scale=1, method="nearest"):
+    frame = np.asarray(frame)
+    if method != "nearest":
+        frame, scale = scale_frame(frame, method, scale), 1
+    img = Image.fromarray(frame, 'RGB')
+    if scale != 1:
+        img = img.resize((frame.shape[1] * scale, frame.shape[0] * scale), Image.NEAREST)
+    return img
+
+
+def encode_frames(frames, encode, workers=None, progress=None):
+    results = []
+    if len(frames) < 2:
+        for frame in frames:
+            results.append(encode(frame))
+            if progress is not None:
+                progress(len(results), len(frames))
+        return results
+    pool = ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) + 4))
+    try:
+        for result in pool.map(encode, frames):
+            results.append(result)
+            if progress is not None:
+                progress(len(results), len(frames))
+    finally:
+        pool.shutdown(cancel_futures=True)
+    return results
+
+
+def export_png(frame, filename, scale=DEFAULT_SCALE, method="nearest", progress=None):
+    check_output_size(frame.shape, scale, "png")
+    img = frame_to_image(frame, scale, method)
+    if progress is not None:
+        progress(1, 2)
+    img.save(filename)
+    if progress is not None:
+        progress(2, 2)
+    return filename
+
+
+def pack_rgb(array):
+    array = np.asarray(array, dtype=np.uint32)
+    return (array[..., 0] << 16) | (array[..., 1] << 8) | array[..., 2]
+
+
+def unpack_rgb(keys):
+    return np.stack([(keys >> 16) & 255, (keys >> 8) & 255, keys & 255], axis=-1).astype(np.uint8)
+
+
+def frame_colors(frame):
+    return np.unique(pack_rgb(frame), return_counts=True)
+
+
+def merge_colors(results):
+    keys = np.concatenate([keys for keys, _ in results])
+    counts = np.concatenate([counts for _, counts in results])
+    keys, inverse = np.unique(keys, return_inverse=True)
+    return keys, np.bincount(inverse, counts).astype(np.int64)
+
+
+def build_palette(keys, counts, max_colors=MAX_COLORS):
+    colors = unpack_rgb(keys)
+    if len(colors) <= max_colors:
+        return colors, np.arange(len(colors), dtype=np.uint8)
+    repeats = np.maximum(1, np.rint(counts * (PALETTE_SAMPLES / counts.sum()))).astype(np.intp)
+    sample = Image.fromarray(np.repeat(colors, repeats, axis=0)[None], "RGB").quantize(max_colors, Image.Quantize.MEDIANCUT)
+    palette = np.array(sample.getpalette()[:max_colors * 3], dtype=np.int32).reshape(-1, 3)[np.unique(np.asarray(sample))]
+    lut = np.empty(len(colors), dtype=np.uint8)
+    for start in range(0, len(colors), 4096):
+        chunk = colors[start:start + 4096].astype(np.int32)
+        lut[start:start + 4096] = (((chunk[:, None] - palette[None]) ** 2).sum(axis=-1)).argmin(axis=1)
+    return palette.astype(np.uint8), lut
+
+
+def index_frame(frame, keys, lut):
+    return lut[np.searchsorted(keys, pack_rgb(frame))]
+
+
+def frame_delays(duration, count):
+    if isinstance(duration, (int, float)):
+        return [duration] * count
+    return list(duration)
+
+
+def merge_frames(indexed, delays):
+    pending, total = None, 0
+    for frame, delay in zip(indexed, delays):
+        if pending is not None and np.array_equal(frame, pending):
+            total += delay
+            continue
+        if pending is not None:
+            yield pending, total
+        pending, total = frame, delay
+    if pending is not None:
+        yield pending, total
+
+
+def changed_box(previous, frame):
+    if previous is None:
+        return np.ones(frame.shape, dtype=bool), (0, 0, frame.shape[1], frame.shape[0])
+    diff = previous != frame
+    rows = np.flatnonzero(diff.any(axis=1))
+    if not len(rows):
+        return diff, (0, 0, 1, 1)
+    cols = np.flatnonzero(diff.any(axis=0))
+    return diff, (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+
+
+def upscale(array, scale):
+    if scale == 1:
+        return array
+    return array.repeat(scale, axis=0).repeat(scale, axis=1)
+
+
+def write_gif(f, frames, size, palette, scale=1, loop=0):
+    bits = max(1, int(len(palette)).bit_length())
+    table = np.zeros((1 << bits, 3), dtype=np.uint8)
+    table[:len(palette)] = palette
+    transparent = len(palette)
+    width, height = size[0] * scale, size[1] * scale
+    f.write(b"GIF89a" + struct.pack("<HHBBB", width, height, 0xF0 | (bits - 1), 0, 0) + table.tobytes())
+    f.write(b"!\xff\x0bNETSCAPE2.0\x03\x01" + struct.pack("<H", loop) + b"\x00")
+    
+    previous, elapsed, written = None, 0, 0
+    for frame, delay in frames:
+        diff, (x0, y0, x1, y1) = changed_box(previous, frame)
+        crop = frame[y0:y1, x0:x1].copy()
+        params = {"disposal": 1}
+        if previous is not None:
+            crop[~diff[y0:y1, x0:x1]] = transparent
+            params["transparency"] = transparent
+        elapsed += delay
+        centiseconds = round(elapsed / 10) - written
+        written += centiseconds
+        params["duration"] = centiseconds * 10
+        image = Image.fromarray(upscale(crop, scale), "P")
+        for chunk in GifImagePlugin.getdata(image, (x0 * scale, y0 * scale), **params):
+            f.write(chunk)
+        previous = frame
+    f.write(b";")
+
+
+def png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def write_apng(f, frames, size, palette, scale=1, loop=0):
+    width, height = size[0] * scale, size[1] * scale
+    f.write(b"\x89PNG\r\n\x1a\n" + png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0)))
+    control = f.tell()
+    f.write(png_chunk(b"acTL", struct.pack(">II", 0, loop)) + png_chunk(b"PLTE", palette.tobytes()))
+    
+    previous, sequence, delays = None, 0, []
+    for frame, delay in frames:
+        _, (x0, y0, x1, y1) = changed_box(previous, frame)
+        crop = upscale(frame[y0:y1, x0:x1], scale)
+        rows = np.zeros((crop.shape[0], crop.shape[1] + 1), dtype=np.uint8)
+        rows[:, 1:] = crop
+        numerator, denominator = (delay, 1000) if delay <= 0xFFFF else (min(round(delay / 10), 0xFFFF), 100)
+        f.write(png_chunk(b"fcTL", struct.pack(">IIIIIHHBB", sequence, crop.shape[1], crop.shape[0], x0 * scale, y0 * scale, numerator, denominator, 0, 0)))
+        data = zlib.compress(rows.tobytes(), 6)
+        if previous is None:
+            f.write(png_chunk(b"IDAT", data))
+            sequence += 1
+        else:
+            f.write(png_chunk(b"fdAT", struct.pack(">I", sequence + 1) + data))
+            sequence += 2
+        delays.append(delay)
+        previous = frame
+    f.write(png_chunk(b"IEND", b""))
+    end = f.tell()
+    f.seek(control)
+    f.write(png_chunk(b"acTL", struct.pack(">II", len(delays), loop)))
+    f.seek(end)
+    return delays
+
+
+def export_animation(frames, filename, scale=DEFAULT_SCALE, duration=200, fmt=None, workers=None, progress=None, method="nearest"):
+    fmt = fmt or ("webp" if filename.lower().endswith(".webp") else "apng" if filename.lower().endswith((".png", ".apng")) else "gif")
+    if fmt not in ANIMATION_FORMATS:
+        raise ValueError(f"Unknown animation format: {fmt}")
+    total = 2 * len(frames)
+    report = None if progress is None else lambda done, count: progress(done, total)
+    factor, scale = (scale, 1) if method != "nearest" else (1, scale)
+    check_output_size(frames[0].shape, factor * scale, fmt)
+    
+    def scaled(frame):
+        return scale_frame(np.asarray(frame), method, factor)
+    keys, counts = merge_colors(encode_frames(frames, lambda frame: frame_colors(scaled(frame)), workers, report))
+    palette, lut = build_palette(keys, counts)
+    
+    def indexed():
+        for i, frame in enumerate(frames):
+            yield index_frame(scaled(frame), keys, lut)
+            if progress is not None:
+                progress(len(frames) + i + 1, total)
+    merged = merge_frames(indexed(), frame_delays(duration, len(frames)))
+    
+    size = (frames[0].shape[1] * factor, frames[0].shape[0] * factor)
+    if fmt == "webp":
+        buffer = io.BytesIO()
+        delays = write_apng(buffer, merged, size, palette, scale)
+        buffer.seek(0)
+        with Image.open(buffer) as animation:
+            animation.save(filename, "WEBP", save_all=True, duration=delays, loop=0, lossless=True, quality=80, method=4)
+        return filename
+    with open(filename, "wb") as f:
+        try:
+            if fmt == "gif":
+                write_gif(f, merged, size, palette, scale)
+            else:
+                write_apng(f, merged, size, palette, scale)
+        except BaseException:
+            f.close()
+            os.remove(filename)
+            raise
+    return filename
+
+
+def export_gif(frames, filename, scale=DEFAULT_SCALE, duration=200, workers=None, progress=None, method="nearest"):
+    return export_animation(frames, filename, scale, duration, "gif", workers, progress, method)
@@ -0,0 +1,62 @@
+import numpy as np
+
+from canvas import to_color, in_bounds
+
+
+def color_match(frame, color, tolerance=0):
+    if tolerance <= 0:
+        return np.all(frame == np.array(to_color(color, frame.shape[-1]), dtype=frame.dtype), axis=-1)
+    diff = np.abs(frame.astype(np.int16) - np.array(to_color(color, frame.shape[-1]), dtype=np.int16))
+    return np.all(diff <= tolerance, axis=-1)
+
+
+def connected_region(match, x, y):
+    h, w = match.shape
+    if not match[y, x]:
+        return np.zeros_like(match)
+    
+    starts = np.zeros_like(match)
+    starts[:, 0] = match[:, 0]
+    starts[:, 1:] = match[:, 1:] & ~match[:, :-1]
+    run_ids = np.cumsum(starts.ravel()).reshape(h, w)
+    run_ids[~match] = 0
+    
+    touching = match[:-1] & match[1:] & (starts[:-1] | starts[1:])
+    upper, lower = run_ids[:-1][touching], run_ids[1:][touching]
+    
+    labels = np.arange(int(starts.sum()) + 1)
+    while True:
+        roots_upper, roots_lower = labels[upper], labels[lower]
+        split = roots_upper != roots_lower
+        if not split.any():
+            break
+        upper, lower = upper[split], lower[split]
+        roots_upper, roots_lower = roots_upper[split], roots_lower[split]
+        labels[np.maximum(roots_upper, roots_lower)] = np.minimum(roots_upper, roots_lower)
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+    
+    region = labels[run_ids] == labels[run_ids[y, x]]
+    return region & match
+
+
+def fill_mask(frame, x, y, tolerance=0, contiguous=True):
+    pixels = np.asarray(frame)
+    if not in_bounds(pixels, x, y):
+        return np.zeros(pixels.shape[:2], dtype=bool)
+    match = color_match(pixels, pixels[y, x], tolerance)
+    if not contiguous:
+        return match
+    return connected_region(match, x, y)
+
+
+def flood_fill(frame, x, y, color, tolerance=0, contiguous=True):
+    pixels = np.asarray(frame)
+    mask = fill_mask(pixels, x, y, tolerance, contiguous)
+    mask &= ~color_match(pixels, color)
+    if mask.any():
+        frame.write_mask(mask, color)
+    return mask
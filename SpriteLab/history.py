@@ -0,0 +1,159 @@
+from collections import deque
+
+DEFAULT_BUDGET = 32 * 1024 * 1024
+
+
+class PixelChange:
+    def __init__(self, frame_index, layer_index, indices, old, new):
+        self.frame_index = frame_index
+        self.layer_index = layer_index
+        self.indices = indices
+        self.old = old
+        self.new = new
+    
+    @classmethod
+    def diff(cls, frame_index, layer_index, before, after):
+        changes = before.diff(after)
+        if changes is None:
+            return None
+        return cls(frame_index, layer_index, *changes)
+    
+    @property
+    def nbytes(self):
+        return self.indices.nbytes + self.old.nbytes + self.new.nbytes
+    
+    def _write(self, frames, values):
+        frames[self.frame_index].layers[self.layer_index].pixels.put(self.indices, values)
+    
+    def undo(self, frames):
+        self._write(frames, self.old)
+    
+    def redo(self, frames):
+        self._write(frames, self.new)
+
+
+class FrameInsert:
+    def __init__(self, frame_index, frame):
+        self.frame_index = frame_index
+        self.frame = frame
+    
+    @property
+    def nbytes(self):
+        return self.frame.nbytes
+    
+    def undo(self, frames):
+        frames.pop(self.frame_index)
+    
+    def redo(self, frames):
+        frames.insert(self.frame_index, self.frame)
+
+
+class FrameRemove(FrameInsert):
+    def undo(self, frames):
+        FrameInsert.redo(self, frames)
+    
+    def redo(self, frames):
+        FrameInsert.undo(self, frames)
+
+
+class LayerInsert:
+    def __init__(self, frame_index, layer_index, layers):
+        self.frame_index = frame_index
+        self.layer_index = layer_index
+        self.layers = layers
+    
+    @property
+    def nbytes(self):
+        return sum(layer.pixels.nbytes for layer in {id(layer): layer for layer in self.layers}.values())
+    
+    def undo(self, frames):
+        for frame in frames:
+            frame.layers.pop(self.layer_index)
+    
+    def redo(self, frames):
+        for frame, layer in zip(frames, self.layers):
+            frame.layers.insert(self.layer_index, layer)
+
+
+class LayerRemove(LayerInsert):
+    def undo(self, frames):
+        LayerInsert.redo(self, frames)
+    
+    def redo(self, frames):
+        LayerInsert.undo(self, frames)
+
+
+class LayerSwap:
+    def __init__(self, frame_index, layer_index, old, new):
+        self.frame_index = frame_index
+        self.layer_index = layer_index
+        self.old = old
+        self.new = new
+    
+    @property
+    def nbytes(self):
+        return sum(layer.pixels.nbytes for layer in {id(layer): layer for layer in self.old + self.new}.values())
+    
+    def _write(self, frames, layers):
+        for frame, layer in zip(frames, layers):
+            frame.layers[self.layer_index] = layer
+    
+    def undo(self, frames):
+        self._write(frames, self.old)
+    
+    def redo(self, frames):
+        self._write(frames, self.new)
+
+
+class History:
+    def __init__(self, budget=DEFAULT_BUDGET, listener=None):
+        self.budget = budget
+        self.listener = listener
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self.nbytes = 0
+    
+    def __len__(self):
+        return len(self.undo_stack)
+    
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.nbytes = 0
+    
+    def push(self, changes):
+        changes = [change for change in changes if change is not None]
+        if not changes:
+            return False
+        for entry in self.redo_stack:
+            self.nbytes -= sum(change.nbytes for change in entry)
+        self.redo_stack.clear()
+        self.undo_stack.append(changes)
+        self.nbytes += sum(change.nbytes for change in changes)
+        while self.nbytes > self.budget and len(self.undo_stack) > 1:
+            self.nbytes -= sum(change.nbytes for change in self.undo_stack.popleft())
+        if self.listener is not None:
+            self.listener(changes, False)
+        return True
+    
+    def undo(self, frames):
+        if not self.undo_stack:
+            return None
+        entry = self.undo_stack.pop()
+        for change in reversed(entry):
+            change.undo(frames)
+        self.redo_stack.append(entry)
+        if self.listener is not None:
+            self.listener(entry, True)
+        return entry[0].frame_index
+    
+    def redo(self, frames):
+        if not self.redo_stack:
+            return None
+        entry = self.redo_stack.pop()
+        for change in entry:
+            change.redo(frames)
+        self.undo_stack.append(entry)
+        if self.listener is not None:
+            self.listener(entry, False)
+        return entry[-1].frame_index
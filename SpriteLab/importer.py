@@ -0,0 +1,70 @@
+import numpy as np
+from PIL import Image, ImageSequence
+
+IMAGE_TYPES = (".png", ".apng", ".gif", ".webp", ".bmp")
+RESAMPLE = {"nearest": Image.NEAREST, "box": Image.BOX}
+
+
+def probe(filename):
+    with Image.open(filename) as img:
+        return img.width, img.height, getattr(img, "n_frames", 1)
+
+
+def iter_frames(filename):
+    with Image.open(filename) as img:
+        for frame in ImageSequence.Iterator(img):
+            yield np.asarray(frame.convert("RGBA")), frame.info.get("duration") or None
+
+
+def slice_sheet(pixels, cell_width, cell_height, margin=0, spacing=0):
+    h, w, c = pixels.shape
+    cols = (w - 2 * margin + spacing) // (cell_width + spacing)
+    rows = (h - 2 * margin + spacing) // (cell_height + spacing)
+    if cols <= 0 or rows <= 0:
+        raise ValueError(f"A {w}x{h} sheet holds no {cell_width}x{cell_height} cells")
+    pixels = np.ascontiguousarray(pixels)
+    s0, s1, s2 = pixels.strides
+    cells = np.lib.stride_tricks.as_strided(
+        pixels[margin:, margin:],
+        shape=(rows, cols, cell_height, cell_width, c),
+        strides=(s0 * (cell_height + spacing), s1 * (cell_width + spacing), s0, s1, s2),
+        writeable=False
+    )
+    return cells.reshape(rows * cols, cell_height, cell_width, c)
+
+
+def iter_sheet(filename, cell_width, cell_height, margin=0, spacing=0, skip_empty=True):
+    with Image.open(filename) as img:
+        pixels = np.asarray(img.convert("RGBA"))
+    cells = slice_sheet(pixels, cell_width, cell_height, margin, spacing)
+    if skip_empty:
+        cells = cells[cells[..., 3].reshape(len(cells), -1).any(axis=1)]
+    for cell in cells:
+        yield cell, None
+
+
+def fit(pixels, size, method="nearest"):
+    h, w = pixels.shape[:2]
+    scale = min(1.0, size / w, size / h)
+    if scale < 1.0:
+        target = (max(1, round(w * scale)), max(1, round(h * scale)))
+        pixels = np.asarray(Image.fromarray(np.ascontiguousarray(pixels), "RGBA").resize(target, RESAMPLE[method]))
+        h, w = pixels.shape[:2]
+    if (w, h) == (size, size):
+        return pixels
+    out = np.zeros((size, size, 4), dtype=np.uint8)
+    y, x = (size - h) // 2, (size - w) // 2
+    out[y:y + h, x:x + w] = pixels
+    return out
+
+
+def import_frames(filename, size, method="nearest", palette=None, dither=0.0, sheet=None):
+    if sheet is not None:
+        source = iter_sheet(filename, *sheet)
+    else:
+        source = iter_frames(filename)
+    for pixels, duration in source:
+        pixels = fit(pixels, size, method)
+        if palette is not None:
+            pixels = palette.remap(pixels, dither)
+        yield pixels, duration
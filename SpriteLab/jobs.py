@@ -0,0 +1,80 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, name, task):
+        self.name = name
+        self.task = task
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.cancel_event = threading.Event()
+        self.future = None
+    
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+    
+    @property
+    def done(self):
+        return self.future is not None and self.future.done()
+    
+    def cancel(self):
+        self.cancel_event.set()
+    
+    def report(self, done, total):
+        if self.cancelled:
+            raise Cancelled(self.name)
+        self.progress = done / total if total else 1.0
+    
+    def run(self):
+        try:
+            if self.cancelled:
+                raise Cancelled(self.name)
+            self.result = self.task(self)
+            self.progress = 1.0
+        except Cancelled:
+            self.cancel_event.set()
+        except Exception as e:
+            self.error = e
+        return self
+
+
+class JobQueue:
+    def __init__(self, notify=None, workers=1):
+        self.notify = notify
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="spritelab-job")
+        self.jobs = []
+    
+    def __len__(self):
+        return len(self.jobs)
+    
+    @property
+    def current(self):
+        for job in self.jobs:
+            if not job.done:
+                return job
+        return None
+    
+    def submit(self, name, task):
+        job = Job(name, task)
+        self.jobs.append(job)
+        job.future = self.pool.submit(job.run)
+        job.future.add_done_callback(lambda future: self.finished(job))
+        return job
+    
+    def finished(self, job):
+        if self.notify is not None:
+            self.notify(job)
+    
+    def collect(self, job):
+        if job in self.jobs:
+            self.jobs.remove(job)
+    
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait=wait)
@@ -0,0 +1,370 @@
+import json
+import os
+import re
+import struct
+import tempfile
+import zlib
+from datetime import datetime
+
+import numpy as np
+
+from canvas import TiledFrame
+from history import PixelChange, FrameInsert, FrameRemove, LayerInsert, LayerRemove, LayerSwap
+from jobs import JobQueue
+from layers import Layer, LayeredFrame
+from project import load_binary, save_binary
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+AUTOSAVE_DIR = ".spritelab-autosave"
+SESSION_PREFIX = "session-"
+LOCK_NAME = "lock"
+COMPACT_BYTES = 16 * 1024 * 1024
+RECORD = struct.Struct("<BI")
+CHECKSUM = struct.Struct("<I")
+LENGTH = struct.Struct("<I")
+FILE_PATTERN = re.compile(r"^(snapshot|journal)-(\d+)\.(slp|bin)$")
+
+PIXELS, FRAME_INSERT, FRAME_REMOVE, LAYER_INSERT, LAYER_REMOVE, LAYER_SWAP, PROPS, DURATION, PALETTE, RESET = range(1, 11)
+
+
+def pack(meta, blobs=()):
+    meta = dict(meta, blobs=[len(blob) for blob in blobs])
+    header = json.dumps(meta, separators=(",", ":")).encode("utf-8")
+    return LENGTH.pack(len(header)) + header + b"".join(blobs)
+
+
+def unpack(payload):
+    (length,) = LENGTH.unpack_from(payload, 0)
+    meta = json.loads(bytes(payload[LENGTH.size:LENGTH.size + length]).decode("utf-8"))
+    blobs = []
+    offset = LENGTH.size + length
+    for size in meta.pop("blobs"):
+        blobs.append(bytes(payload[offset:offset + size]))
+        offset += size
+    return meta, blobs
+
+
+def encode_tiles(pixels):
+    keys = sorted(pixels.tiles)
+    data = zlib.compress(b"".join(np.ascontiguousarray(pixels.tiles[key]).tobytes() for key in keys), 1)
+    return {"size": [pixels.width, pixels.height], "background": list(pixels.background), "tile_size": pixels.tile_size, "keys": [list(key) for key in keys]}, data
+
+
+def decode_tiles(meta, blob):
+    pixels = TiledFrame(meta["size"][0], meta["size"][1], tuple(meta["background"]), meta["tile_size"])
+    data = np.frombuffer(zlib.decompress(blob), dtype=np.uint8)
+    offset = 0
+    for key in meta["keys"]:
+        tile = pixels.tile(tuple(key), create=True)
+        tile[:] = data[offset:offset + tile.size].reshape(tile.shape)
+        offset += tile.size
+    return pixels
+
+
+def encode_layers(groups, owners=None):
+    entries, blobs, index = [], [], {}
+    rows = []
+    for layers in groups:
+        row = []
+        for layer in layers:
+            if id(layer) not in index:
+                index[id(layer)] = len(entries)
+                if owners is not None and id(layer) in owners:
+                    entries.append({"ref": owners[id(layer)]})
+                else:
+                    meta, blob = encode_tiles(layer.pixels)
+                    entries.append(dict(meta, props=layer.props(), indexed=layer.palette is not None, blob=len(blobs)))
+                    blobs.append(blob)
+            row.append(index[id(layer)])
+        rows.append(row)
+    return {"layers": entries, "rows": rows}, blobs
+
+
+def decode_layers(meta, blobs, frames, palette):
+    layers = []
+    for entry in meta["layers"]:
+        if "ref" in entry:
+            frame_index, layer_index = entry["ref"]
+            layers.append(frames[frame_index].layers[layer_index])
+        else:
+            pixels = decode_tiles(entry, blobs[entry["blob"]])
+            layers.append(Layer.from_props(pixels, entry["props"], palette if entry["indexed"] else None))
+    return [[layers[i] for i in row] for row in meta["rows"]]
+
+
+def layer_owners(frames, skip, layers):
+    owners = {}
+    for frame_index in (skip - 1, skip + 1):
+        if not 0 <= frame_index < len(frames):
+            continue
+        neighbour = frames[frame_index].layers
+        for layer_index, layer in enumerate(layers):
+            if layer_index < len(neighbour) and neighbour[layer_index] is layer:
+                owners.setdefault(id(layer), [frame_index - (frame_index > skip), layer_index])
+    return owners
+
+
+def encode_change(change, frames, undo):
+    if isinstance(change, PixelChange):
+        values = change.old if undo else change.new
+        meta = {"frame": change.frame_index, "layer": change.layer_index, "count": len(change.indices), "channels": values.shape[-1]}
+        return PIXELS, pack(meta, [zlib.compress(change.indices.astype("<u4").tobytes() + np.ascontiguousarray(values).tobytes(), 1)])
+    if isinstance(change, FrameInsert):
+        inserted = isinstance(change, FrameRemove) == undo
+        if not inserted:
+            return FRAME_REMOVE, pack({"frame": change.frame_index})
+        frame = change.frame
+        meta, blobs = encode_layers([frame.layers], layer_owners(frames, change.frame_index, frame.layers))
+        return FRAME_INSERT, pack(dict(meta, frame=change.frame_index, duration=frame.duration), blobs)
+    if isinstance(change, LayerInsert):
+        inserted = isinstance(change, LayerRemove) == undo
+        if not inserted:
+            return LAYER_REMOVE, pack({"layer": change.layer_index})
+        meta, blobs = encode_layers([[layer] for layer in change.layers])
+        return LAYER_INSERT, pack(dict(meta, layer=change.layer_index), blobs)
+    if isinstance(change, LayerSwap):
+        meta, blobs = encode_layers([[layer] for layer in (change.old if undo else change.new)])
+        return LAYER_SWAP, pack(dict(meta, layer=change.layer_index), blobs)
+    raise TypeError(f"Cannot journal {type(change).__name__}")
+
+
+def apply_record(kind, payload, frames, palette):
+    meta, blobs = unpack(payload)
+    if kind == PIXELS:
+        data = zlib.decompress(blobs[0])
+        count = meta["count"]
+        indices = np.frombuffer(data, dtype="<u4", count=count).astype(np.intp)
+        values = np.frombuffer(data, dtype=np.uint8, offset=count * 4).reshape(count, meta["channels"])
+        PixelChange(meta["frame"], meta["layer"], indices, None, values).redo(frames)
+    elif kind == FRAME_INSERT:
+        frame = LayeredFrame(decode_layers(meta, blobs, frames, palette)[0])
+        frame.duration = meta.get("duration")
+        FrameInsert(meta["frame"], frame).redo(frames)
+    elif kind == FRAME_REMOVE:
+        FrameRemove(meta["frame"], None).redo(frames)
+    elif kind == LAYER_INSERT:
+        LayerInsert(0, meta["layer"], [row[0] for row in decode_layers(meta, blobs, frames, palette)]).redo(frames)
+    elif kind == LAYER_REMOVE:
+        LayerRemove(0, meta["layer"], []).redo(frames)
+    elif kind == LAYER_SWAP:
+        LayerSwap(0, meta["layer"], [], [row[0] for row in decode_layers(meta, blobs, frames, palette)]).redo(frames)
+    elif kind == PROPS:
+        layers = {id(frame.layers[meta["layer"]]): frame.layers[meta["layer"]] for frame in frames}
+        for layer in layers.values():
+            for name, value in meta["props"].items():
+                setattr(layer, name, value)
+    elif kind == DURATION:
+        frames[meta["frame"]].duration = meta["duration"]
+    elif kind == PALETTE:
+        palette.set_color(meta["index"], meta["color"])
+    else:
+        raise ValueError(f"Unknown journal record type {kind}")
+
+
+def read_records(filename):
+    with open(filename, "rb") as f:
+        data = f.read()
+    offset = 0
+    while offset + RECORD.size <= len(data):
+        kind, length = RECORD.unpack_from(data, offset)
+        end = offset + RECORD.size + length + CHECKSUM.size
+        if end > len(data):
+            break
+        payload = data[offset + RECORD.size:end - CHECKSUM.size]
+        if CHECKSUM.unpack_from(data, end - CHECKSUM.size)[0] != zlib.crc32(payload):
+            break
+        yield kind, payload
+        offset = end
+
+
+def try_lock(filename):
+    f = open(filename, "a+b")
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+class Journal:
+    def __init__(self, root=AUTOSAVE_DIR, compact_bytes=COMPACT_BYTES):
+        self.root = root
+        self.directory = None
+        self.lock = None
+        self.compact_bytes = compact_bytes
+        self.generation = 0
+        self.file = None
+        self.nbytes = 0
+        self.records = 0
+        self.jobs = JobQueue()
+        if root is not None:
+            self.adopt_session() or self.new_session()
+    
+    def adopt_session(self):
+        os.makedirs(self.root, exist_ok=True)
+        sessions = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith(SESSION_PREFIX) and os.path.isdir(path):
+                sessions.append((os.path.getmtime(path), path))
+        for _, path in sorted(sessions, reverse=True):
+            lock = try_lock(os.path.join(path, LOCK_NAME))
+            if lock is None:
+                continue
+            self.directory, self.lock = path, lock
+            if self.has_recovery():
+                return True
+            self.remove_session()
+        return False
+    
+    def new_session(self):
+        os.makedirs(self.root, exist_ok=True)
+        self.directory = tempfile.mkdtemp(prefix=SESSION_PREFIX, dir=self.root)
+        self.lock = try_lock(os.path.join(self.directory, LOCK_NAME))
+        self.generation = 0
+    
+    def release(self):
+        if self.lock is not None:
+            self.lock.close()
+            self.lock = None
+    
+    def remove_session(self):
+        snapshots, journals = self.files()
+        for kind, generations in (("snapshot", snapshots), ("journal", journals)):
+            for generation in generations:
+                try:
+                    os.remove(self.path(kind, generation))
+                except OSError:
+                    pass
+        self.release()
+        for path in (os.path.join(self.directory, LOCK_NAME), self.directory, self.root):
+            try:
+                os.rmdir(path) if os.path.isdir(path) else os.remove(path)
+            except OSError:
+                pass
+        self.directory = None
+    
+    def quarantine(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.jobs.shutdown()
+        self.jobs = JobQueue()
+        self.release()
+        failed = os.path.join(self.root, datetime.now().strftime("failed-%Y%m%d_%H%M%S-") + os.path.basename(self.directory))
+        os.replace(self.directory, failed)
+        self.new_session()
+        return failed
+    
+    def path(self, kind, generation):
+        return os.path.join(self.directory, f"{kind}-{generation:06d}.{'slp' if kind == 'snapshot' else 'bin'}")
+    
+    def files(self):
+        found = {"snapshot": [], "journal": []}
+        if self.directory is not None and os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                match = FILE_PATTERN.match(name)
+                if match:
+                    found[match.group(1)].append(int(match.group(2)))
+        return sorted(found["snapshot"]), sorted(found["journal"])
+    
+    def has_recovery(self):
+        snapshots, _ = self.files()
+        return bool(snapshots)
+    
+    def recover(self):
+        snapshots, journals = self.files()
+        if not snapshots:
+            return None, 0
+        base = snapshots[-1]
+        project = load_binary(self.path("snapshot", base))
+        frames = project.frames
+        count = 0
+        for generation in journals:
+            if generation < base:
+                continue
+            for kind, payload in read_records(self.path("journal", generation)):
+                if kind == RESET:
+                    if generation > base:
+                        return project, count
+                    continue
+                apply_record(kind, payload, frames, project.indexed)
+                count += 1
+        return project, count
+    
+    def checkpoint(self, project, reset=False):
+        if self.directory is None:
+            return
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        os.makedirs(self.directory, exist_ok=True)
+        snapshots, journals = self.files()
+        generation = max(snapshots + journals + [self.generation]) + 1
+        snapshot = project.snapshot()
+        self.generation = generation
+        self.file = open(self.path("journal", generation), "ab")
+        self.nbytes = 0
+        self.records = 0
+        if reset:
+            self.append(RESET, pack({}))
+        self.jobs.submit("Autosave", lambda job: self.write_snapshot(snapshot, generation))
+    
+    def write_snapshot(self, project, generation):
+        save_binary(self.path("snapshot", generation), project, reattach=False)
+        snapshots, journals = self.files()
+        for kind, generations in (("snapshot", snapshots), ("journal", journals)):
+            for old in generations:
+                if old < generation:
+                    try:
+                        os.remove(self.path(kind, old))
+                    except OSError:
+                        pass
+    
+    def append(self, kind, payload):
+        if self.file is None:
+            return
+        self.file.write(RECORD.pack(kind, len(payload)) + payload + CHECKSUM.pack(zlib.crc32(payload)))
+        self.file.flush()
+        self.nbytes += RECORD.size + len(payload) + CHECKSUM.size
+        self.records += 1
+    
+    def record_changes(self, changes, frames, undo=False):
+        if self.file is None:
+            return
+        for change in (reversed(changes) if undo else changes):
+            self.append(*encode_change(change, frames, undo))
+    
+    def record_props(self, layer_index, props):
+        self.append(PROPS, pack({"layer": layer_index, "props": props}))
+    
+    def record_duration(self, frame_index, duration):
+        self.append(DURATION, pack({"frame": frame_index, "duration": duration}))
+    
+    def record_palette(self, index, color):
+        self.append(PALETTE, pack({"index": index, "color": [int(c) for c in tuple(color)[:3]]}))
+    
+    def needs_compaction(self):
+        return self.nbytes > self.compact_bytes
+    
+    def close(self, discard=True):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.jobs.shutdown()
+        if self.directory is None:
+            return
+        if discard:
+            self.remove_session()
+        else:
+            self.release()
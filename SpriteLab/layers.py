@@ -0,0 +1,165 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from canvas import WHITE, TiledFrame
+
+BLEND_MODES = ("normal", "multiply", "add")
+PAPER = WHITE + (255,)
+TRANSPARENT = (0, 0, 0, 0)
+CACHE_TILES = 64
+
+
+class Layer:
+    def __init__(self, pixels, name="Layer", visible=True, opacity=1.0, mode="normal", linked=False, palette=None):
+        self.pixels = pixels
+        self.name = name
+        self.visible = visible
+        self.opacity = opacity
+        self.mode = mode
+        self.linked = linked
+        self.palette = palette
+    
+    def props(self):
+        return {"name": self.name, "visible": self.visible, "opacity": self.opacity, "mode": self.mode, "linked": self.linked}
+    
+    @classmethod
+    def from_props(cls, pixels, props, palette=None):
+        return cls(pixels, props.get("name", "Layer"), props.get("visible", True), props.get("opacity", 1.0), props.get("mode", "normal"), props.get("linked", False), palette)
+    
+    def copy(self, linked=None):
+        layer = Layer.from_props(self.pixels.copy(), self.props(), self.palette)
+        if linked is not None:
+            layer.linked = linked
+        return layer
+    
+    def blank(self):
+        pixels = TiledFrame(self.pixels.width, self.pixels.height, self.pixels.background, self.pixels.tile_size)
+        return Layer.from_props(pixels, self.props(), self.palette)
+    
+    def rgba(self, pixels):
+        if self.palette is None:
+            return pixels
+        return self.palette.lut[pixels[..., 0]]
+    
+    def signature(self, key):
+        return (self.pixels.serial, self.pixels.versions.get(key, 0), self.visible, self.opacity, self.mode, self.palette and self.palette.revision)
+
+
+def new_layer(size, name="Layer", background=TRANSPARENT, palette=None):
+    return Layer(TiledFrame(size, size, background), name, palette=palette)
+
+
+def unique_layers(frames):
+    seen = set()
+    for frame_index, frame in enumerate(frames):
+        for layer_index, layer in enumerate(frame.layers):
+            if id(layer) not in seen:
+                seen.add(id(layer))
+                yield frame_index, layer_index, layer
+
+
+def blend(base, layers, key, bounds):
+    out = base
+    for layer in layers:
+        if not layer.visible or layer.opacity <= 0:
+            continue
+        tile = layer.pixels.tile(key)
+        if tile is None:
+            if layer.rgba(np.array(layer.pixels.background, dtype=np.uint8))[3] == 0:
+                continue
+            tile = layer.pixels.read(*bounds)
+        tile = layer.rgba(tile)
+        src = tile[..., :3].astype(np.float32)
+        alpha = tile[..., 3:].astype(np.float32) * (layer.opacity / 255.0)
+        if layer.mode == "multiply":
+            src = out * src / 255.0
+        elif layer.mode == "add":
+            src = np.minimum(out + src, 255.0)
+        out = out + (src - out) * alpha
+    return out
+
+
+class LayeredFrame:
+    def __init__(self, layers):
+        self.layers = layers
+        self.duration = None
+        self.active = 0
+        self.cache = OrderedDict()
+    
+    @property
+    def base(self):
+        return self.layers[0].pixels
+    
+    @property
+    def width(self):
+        return self.base.width
+    
+    @property
+    def height(self):
+        return self.base.height
+    
+    @property
+    def shape(self):
+        return (self.height, self.width, 3)
+    
+    @property
+    def revision(self):
+        return tuple((layer.pixels.serial, layer.pixels.revision, layer.visible, layer.opacity, layer.mode, layer.palette and layer.palette.revision) for layer in self.layers)
+    
+    @property
+    def nbytes(self):
+        unique = {id(layer.pixels): layer.pixels for layer in self.layers}
+        return sum(pixels.nbytes for pixels in unique.values())
+    
+    def __array__(self, dtype=None, copy=None):
+        array = self.read(0, 0, self.width, self.height)
+        return array if dtype is None else array.astype(dtype)
+    
+    @classmethod
+    def from_array(cls, array, name="Background"):
+        if array.shape[-1] == 3:
+            array = np.dstack([array, np.full(array.shape[:2], 255, dtype=np.uint8)])
+        return cls([Layer(TiledFrame.from_array(array, PAPER), name)])
+    
+    def blank_like(self):
+        return LayeredFrame([layer if layer.linked else layer.blank() for layer in self.layers])
+    
+    def composite_tile(self, key):
+        active = max(0, min(self.active, len(self.layers) - 1))
+        below_key = tuple(layer.signature(key) for layer in self.layers[:active])
+        full_key = below_key + tuple(layer.signature(key) for layer in self.layers[active:])
+        entry = self.cache.get(key)
+        if entry is not None and entry[2] == full_key:
+            self.cache.move_to_end(key)
+            return entry[3]
+        
+        bounds = self.base.tile_bounds(key)
+        if active and entry is not None and entry[0] == below_key:
+            below = entry[1]
+        else:
+            below = np.empty((bounds[3] - bounds[1], bounds[2] - bounds[0], 3), dtype=np.float32)
+            below[:] = WHITE
+            if active:
+                below = np.rint(blend(below, self.layers[:active], key, bounds)).astype(np.uint8)
+        result = np.rint(blend(below.astype(np.float32), self.layers[active:], key, bounds)).astype(np.uint8)
+        self.cache[key] = (below_key, below if active else None, full_key, result)
+        self.cache.move_to_end(key)
+        while len(self.cache) > CACHE_TILES:
+            self.cache.popitem(last=False)
+        return result
+    
+    def read(self, x0, y0, x1, y1):
+        region = np.empty((y1 - y0, x1 - x0, 3), dtype=np.uint8)
+        if x1 <= x0 or y1 <= y0:
+            return region
+        for key in self.base.tile_keys(x0, y0, x1, y1):
+            tile = self.composite_tile(key)
+            tx0, ty0, tx1, ty1 = self.base.tile_bounds(key)
+            ix0, iy0, ix1, iy1 = max(x0, tx0), max(y0, ty0), min(x1, tx1), min(y1, ty1)
+            region[iy0 - y0:iy1 - y0, ix0 - x0:ix1 - x0] = tile[iy0 - ty0:iy1 - ty0, ix0 - tx0:ix1 - tx0]
+        return region
+
+
+def new_layered_frame(size):
+    return LayeredFrame([new_layer(size, "Background", PAPER)])
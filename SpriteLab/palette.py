@@ -0,0 +1,195 @@
+import itertools
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+from canvas import WHITE, TiledFrame
+from layers import unique_layers
+
+PALETTES = {
+    "Basic": [
+        (0, 0, 0), (255, 255, 255), (255, 0, 0), (0, 255, 0),
+        (0, 0, 255), (255, 255, 0), (255, 0, 255), (0, 255, 255),
+        (128, 0, 0), (0, 128, 0), (0, 0, 128), (128, 128, 0)
+    ],
+    "Pastel": [
+        (255, 209, 220), (204, 255, 229), (204, 229, 255),
+        (255, 255, 204), (229, 204, 255), (255, 229, 204),
+        (220, 255, 209), (209, 220, 255), (255, 204, 229)
+    ],
+    "Game Boy": [
+        (15, 56, 15), (48, 98, 48), (139, 172, 15),
+        (155, 188, 15), (48, 98, 48)
+    ],
+    "NES": [
+        (124, 124, 124), (0, 0, 252), (0, 0, 188), (68, 40, 188),
+        (148, 0, 132), (168, 0, 32), (168, 16, 0), (136, 20, 0)
+    ]
+}
+
+MAX_COLORS = 255
+LOOKUP_SLOTS = 8
+LOOKUP_BITS = 18
+EMPTY_ENTRY = np.uint64(0xFFFFFFFFFFFFFFFF)
+TRANSPARENT_INDEX = 255
+DITHER_SPREAD = 64
+BAYER = (np.array([
+    [0, 8, 2, 10],
+    [12, 4, 14, 6],
+    [3, 11, 1, 9],
+    [15, 7, 13, 5]
+], dtype=np.float32) + 0.5) / 16 - 0.5
+
+_revisions = itertools.count(1)
+_lookups = OrderedDict()
+_lookups_lock = threading.Lock()
+
+
+def srgb_to_oklab(rgb):
+    c = np.asarray(rgb, dtype=np.float32) / 255.0
+    c = np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+    lms = c @ np.array([
+        [0.4122214708, 0.2119034982, 0.0883024619],
+        [0.5363325363, 0.6806995451, 0.2817188376],
+        [0.0514459929, 0.1073969566, 0.6299787005]
+    ], dtype=np.float32)
+    lms = np.cbrt(lms)
+    return lms @ np.array([
+        [0.2104542553, 1.9779984951, 0.0259040371],
+        [0.7936177850, -2.4285922050, 0.7827717662],
+        [-0.0040720468, 0.4505937099, -0.8086757660]
+    ], dtype=np.float32)
+
+
+class ColorLookup:
+    def __init__(self, lab, bits=LOOKUP_BITS):
+        self.lab = lab
+        self.shift = 32 - bits
+        self.entries = np.full(1 << bits, EMPTY_ENTRY, dtype=np.uint64)
+    
+    def slots(self, keys):
+        return ((keys.astype(np.uint64) * 2654435761) & 0xFFFFFFFF) >> self.shift
+    
+    def match(self, keys):
+        slots = self.slots(keys)
+        entries = self.entries[slots]
+        found = (entries >> 8) == keys
+        if found.all():
+            return (entries & 255).astype(np.uint8)
+        new = np.unique(keys[~found])
+        matched = np.empty(len(new), dtype=np.uint8)
+        for start in range(0, len(new), 4096):
+            chunk = new[start:start + 4096]
+            lab = srgb_to_oklab(np.stack([chunk >> 16, (chunk >> 8) & 255, chunk & 255], axis=-1))
+            distances = ((lab[:, None, :] - self.lab[None, :, :]) ** 2).sum(axis=-1)
+            matched[start:start + len(chunk)] = distances.argmin(axis=1)
+        self.entries[self.slots(new)] = (new.astype(np.uint64) << 8) | matched
+        result = (entries & 255).astype(np.uint8)
+        result[~found] = matched[np.searchsorted(new, keys[~found])]
+        return result
+
+
+def color_lookup(colors, lab):
+    key = colors.tobytes()
+    with _lookups_lock:
+        lookup = _lookups.get(key)
+        if lookup is None:
+            lookup = _lookups[key] = ColorLookup(lab)
+        _lookups.move_to_end(key)
+        while len(_lookups) > LOOKUP_SLOTS:
+            _lookups.popitem(last=False)
+    return lookup
+
+
+class Palette:
+    def __init__(self, colors):
+        colors = [tuple(int(c) for c in tuple(color)[:3]) for color in colors]
+        if not 0 < len(colors) <= MAX_COLORS:
+            raise ValueError(f"A palette needs 1 to {MAX_COLORS} colors, got {len(colors)}")
+        self.colors = np.array(colors, dtype=np.uint8)
+        self.lut = np.zeros((256, 4), dtype=np.uint8)
+        self.lut[:len(colors), :3] = self.colors
+        self.lut[:len(colors), 3] = 255
+        self.lab = srgb_to_oklab(self.colors)
+        self.lookup = None
+        self.revision = next(_revisions)
+    
+    def __len__(self):
+        return len(self.colors)
+    
+    def set_color(self, index, color):
+        self.colors[index] = tuple(color)[:3]
+        self.lut[index, :3] = self.colors[index]
+        self.lab = srgb_to_oklab(self.colors)
+        self.lookup = None
+        self.revision = next(_revisions)
+    
+    def nearest(self, rgb):
+        rgb = np.asarray(rgb, dtype=np.uint8).reshape(-1, 3)
+        if self.lookup is None:
+            self.lookup = color_lookup(self.colors, self.lab)
+        keys = (rgb[:, 0].astype(np.uint32) << 16) | (rgb[:, 1].astype(np.uint32) << 8) | rgb[:, 2]
+        return self.lookup.match(keys)
+    
+    def quantize(self, pixels, dither=0.0):
+        rgb = np.asarray(pixels)[..., :3]
+        if dither:
+            h, w = rgb.shape[:2]
+            offset = np.rint(BAYER[np.arange(h)[:, None] % 4, np.arange(w)[None, :] % 4] * dither * DITHER_SPREAD)
+            rgb = np.clip(rgb.astype(np.int16) + offset.astype(np.int16)[..., None], 0, 255)
+        return self.nearest(rgb).reshape(rgb.shape[:2])
+    
+    def remap(self, pixels, dither=0.0):
+        pixels = np.asarray(pixels)
+        out = pixels.copy()
+        out[..., :3] = self.colors[self.quantize(pixels, dither)]
+        if pixels.shape[-1] == 4:
+            out[pixels[..., 3] == 0] = pixels[pixels[..., 3] == 0]
+        return out
+
+
+def load_palette(spec):
+    if spec in PALETTES:
+        return Palette(PALETTES[spec])
+    if not os.path.exists(spec):
+        raise ValueError(f"Unknown palette: {spec}")
+    if os.path.splitext(spec)[1].lower() in (".hex", ".txt"):
+        with open(spec, "r") as f:
+            codes = [line.strip().lstrip("#") for line in f if line.strip() and not line.startswith(";")]
+        return Palette([tuple(int(code[i:i + 2], 16) for i in (0, 2, 4)) for code in codes])
+    with Image.open(spec) as img:
+        pixels = np.asarray(img.convert("RGB")).reshape(-1, 3)
+    _, first = np.unique(pixels, axis=0, return_index=True)
+    return Palette(pixels[np.sort(first)])
+
+
+def remap_layers(frames, palette, dither=0.0):
+    for frame_index, layer_index, layer in unique_layers(frames):
+        remapped = palette.remap(np.asarray(layer.pixels), dither)
+        yield frame_index, layer_index, TiledFrame.from_array(remapped, layer.pixels.background, layer.pixels.tile_size)
+
+
+def index_pixels(pixels, palette, dither=0.0):
+    indices = palette.quantize(pixels, dither)
+    if pixels.shape[-1] == 4:
+        indices[pixels[..., 3] < 128] = TRANSPARENT_INDEX
+    return indices[..., None]
+
+
+def to_indexed(frames, palette, dither=0.0):
+    paper = (int(palette.nearest(WHITE)[0]),)
+    for _, _, layer in unique_layers(frames):
+        background = paper if layer.pixels.background[3] else (TRANSPARENT_INDEX,)
+        layer.pixels = TiledFrame.from_array(index_pixels(np.asarray(layer.pixels), palette, dither), background, layer.pixels.tile_size)
+        layer.palette = palette
+
+
+def to_direct(frames):
+    for _, _, layer in unique_layers(frames):
+        lut = layer.palette.lut
+        background = tuple(int(c) for c in lut[layer.pixels.background[0]])
+        layer.pixels = TiledFrame.from_array(lut[np.asarray(layer.pixels)[..., 0]], background, layer.pixels.tile_size)
+        layer.palette = None
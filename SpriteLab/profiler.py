@@ -0,0 +1,98 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+MAX_TRACE_EVENTS = 200000
+HUD_SAMPLES = 60
+HUD_INTERVAL = 0.25
+
+
+class Profiler:
+    def __init__(self, max_events=MAX_TRACE_EVENTS):
+        self.events = deque(maxlen=max_events)
+        self.samples = {}
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+    
+    def timestamp(self, seconds):
+        return round((seconds - self.origin) * 1e6, 1)
+    
+    @contextmanager
+    def span(self, name, category="editor", **args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, category, start, time.perf_counter(), args)
+    
+    def record(self, name, category, start, end, args=None):
+        event = {"name": name, "cat": category, "ph": "X", "ts": self.timestamp(start), "dur": round((end - start) * 1e6, 1), "pid": self.pid, "tid": threading.get_ident()}
+        if args:
+            event["args"] = args
+        with self.lock:
+            samples = self.samples.get(name)
+            if samples is None:
+                samples = self.samples[name] = deque(maxlen=HUD_SAMPLES)
+            samples.append(end - start)
+            self.events.append(event)
+    
+    def counter(self, name, **values):
+        event = {"name": name, "ph": "C", "ts": self.timestamp(time.perf_counter()), "pid": self.pid, "args": values}
+        with self.lock:
+            self.events.append(event)
+    
+    def mark(self, name, **args):
+        event = {"name": name, "ph": "i", "s": "g", "ts": self.timestamp(time.perf_counter()), "pid": self.pid, "tid": threading.get_ident(), "args": args}
+        with self.lock:
+            self.events.append(event)
+    
+    def average(self, name):
+        with self.lock:
+            samples = list(self.samples.get(name, ()))
+        return sum(samples) / len(samples) * 1000 if samples else 0.0
+    
+    def peak(self, name):
+        with self.lock:
+            samples = list(self.samples.get(name, ()))
+        return max(samples) * 1000 if samples else 0.0
+    
+    def save_trace(self, filename):
+        with self.lock:
+            events = list(self.events)
+        data = {
+            "traceEvents": [{"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": "SpriteLab"}}] + events,
+            "displayTimeUnit": "ms"
+        }
+        with open(filename, "w") as f:
+            json.dump(data, f)
+        return filename
+    
+    def clear(self):
+        with self.lock:
+            self.events.clear()
+            self.samples.clear()
+
+
+def traced(category="tool"):
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.profiler.span(method.__name__, category):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def frames_nbytes(frames):
+    loaded = getattr(frames, "is_loaded", lambda index: True)
+    unique = {}
+    for index in range(len(frames)):
+        if loaded(index):
+            for layer in frames[index].layers:
+                unique[id(layer.pixels)] = layer.pixels
+    return sum(pixels.nbytes for pixels in unique.values())
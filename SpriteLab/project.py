@@ -0,0 +1,287 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+from collections.abc import MutableSequence
+
+import numpy as np
+
+from canvas import TiledFrame, frame_to_columns, frame_from_columns
+from export import encode_frames
+from layers import Layer, LayeredFrame, PAPER, TRANSPARENT
+from palette import Palette
+
+MAGIC = b"SLAB"
+VERSION = 2
+HEADER = struct.Struct("<4sHHHHII")
+INDEX_ENTRY = struct.Struct("<QI")
+COLOR_COUNT = struct.Struct("<I")
+
+
+def encode_frame(frame):
+    frame = np.asarray(frame)
+    colors, indices = np.unique(frame.reshape(-1, frame.shape[-1]), axis=0, return_inverse=True)
+    if len(colors) <= 256:
+        data = indices.astype(np.uint8)
+    elif len(colors) <= 65536:
+        data = indices.astype(np.uint16)
+    else:
+        return COLOR_COUNT.pack(0) + zlib.compress(frame.tobytes())
+    return COLOR_COUNT.pack(len(colors)) + colors.astype(np.uint8).tobytes() + zlib.compress(data.tobytes())
+
+
+def decode_frame(blob, width, height, channels=3):
+    (count,) = COLOR_COUNT.unpack_from(blob, 0)
+    offset = COLOR_COUNT.size
+    if count == 0:
+        raw = zlib.decompress(blob[offset:])
+        return np.frombuffer(raw, dtype=np.uint8).reshape(height, width, channels).copy()
+    colors = np.frombuffer(blob, dtype=np.uint8, count=count * channels, offset=offset).reshape(count, channels)
+    raw = zlib.decompress(blob[offset + count * channels:])
+    indices = np.frombuffer(raw, dtype=np.uint8 if count <= 256 else np.uint16)
+    return colors[indices].reshape(height, width, channels)
+
+
+class LazyFrames(MutableSequence):
+    def __init__(self, source, entries, width, height, layers=None, durations=None, palette=None):
+        self.source = source
+        self.items = list(entries)
+        self.width = width
+        self.height = height
+        self.layers = layers
+        self.palette = palette
+        self.durations = list(durations) if durations else [None] * len(self.items)
+        self.shared = {}
+    
+    def __len__(self):
+        return len(self.items)
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        item = self.items[index]
+        if not self.is_loaded(index):
+            item = self.decode(item)
+            item.duration = self.durations[index]
+            self.items[index] = item
+        return item
+    
+    def decode(self, refs):
+        if self.layers is None:
+            return LayeredFrame.from_array(decode_frame(self.blob(refs[0]), self.width, self.height))
+        layers = []
+        for ref, props in zip(refs, self.layers):
+            layer = self.shared.get(ref)
+            if layer is None:
+                channels = 4 if self.palette is None else 1
+                background = props.get("background") or (PAPER if not layers else TRANSPARENT)
+                pixels = TiledFrame.from_array(decode_frame(self.blob(ref), self.width, self.height, channels), tuple(background))
+                layer = Layer.from_props(pixels, props, self.palette)
+                self.shared[ref] = layer
+            layers.append(layer)
+        return LayeredFrame(layers)
+    
+    def __setitem__(self, index, frame):
+        self.items[index] = frame
+    
+    def __delitem__(self, index):
+        del self.items[index]
+        del self.durations[index]
+    
+    def insert(self, index, frame):
+        self.items.insert(index, frame)
+        self.durations.insert(index, None)
+    
+    def duration(self, index):
+        if self.is_loaded(index):
+            return self.items[index].duration
+        return self.durations[index]
+    
+    def is_loaded(self, index):
+        return not isinstance(self.items[index], tuple)
+    
+    def blob(self, ref):
+        offset, length = ref
+        return self.source[offset:offset + length]
+    
+    def detach(self):
+        if isinstance(self.source, mmap.mmap):
+            self.source.close()
+        self.source = None
+    
+    def attach(self, source, rows, shared):
+        self.source = source
+        for index, refs in rows.items():
+            self.items[index] = refs
+        self.shared = shared
+
+
+class Project:
+    def __init__(self, frames, canvas_size, pixel_size=20, palette="Basic", indexed=None):
+        self.frames = frames
+        self.canvas_size = canvas_size
+        self.pixel_size = pixel_size
+        self.palette = palette
+        self.indexed = indexed
+    
+    def meta(self):
+        layers = [dict(layer.props(), background=list(layer.pixels.background)) for layer in self.frames[0].layers]
+        meta = {"pixel_size": self.pixel_size, "palette": self.palette, "layers": layers, "durations": frame_durations(self.frames)}
+        if self.indexed is not None:
+            meta["indexed"] = self.indexed.colors.tolist()
+        return meta
+    
+    def snapshot(self):
+        palettes = {}
+        layers = {}
+        
+        def copy_palette(palette):
+            if palette is None:
+                return None
+            if id(palette) not in palettes:
+                palettes[id(palette)] = Palette(palette.colors)
+            return palettes[id(palette)]
+        
+        def copy_layer(layer):
+            if id(layer) not in layers:
+                layers[id(layer)] = layer.copy()
+                layers[id(layer)].palette = copy_palette(layer.palette)
+            return layers[id(layer)]
+        
+        def copy_frame(frame):
+            copy = LayeredFrame([copy_layer(layer) for layer in frame.layers])
+            copy.duration = frame.duration
+            return copy
+        
+        frames = self.frames
+        if isinstance(frames, LazyFrames):
+            snapshot = LazyFrames(frames.source, [], frames.width, frames.height, frames.layers, frames.durations, copy_palette(frames.palette))
+            snapshot.items = [item if isinstance(item, tuple) else copy_frame(item) for item in frames.items]
+            snapshot.shared = {ref: copy_layer(layer) for ref, layer in frames.shared.items()}
+        else:
+            snapshot = [copy_frame(frame) for frame in frames]
+        return Project(snapshot, self.canvas_size, self.pixel_size, self.palette, copy_palette(self.indexed))
+
+
+def frame_durations(frames):
+    if isinstance(frames, LazyFrames):
+        return [frames.duration(i) for i in range(len(frames))]
+    return [frame.duration for frame in frames]
+
+
+def save_binary(filename, project, progress=None, reattach=True):
+    frames = project.frames
+    lazy = isinstance(frames, LazyFrames)
+    
+    sources = {}
+    rows = []
+    for index in range(len(frames)):
+        row = []
+        if lazy and not frames.is_loaded(index):
+            for ref in frames.items[index]:
+                layer = frames.shared.get(ref)
+                key = ref if layer is None else id(layer)
+                sources.setdefault(key, ref if layer is None else layer)
+                row.append(key)
+        else:
+            for layer in frames[index].layers:
+                sources.setdefault(id(layer), layer)
+                row.append(id(layer))
+        rows.append(row)
+    
+    def encode(key):
+        source = sources[key]
+        if isinstance(source, tuple):
+            return bytes(frames.blob(source))
+        return encode_frame(source.pixels)
+    
+    keys = list(sources)
+    blobs = encode_frames(keys, encode, progress=progress)
+    meta = json.dumps(project.meta()).encode("utf-8")
+    
+    offset = HEADER.size + len(meta) + INDEX_ENTRY.size * sum(len(row) for row in rows)
+    refs = {}
+    for key, blob in zip(keys, blobs):
+        refs[key] = (offset, len(blob))
+        offset += len(blob)
+    index = bytearray()
+    for row in rows:
+        for key in row:
+            index += INDEX_ENTRY.pack(*refs[key])
+    
+    temp_name = filename + ".tmp"
+    with open(temp_name, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, project.canvas_size, project.canvas_size, 0, len(rows), len(meta)))
+        f.write(meta)
+        f.write(index)
+        for blob in blobs:
+            f.write(blob)
+    if lazy and reattach:
+        frames.detach()
+    os.replace(temp_name, filename)
+    if lazy and reattach:
+        with open(filename, "rb") as f:
+            source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        pending = {i: tuple(refs[key] for key in row) for i, row in enumerate(rows) if not frames.is_loaded(i)}
+        shared = {refs[key]: source for key, source in sources.items() if not isinstance(source, tuple)}
+        frames.attach(source, pending, shared)
+    return filename
+
+
+def load_binary(filename):
+    with open(filename, "rb") as f:
+        source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, width, height, _, count, meta_len = HEADER.unpack_from(source, 0)
+    if magic != MAGIC:
+        source.close()
+        raise ValueError("Not a SpriteLab project file")
+    if version > VERSION:
+        source.close()
+        raise ValueError(f"Unsupported project version {version}")
+    meta = json.loads(bytes(source[HEADER.size:HEADER.size + meta_len]).decode("utf-8"))
+    table = HEADER.size + meta_len
+    layers = meta.get("layers") if version >= 2 else None
+    depth = len(layers) if layers else 1
+    entries = [tuple(INDEX_ENTRY.unpack_from(source, table + (i * depth + j) * INDEX_ENTRY.size) for j in range(depth)) for i in range(count)]
+    indexed = Palette(meta["indexed"]) if meta.get("indexed") else None
+    frames = LazyFrames(source, entries, width, height, layers, meta.get("durations"), indexed)
+    return Project(frames, width, meta.get("pixel_size", 20), meta.get("palette", "Basic"), indexed)
+
+
+def save_json(filename, project, progress=None):
+    columns = []
+    for frame in project.frames:
+        columns.append(frame_to_columns(frame))
+        if progress is not None:
+            progress(len(columns), len(project.frames))
+    data = {
+        "canvas_size": project.canvas_size,
+        "pixel_size": project.pixel_size,
+        "frames": columns,
+        "durations": frame_durations(project.frames),
+        "palette": project.palette
+    }
+    with open(filename, "w") as f:
+        json.dump(data, f)
+    return filename
+
+
+def load_json(filename):
+    with open(filename, "r") as f:
+        data = json.load(f)
+    frames = [LayeredFrame.from_array(np.asarray(frame_from_columns(frame_data))) for frame_data in data["frames"]]
+    for frame, duration in zip(frames, data.get("durations", [])):
+        frame.duration = duration
+    return Project(frames, data["canvas_size"], data.get("pixel_size", 20), data.get("palette", "Basic"))
+
+
+def is_binary(filename):
+    with open(filename, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def load_project(filename):
+    if is_binary(filename):
+        return load_binary(filename)
+    return load_json(filename)
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import export
+from project import load_project, frame_durations
+
+FORMATS = ("png",) + tuple(export.ANIMATION_FORMATS)
+DEFAULT_FORMATS = ("png", "gif")
+MANIFEST_NAME = ".spritelab-render.json"
+
+
+def file_hash(filename):
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def output_paths(filename, out_dir, formats, scales, frame_count, method="nearest"):
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    suffix = "" if method == "nearest" else f"_{method}"
+    paths = []
+    for scale in scales:
+        for fmt in formats:
+            if fmt == "png":
+                paths.extend(os.path.join(out_dir, f"{stem}_x{scale}{suffix}_{i:04d}.png") for i in range(frame_count))
+            else:
+                paths.append(os.path.join(out_dir, f"{stem}_x{scale}{suffix}{export.ANIMATION_FORMATS[fmt]}"))
+    return paths
+
+
+def render_project(filename, out_dir, formats=DEFAULT_FORMATS, scales=(export.DEFAULT_SCALE,), duration=200, method="nearest"):
+    project = load_project(filename)
+    frames = list(project.frames)
+    durations = [d or duration for d in frame_durations(frames)]
+    os.makedirs(out_dir, exist_ok=True)
+    
+    outputs = []
+    for scale in scales:
+        paths = iter(output_paths(filename, out_dir, formats, [scale], len(frames), method))
+        for fmt in formats:
+            if fmt == "png":
+                for frame in frames:
+                    outputs.append(export.export_png(frame, next(paths), scale, method))
+            elif fmt in export.ANIMATION_FORMATS:
+                outputs.append(export.export_animation(frames, next(paths), scale, durations, fmt, method=method))
+            else:
+                raise ValueError(f"Unknown output format: {fmt}")
+    return outputs
+
+
+def load_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, MANIFEST_NAME), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, MANIFEST_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def render_key(content_hash, formats, scales, duration, method="nearest"):
+    return json.dumps([content_hash, list(formats), list(scales), duration, method])
+
+
+def render_many(filenames, out_dir, formats=DEFAULT_FORMATS, scales=(export.DEFAULT_SCALE,), duration=200, jobs=None, force=False, method="nearest"):
+    stems = [os.path.splitext(os.path.basename(filename))[0] for filename in filenames]
+    if len(set(stems)) != len(stems):
+        raise ValueError("Input projects must have unique file names")
+    
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {} if force else load_manifest(out_dir)
+    
+    pending = {}
+    skipped = []
+    for filename in filenames:
+        name = os.path.abspath(filename)
+        key = render_key(file_hash(filename), formats, scales, duration, method)
+        entry = manifest.get(name)
+        if entry and entry["key"] == key and all(os.path.exists(path) for path in entry["outputs"]):
+            skipped.append(filename)
+        else:
+            pending[name] = (filename, key)
+    
+    rendered = {}
+    failed = {}
+    if pending:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {name: pool.submit(render_project, filename, out_dir, formats, scales, duration, method) for name, (filename, key) in pending.items()}
+            for name, future in futures.items():
+                filename, key = pending[name]
+                try:
+                    outputs = future.result()
+                except Exception as e:
+                    manifest.pop(name, None)
+                    failed[filename] = e
+                    continue
+                manifest[name] = {"key": key, "outputs": outputs}
+                rendered[filename] = outputs
+        save_manifest(out_dir, manifest)
+    
+    return rendered, skipped, failed
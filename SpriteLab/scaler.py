@@ -0,0 +1,256 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+SCALE_CACHE_BUDGET = 128 * 1024 * 1024
+BATCH_BYTES = 4 * 1024 * 1024
+YUV = np.array([[0.299, 0.587, 0.114], [-0.169, -0.331, 0.5], [0.5, -0.419, -0.081]], dtype=np.float32)
+YUV_WEIGHTS = np.array([48, 7, 6, 48], dtype=np.float32)
+CORNERS = ((1, 1), (1, -1), (-1, -1), (-1, 1))
+
+
+def frame_hash(frame):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(frame.shape).encode("ascii"))
+    digest.update(np.ascontiguousarray(frame).tobytes())
+    return digest.hexdigest()
+
+
+def pack(frames):
+    keys = np.zeros(frames.shape[:-1], dtype=np.uint32)
+    for channel in range(frames.shape[-1]):
+        keys |= frames[..., channel].astype(np.uint32) << (8 * channel)
+    return keys
+
+
+def unpack(keys, channels):
+    return np.stack([(keys >> (8 * channel)) & 255 for channel in range(channels)], axis=-1).astype(np.uint8)
+
+
+def neighbours(array, radius, spatial=(-2, -1)):
+    pad = [(0, 0)] * array.ndim
+    for axis in spatial:
+        pad[axis] = (radius, radius)
+    padded = np.pad(array, pad, mode="edge")
+    height, width = array.shape[spatial[0]], array.shape[spatial[1]]
+    
+    def at(dy, dx):
+        index = [slice(None)] * array.ndim
+        index[spatial[0]] = slice(radius + dy, radius + dy + height)
+        index[spatial[1]] = slice(radius + dx, radius + dx + width)
+        return padded[tuple(index)]
+    return at
+
+
+def interleave(blocks, factor):
+    shape = blocks[0].shape
+    stacked = np.stack(blocks, axis=-1).reshape(shape + (factor, factor))
+    return stacked.swapaxes(-3, -2).reshape(shape[:-2] + (shape[-2] * factor, shape[-1] * factor))
+
+
+def repeat(array, factor, spatial=(-2, -1)):
+    if factor == 1:
+        return array
+    return array.repeat(factor, axis=spatial[0]).repeat(factor, axis=spatial[1])
+
+
+def scale2x(keys):
+    at = neighbours(keys, 1)
+    b, d, e, f, h = at(-1, 0), at(0, -1), at(0, 0), at(0, 1), at(1, 0)
+    blocks = [
+        np.where((d == b) & (b != f) & (d != h), d, e),
+        np.where((b == f) & (b != d) & (f != h), f, e),
+        np.where((d == h) & (d != b) & (h != f), d, e),
+        np.where((h == f) & (d != h) & (b != f), f, e),
+    ]
+    return interleave(blocks, 2)
+
+
+def scale3x(keys):
+    at = neighbours(keys, 1)
+    a, b, c = at(-1, -1), at(-1, 0), at(-1, 1)
+    d, e, f = at(0, -1), at(0, 0), at(0, 1)
+    g, h, i = at(1, -1), at(1, 0), at(1, 1)
+    top_left = (d == b) & (b != f) & (d != h)
+    top_right = (b == f) & (b != d) & (f != h)
+    bottom_left = (d == h) & (d != b) & (h != f)
+    bottom_right = (h == f) & (d != h) & (b != f)
+    blocks = [
+        np.where(top_left, d, e),
+        np.where((top_left & (e != c)) | (top_right & (e != a)), b, e),
+        np.where(top_right, f, e),
+        np.where((top_left & (e != g)) | (bottom_left & (e != a)), d, e),
+        e,
+        np.where((top_right & (e != i)) | (bottom_right & (e != c)), f, e),
+        np.where(bottom_left, d, e),
+        np.where((bottom_left & (e != i)) | (bottom_right & (e != g)), h, e),
+        np.where(bottom_right, f, e),
+    ]
+    return interleave(blocks, 3)
+
+
+def scale_nearest(frames, scale):
+    return repeat(frames, scale, (-3, -2))
+
+
+def scale_epx(frames, scale):
+    keys = pack(frames)
+    while scale % 2 == 0:
+        keys = scale2x(keys)
+        scale //= 2
+    while scale % 3 == 0:
+        keys = scale3x(keys)
+        scale //= 3
+    return unpack(repeat(keys, scale), frames.shape[-1])
+
+
+def yuv(frames):
+    colors = frames.astype(np.float32)
+    result = colors[..., :3] @ YUV.T
+    if frames.shape[-1] > 3:
+        result = np.concatenate([result, colors[..., 3:4]], axis=-1)
+    return result * YUV_WEIGHTS[:result.shape[-1]]
+
+
+def distances(frames):
+    weighted = np.pad(yuv(frames), [(0, 0)] * (frames.ndim - 3) + [(2, 2), (2, 2), (0, 0)], mode="edge")
+    height, width = frames.shape[-3:-1]
+    maps = {
+        (1, 1): np.abs(weighted[..., :-1, :-1, :] - weighted[..., 1:, 1:, :]).sum(axis=-1),
+        (1, -1): np.abs(weighted[..., :-1, 1:, :] - weighted[..., 1:, :-1, :]).sum(axis=-1),
+        (0, 1): np.abs(weighted[..., :, :-1, :] - weighted[..., :, 1:, :]).sum(axis=-1),
+        (1, 0): np.abs(weighted[..., :-1, :, :] - weighted[..., 1:, :, :]).sum(axis=-1),
+    }
+    
+    def dist(p, q):
+        if (q[0], q[1]) < (p[0], p[1]):
+            p, q = q, p
+        step = (q[0] - p[0], q[1] - p[1])
+        y, x = p[0] + 2, p[1] + 2 - (step == (1, -1))
+        return maps[step][..., y:y + height, x:x + width]
+    return dist
+
+
+def xbr_corner(at, dist, sy, sx):
+    def point(dy, dx):
+        return dy * sy, dx * sx
+    E, B, D, F, H = point(0, 0), point(-1, 0), point(0, -1), point(0, 1), point(1, 0)
+    C, G, I = point(-1, 1), point(1, -1), point(1, 1)
+    F4, H5, I4, I5 = point(0, 2), point(2, 0), point(1, 2), point(2, 1)
+    along = dist(E, C) + dist(E, G) + dist(I, F4) + dist(I, H5) + 4 * dist(H, F)
+    across = dist(H, D) + dist(H, I5) + dist(F, I4) + dist(F, B) + 4 * dist(E, I)
+    edge = (along < across) & (at(*E) != at(*F)) & (at(*E) != at(*H))
+    return edge, np.where(dist(E, F) <= dist(E, H), at(*F), at(*H))
+
+
+def scale_xbr(frames, scale):
+    if scale == 1:
+        return frames
+    channels = frames.shape[-1]
+    keys = pack(frames)
+    at = neighbours(keys, 2)
+    dist = distances(frames)
+    centers = (np.arange(scale, dtype=np.float32) + 0.5) / scale
+    out = np.broadcast_to(frames[..., None, None, :], frames.shape[:-1] + (scale, scale, channels)).copy()
+    blocks = out.reshape(-1, scale, scale, channels)
+    for sy, sx in CORNERS:
+        edge, target = xbr_corner(at, dist, sy, sx)
+        index = np.flatnonzero(edge)
+        if not len(index):
+            continue
+        v = centers if sy > 0 else 1 - centers
+        u = centers if sx > 0 else 1 - centers
+        alpha = np.clip((v[:, None] + u[None, :] - 1.5) * scale / 2 + 0.5, 0, 1)
+        ys, xs = np.nonzero(alpha)
+        alpha = alpha[ys, xs][:, None]
+        source = unpack(keys.reshape(-1)[index], channels).astype(np.float32)[:, None, :]
+        target = unpack(target.reshape(-1)[index], channels).astype(np.float32)[:, None, :]
+        blocks[index[:, None], ys, xs] = np.rint(source + (target - source) * alpha)
+    return out.swapaxes(-4, -3).reshape(frames.shape[:-3] + (frames.shape[-3] * scale, frames.shape[-2] * scale, channels))
+
+
+FILTERS = {
+    "nearest": scale_nearest,
+    "epx": scale_epx,
+    "xbr": scale_xbr,
+}
+
+
+class ScaleCache:
+    def __init__(self, budget=SCALE_CACHE_BUDGET):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def get(self, key):
+        with self.lock:
+            result = self.entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return result
+    
+    def put(self, key, result):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self.entries[key] = result
+            self.nbytes += result.nbytes
+            while self.nbytes > self.budget and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+        return result
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+
+CACHE = ScaleCache()
+
+
+def scale_frame(frame, method="nearest", scale=1, cache=CACHE):
+    return scale_frames([frame], method, scale, cache)[0]
+
+
+def scale_frames(frames, method="nearest", scale=1, cache=CACHE, progress=None):
+    if method not in FILTERS:
+        raise ValueError(f"Unknown scaling filter: {method}")
+    arrays = [np.ascontiguousarray(np.asarray(frame)) for frame in frames]
+    if scale == 1:
+        if progress is not None:
+            progress(len(arrays), len(arrays))
+        return arrays
+    if method == "nearest":
+        cache = None
+    results = [None] * len(arrays)
+    pending = {}
+    for i, array in enumerate(arrays):
+        key = None if cache is None else (frame_hash(array), method, scale)
+        results[i] = None if key is None else cache.get(key)
+        if results[i] is None:
+            pending.setdefault(array.shape, []).append((i, key))
+    done = len(arrays) - sum(len(items) for items in pending.values())
+    for shape, items in pending.items():
+        batch = max(1, BATCH_BYTES // (int(np.prod(shape)) * scale * scale * 4))
+        for start in range(0, len(items), batch):
+            group = items[start:start + batch]
+            scaled = FILTERS[method](np.stack([arrays[i] for i, _ in group]), scale)
+            for (i, key), result in zip(group, scaled):
+                results[i] = result if key is None else cache.put(key, result.copy())
+            done += len(group)
+            if progress is not None:
+                progress(done, len(arrays))
+    return results
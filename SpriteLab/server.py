@@ -0,0 +1,406 @@
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+import export
+from atlas import build_atlas
+from palette import PALETTES, load_palette
+from project import LazyFrames, load_project, frame_durations
+from render import file_hash
+from scaler import FILTERS
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+CACHE_DIR = ".spritelab-cache"
+MEMORY_BUDGET = 64 * 1024 * 1024
+DISK_BUDGET = 512 * 1024 * 1024
+PROJECT_SLOTS = 8
+MAX_SCALE = 32
+ENDPOINTS = ("frame", "animation", "sheet", "sheet.json")
+CONTENT_TYPES = {".png": "image/png", ".gif": "image/gif", ".webp": "image/webp", ".json": "application/json"}
+
+
+class OutputCache:
+    def __init__(self, directory, memory_budget=MEMORY_BUDGET, disk_budget=DISK_BUDGET):
+        self.directory = directory
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.disk = OrderedDict()
+        self.disk_bytes = 0
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(directory):
+            if entry.is_file() and os.path.splitext(entry.name)[1] in CONTENT_TYPES and not entry.name.startswith("tmp"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self.disk[name] = size
+            self.disk_bytes += size
+        self.evict()
+    
+    def path(self, name):
+        return os.path.join(self.directory, name)
+    
+    def get(self, name):
+        with self.lock:
+            data = self.memory.get(name)
+            if data is not None:
+                self.memory.move_to_end(name)
+                self.hits["memory"] += 1
+                return data, "memory"
+            if name not in self.disk:
+                return None, None
+            self.disk.move_to_end(name)
+        try:
+            with open(self.path(name), "rb") as f:
+                data = f.read()
+            os.utime(self.path(name))
+        except OSError:
+            with self.lock:
+                self.disk_bytes -= self.disk.pop(name, 0)
+            return None, None
+        with self.lock:
+            self.hits["disk"] += 1
+            self.remember(name, data)
+        return data, "disk"
+    
+    def store(self, name, render):
+        fd, temp_name = tempfile.mkstemp(suffix=os.path.splitext(name)[1], dir=self.directory)
+        os.close(fd)
+        try:
+            render(temp_name)
+            with open(temp_name, "rb") as f:
+                data = f.read()
+            os.replace(temp_name, self.path(name))
+        except BaseException:
+            if os.path.exists(temp_name):
+                os.remove(temp_name)
+            raise
+        with self.lock:
+            self.misses += 1
+            self.disk_bytes += len(data) - self.disk.pop(name, 0)
+            self.disk[name] = len(data)
+            self.remember(name, data)
+            self.evict()
+        return data
+    
+    def remember(self, name, data):
+        old = self.memory.pop(name, None)
+        if old is not None:
+            self.memory_bytes -= len(old)
+        self.memory[name] = data
+        self.memory_bytes += len(data)
+        while self.memory_bytes > self.memory_budget and len(self.memory) > 1:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+    
+    def evict(self):
+        while self.disk_bytes > self.disk_budget and len(self.disk) > 1:
+            name, size = self.disk.popitem(last=False)
+            self.disk_bytes -= size
+            self.remove(name)
+    
+    def discard(self, prefix):
+        with self.lock:
+            for name in [name for name in self.memory if name.startswith(prefix)]:
+                self.memory_bytes -= len(self.memory.pop(name))
+            for name in [name for name in self.disk if name.startswith(prefix)]:
+                self.disk_bytes -= self.disk.pop(name)
+                self.remove(name)
+    
+    def remove(self, name):
+        try:
+            os.remove(self.path(name))
+        except OSError:
+            pass
+    
+    def stats(self):
+        with self.lock:
+            return {
+                "memory": {"entries": len(self.memory), "bytes": self.memory_bytes, "budget": self.memory_budget, "hits": self.hits["memory"]},
+                "disk": {"entries": len(self.disk), "bytes": self.disk_bytes, "budget": self.disk_budget, "hits": self.hits["disk"]},
+                "misses": self.misses
+            }
+
+
+def query_int(query, key, default, low, high):
+    try:
+        value = int(query.get(key, default))
+    except ValueError:
+        raise ValueError(f"'{key}' must be an integer") from None
+    if not low <= value <= high:
+        raise ValueError(f"'{key}' must be within {low}-{high}")
+    return value
+
+
+def query_choice(query, key, default, choices):
+    value = query.get(key, default)
+    if value not in choices:
+        raise ValueError(f"'{key}' must be one of {', '.join(choices)}")
+    return value
+
+
+class RenderService:
+    def __init__(self, root, cache_dir=None, memory_budget=MEMORY_BUDGET, disk_budget=DISK_BUDGET):
+        self.root = os.path.realpath(root)
+        self.cache = OutputCache(cache_dir or os.path.join(self.root, CACHE_DIR), memory_budget, disk_budget)
+        self.sources = {}
+        self.projects = OrderedDict()
+        self.leases = {}
+        self.retired = {}
+        self.render_locks = {}
+        self.palettes = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+    
+    def resolve(self, name, kind="project"):
+        path = os.path.realpath(os.path.join(self.root, name))
+        if os.path.commonpath([self.root, path]) != self.root or not os.path.isfile(path):
+            raise FileNotFoundError(f"No such {kind}: {name}")
+        return path
+    
+    def content_hash(self, path):
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            known = self.sources.get(path)
+        if known is not None and known[0] == signature:
+            return known[1]
+        content = file_hash(path)
+        with self.lock:
+            self.sources[path] = (signature, content)
+            stale = known is not None and known[1] != content and all(other != known[1] for _, other in self.sources.values())
+            if stale and known[1] in self.projects:
+                self.retire(self.projects.pop(known[1]))
+        if stale:
+            self.cache.discard(known[1][:16])
+        return content
+    
+    def project(self, path, content):
+        with self.lock:
+            project = self.projects.get(content)
+            if project is not None:
+                self.projects.move_to_end(content)
+                self.leases[id(project)] = self.leases.get(id(project), 0) + 1
+                return project
+        project = load_project(path)
+        with self.lock:
+            self.leases[id(project)] = self.leases.get(id(project), 0) + 1
+            self.render_locks[id(project)] = threading.Lock()
+            if content in self.projects:
+                self.retire(self.projects.pop(content))
+            self.projects[content] = project
+            while len(self.projects) > PROJECT_SLOTS:
+                self.retire(self.projects.popitem(last=False)[1])
+        return project
+    
+    def retire(self, project):
+        if self.leases.get(id(project)):
+            self.retired[id(project)] = project
+            return
+        del self.render_locks[id(project)]
+        if isinstance(project.frames, LazyFrames):
+            project.frames.detach()
+    
+    def release(self, project):
+        with self.lock:
+            self.leases[id(project)] -= 1
+            if self.leases[id(project)]:
+                return
+            del self.leases[id(project)]
+            retired = self.retired.pop(id(project), None)
+            if retired is not None:
+                self.retire(retired)
+    
+    def palette(self, spec):
+        key = spec
+        if spec not in PALETTES:
+            spec = self.resolve(spec, "palette")
+            stat = os.stat(spec)
+            key = (spec, stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            palette = self.palettes.get(key)
+        if palette is None:
+            palette = load_palette(spec)
+            with self.lock:
+                self.palettes[key] = palette
+        return palette
+    
+    def frames(self, project, indices, palette, dither):
+        with self.render_locks[id(project)]:
+            frames = [np.asarray(project.frames[i]) for i in indices]
+        if palette is not None:
+            frames = [palette.remap(frame, dither) for frame in frames]
+        return frames
+    
+    def request(self, kind, query):
+        if kind not in ENDPOINTS:
+            raise LookupError(f"Unknown endpoint: /{kind}")
+        path = self.resolve(query.get("project", ""))
+        scale = query_int(query, "scale", 1, 1, MAX_SCALE)
+        method = query_choice(query, "filter", "nearest", tuple(FILTERS))
+        palette = self.palette(query["palette"]) if query.get("palette") else None
+        try:
+            dither = float(query.get("dither", 0))
+        except ValueError:
+            raise ValueError("'dither' must be a number") from None
+        if not 0 <= dither <= 1:
+            raise ValueError("'dither' must be within 0-1")
+        colors = None if palette is None else hashlib.sha256(palette.colors.tobytes()).hexdigest()
+        params = {"scale": scale, "filter": method, "palette": colors, "dither": dither}
+        
+        content = self.content_hash(path)
+        project = self.project(path, content)
+        try:
+            count = len(project.frames)
+            if kind == "frame":
+                index = query_int(query, "frame", 0, 0, count - 1) if count else 0
+                params["frame"] = index
+                ext = ".png"
+                
+                def render(filename):
+                    export.export_png(self.frames(project, [index], palette, dither)[0], filename, scale, method)
+            elif kind == "animation":
+                fmt = query_choice(query, "format", "gif", tuple(export.ANIMATION_FORMATS))
+                duration = query_int(query, "duration", 200, 1, 65535)
+                params.update(format=fmt, duration=duration)
+                ext = export.ANIMATION_FORMATS[fmt]
+                
+                def render(filename):
+                    durations = [d or duration for d in frame_durations(project.frames)]
+                    export.export_animation(self.frames(project, range(count), palette, dither), filename, scale, durations, fmt, method=method)
+            else:
+                padding = query_int(query, "padding", 1, 0, 256)
+                extrude = query_int(query, "extrude", 0, 0, 256)
+                duration = query_int(query, "duration", 200, 1, 65535)
+                params.update(padding=padding, extrude=extrude, duration=duration)
+                ext = os.path.splitext(kind)[1] or ".png"
+                stem = os.path.splitext(os.path.basename(path))[0]
+                
+                def render(filename):
+                    durations = [d or duration for d in frame_durations(project.frames)]
+                    sheet = build_atlas([(stem, self.frames(project, range(count), palette, dither), durations)], scale, padding, extrude, method=method)
+                    if ext == ".json":
+                        with open(filename, "w") as f:
+                            json.dump(sheet.meta(stem + ".png"), f, indent=2)
+                    else:
+                        sheet.image.save(filename)
+            if not count:
+                raise ValueError("Project holds no frames")
+            
+            digest = hashlib.sha256(json.dumps([kind, params], sort_keys=True).encode("utf-8")).hexdigest()[:32]
+            name = f"{content[:16]}-{digest}{ext}"
+            data, source = self.fetch(name, render)
+            return name, data, source
+        finally:
+            self.release(project)
+    
+    def fetch(self, name, render):
+        data, source = self.cache.get(name)
+        if data is not None:
+            return data, source
+        with self.lock:
+            future = self.pending.get(name)
+            owner = future is None
+            if owner:
+                future = self.pending[name] = Future()
+        if not owner:
+            return future.result(), "shared"
+        try:
+            data, source = self.cache.get(name)
+            if data is None:
+                data, source = self.cache.store(name, render), "render"
+            future.set_result(data)
+            return data, source
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.pending[name]
+    
+    def stats(self):
+        with self.lock:
+            stats = {"projects": len(self.projects), "sources": len(self.sources), "pending": len(self.pending)}
+        stats.update(self.cache.stats())
+        return stats
+
+
+class RenderHandler(BaseHTTPRequestHandler):
+    server_version = "SpriteLab"
+    
+    def do_GET(self):
+        url = urlsplit(self.path)
+        kind = url.path.strip("/")
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        service = self.server.service
+        try:
+            if kind == "stats":
+                name, data, source = "stats.json", json.dumps(service.stats(), indent=2).encode("utf-8"), None
+            else:
+                name, data, source = service.request(kind, query)
+        except (FileNotFoundError, LookupError) as e:
+            self.send_error(HTTPStatus.NOT_FOUND, str(e).strip("'"))
+            return
+        except (OSError, ValueError) as e:
+            self.send_error(HTTPStatus.BAD_REQUEST, str(e))
+            return
+        except Exception as e:
+            self.log_error("Render failed for %s: %r", self.path, e)
+            self.send_error(HTTPStatus.INTERNAL_SERVER_ERROR, str(e))
+            return
+        
+        etag = None if source is None else f'"{os.path.splitext(name)[0]}"'
+        if etag is not None and self.headers.get("If-None-Match") == etag:
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", CONTENT_TYPES[os.path.splitext(name)[1]])
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "no-cache")
+        if etag is not None:
+            self.send_header("ETag", etag)
+            self.send_header("X-Cache", source)
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+def make_server(root, host=DEFAULT_HOST, port=DEFAULT_PORT, cache_dir=None, memory_budget=MEMORY_BUDGET, disk_budget=DISK_BUDGET, quiet=False):
+    server = ThreadingHTTPServer((host, port), RenderHandler)
+    server.daemon_threads = True
+    server.service = RenderService(root, cache_dir, memory_budget, disk_budget)
+    server.quiet = quiet
+    return server
+
+
+def serve(root, host=DEFAULT_HOST, port=DEFAULT_PORT, cache_dir=None, memory_budget=MEMORY_BUDGET, disk_budget=DISK_BUDGET, quiet=False):
+    server = make_server(root, host, port, cache_dir, memory_budget, disk_budget, quiet)
+    print(f"Serving {server.service.root} on http://{server.server_address[0]}:{server.server_address[1]}/ (cache: {server.service.cache.directory})", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
@@ -0,0 +1,188 @@
+import argparse
+import sys
+
+import os
+
+import export
+import server
+from atlas import build_atlas
+from canvas import MAX_CANVAS_SIZE
+from importer import RESAMPLE, probe, import_frames
+from layers import LayeredFrame
+from palette import PALETTES, load_palette, remap_layers, to_indexed, to_direct
+from project import Project, load_project, frame_durations, save_binary
+from render import DEFAULT_FORMATS, FORMATS, render_many
+from scaler import FILTERS
+
+
+def render_command(args):
+    try:
+        rendered, skipped, failed = render_many(args.projects, args.output, args.format, args.scale, args.duration, args.jobs, args.force, args.filter)
+    except ValueError as e:
+        print(f"Render error: {e}", file=sys.stderr)
+        return 2
+    
+    for filename, outputs in rendered.items():
+        print(f"Rendered: {filename} ({len(outputs)} files)")
+    for filename in skipped:
+        print(f"Unchanged: {filename}")
+    for filename, error in failed.items():
+        print(f"Failed: {filename}: {error}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def atlas_command(args):
+    sources = []
+    for filename in args.projects:
+        name = os.path.splitext(os.path.basename(filename))[0]
+        frames = load_project(filename).frames
+        sources.append((name, list(frames), [d or args.duration for d in frame_durations(frames)]))
+    
+    try:
+        sheet = build_atlas(sources, args.scale, args.padding, args.extrude, args.max_width, args.pot, args.filter)
+    except ValueError as e:
+        print(f"Atlas error: {e}", file=sys.stderr)
+        return 2
+    
+    image_name, meta_name = sheet.save(args.output, args.meta)
+    print(f"Atlas: {image_name} + {meta_name} ({sheet.cells} unique of {len(sheet.frames)} frames, {sheet.image.width}x{sheet.image.height})")
+    return 0
+
+
+def remap_command(args):
+    try:
+        palette = load_palette(args.palette)
+    except (OSError, ValueError) as e:
+        print(f"Palette error: {e}", file=sys.stderr)
+        return 2
+    
+    os.makedirs(args.output, exist_ok=True)
+    for filename in args.projects:
+        project = load_project(filename)
+        frames = list(project.frames)
+        if project.indexed is not None:
+            to_direct(frames)
+        if args.indexed:
+            to_indexed(frames, palette, args.dither)
+        else:
+            for frame_index, layer_index, pixels in remap_layers(frames, palette, args.dither):
+                frames[frame_index].layers[layer_index].pixels = pixels
+        name = os.path.splitext(os.path.basename(filename))[0] + ".slp"
+        output = save_binary(os.path.join(args.output, name), Project(frames, project.canvas_size, project.pixel_size, project.palette, palette if args.indexed else None))
+        print(f"Remapped: {filename} -> {output} ({len(frames)} frames)")
+    return 0
+
+
+def parse_cell(text):
+    width, _, height = text.lower().partition("x")
+    return int(width), int(height or width)
+
+
+def import_command(args):
+    try:
+        palette = load_palette(args.palette) if args.palette else None
+    except (OSError, ValueError) as e:
+        print(f"Palette error: {e}", file=sys.stderr)
+        return 2
+    
+    try:
+        width, height, _ = probe(args.image)
+        sheet = (*args.sheet, args.margin, args.spacing) if args.sheet else None
+        size = args.size or (max(args.sheet) if args.sheet else max(width, height))
+        size = max(1, min(size, MAX_CANVAS_SIZE))
+        frames = []
+        for pixels, duration in import_frames(args.image, size, args.method, None if args.indexed else palette, args.dither, sheet):
+            frame = LayeredFrame.from_array(pixels)
+            frame.duration = duration or args.duration
+            frames.append(frame)
+    except (OSError, ValueError) as e:
+        print(f"Import error: {e}", file=sys.stderr)
+        return 2
+    if not frames:
+        print(f"Import error: {args.image} holds no frames", file=sys.stderr)
+        return 2
+    
+    if args.indexed:
+        to_indexed(frames, palette, args.dither)
+    output = args.output or os.path.splitext(args.image)[0] + ".slp"
+    output = save_binary(output, Project(frames, size, indexed=palette if args.indexed else None))
+    print(f"Imported: {args.image} -> {output} ({len(frames)} frames, {size}x{size})")
+    return 0
+
+
+def serve_command(args):
+    try:
+        return server.serve(args.root, args.host, args.port, args.cache_dir, args.memory * 1024 * 1024, args.disk * 1024 * 1024, args.quiet)
+    except OSError as e:
+        print(f"Server error: {e}", file=sys.stderr)
+        return 2
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="spritelab", description="SpriteLab command line tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    render = commands.add_parser("render", help="Render projects to PNG/GIF/APNG/WebP without opening the editor")
+    render.add_argument("projects", nargs="+", help="Project files (.slp or .json)")
+    render.add_argument("-o", "--output", default="render", help="Output directory")
+    render.add_argument("-f", "--format", nargs="+", choices=FORMATS, default=list(DEFAULT_FORMATS), help="Output formats")
+    render.add_argument("-s", "--scale", nargs="+", type=int, default=[export.DEFAULT_SCALE], help="Output scale factors")
+    render.add_argument("--filter", choices=tuple(FILTERS), default="nearest", help="Upscaling filter")
+    render.add_argument("-d", "--duration", type=int, default=200, help="Animation frame duration in milliseconds for frames without their own")
+    render.add_argument("-j", "--jobs", type=int, default=None, help="Worker processes (default: CPU count)")
+    render.add_argument("--force", action="store_true", help="Render even if inputs are unchanged")
+    render.set_defaults(handler=render_command)
+    
+    atlas = commands.add_parser("atlas", help="Pack project frames into a sprite sheet with metadata")
+    atlas.add_argument("projects", nargs="+", help="Project files (.slp or .json)")
+    atlas.add_argument("-o", "--output", default="atlas.png", help="Atlas image path; metadata is written next to it")
+    atlas.add_argument("-s", "--scale", type=int, default=1, help="Frame scale factor")
+    atlas.add_argument("--filter", choices=tuple(FILTERS), default="nearest", help="Upscaling filter")
+    atlas.add_argument("-p", "--padding", type=int, default=1, help="Empty pixels between cells")
+    atlas.add_argument("-e", "--extrude", type=int, default=0, help="Pixels of edge extrusion around each cell")
+    atlas.add_argument("-w", "--max-width", type=int, default=None, help="Atlas width (default: smallest power of two that fits)")
+    atlas.add_argument("--pot", action="store_true", help="Round the atlas size up to powers of two")
+    atlas.add_argument("-m", "--meta", choices=("json", "xml"), default="json", help="Metadata format")
+    atlas.add_argument("-d", "--duration", type=int, default=200, help="Frame duration in milliseconds for frames without their own")
+    atlas.set_defaults(handler=atlas_command)
+    
+    remap = commands.add_parser("remap", help="Map every frame of the given projects onto a palette")
+    remap.add_argument("projects", nargs="+", help="Project files (.slp or .json)")
+    remap.add_argument("-p", "--palette", required=True, help=f"Palette name ({', '.join(PALETTES)}), a .hex file or an image")
+    remap.add_argument("-o", "--output", default="remapped", help="Output directory for the remapped .slp projects")
+    remap.add_argument("-d", "--dither", type=float, default=0.0, help="Ordered dithering strength from 0 to 1")
+    remap.add_argument("--indexed", action="store_true", help="Save the result as an indexed-color project")
+    remap.set_defaults(handler=remap_command)
+    
+    importer = commands.add_parser("import", help="Turn a PNG/GIF/APNG image or sprite sheet into a project")
+    importer.add_argument("image", help="Image, animation or sprite sheet")
+    importer.add_argument("-o", "--output", default=None, help="Project path (default: the image name with .slp)")
+    importer.add_argument("-s", "--size", type=int, default=None, help="Canvas size; larger frames are downscaled to fit")
+    importer.add_argument("-m", "--method", choices=tuple(RESAMPLE), default="nearest", help="Downscaling filter")
+    importer.add_argument("-p", "--palette", default=None, help=f"Quantize to a palette ({', '.join(PALETTES)}), a .hex file or an image")
+    importer.add_argument("-d", "--dither", type=float, default=0.0, help="Ordered dithering strength from 0 to 1")
+    importer.add_argument("--indexed", action="store_true", help="Save as an indexed-color project (requires --palette)")
+    importer.add_argument("--sheet", type=parse_cell, default=None, metavar="WxH", help="Slice a sprite sheet into cells of this size")
+    importer.add_argument("--margin", type=int, default=0, help="Pixels around the sprite sheet grid")
+    importer.add_argument("--spacing", type=int, default=0, help="Pixels between sprite sheet cells")
+    importer.add_argument("--duration", type=int, default=None, help="Frame duration in milliseconds for frames without their own")
+    importer.set_defaults(handler=import_command)
+    
+    serve = commands.add_parser("serve", help="Serve rendered frames, animations and sheets over local HTTP")
+    serve.add_argument("root", nargs="?", default=".", help="Directory holding the projects to serve")
+    serve.add_argument("--host", default=server.DEFAULT_HOST, help="Address to listen on")
+    serve.add_argument("-p", "--port", type=int, default=server.DEFAULT_PORT, help="Port to listen on")
+    serve.add_argument("--cache-dir", default=None, help=f"Render cache directory (default: <root>/{server.CACHE_DIR})")
+    serve.add_argument("--memory", type=int, default=server.MEMORY_BUDGET // (1024 * 1024), help="In-memory cache budget in MB")
+    serve.add_argument("--disk", type=int, default=server.DISK_BUDGET // (1024 * 1024), help="On-disk cache budget in MB")
+    serve.add_argument("-q", "--quiet", action="store_true", help="Do not log each request")
+    serve.set_defaults(handler=serve_command)
+    
+    args = parser.parse_args(argv)
+    if args.command == "import" and args.indexed and not args.palette:
+        parser.error("--indexed requires --palette")
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+
+from canvas import line_points
+
+BRUSH_SHAPES = ("square", "round")
+MAX_BRUSH_SIZE = 32
+
+
+@lru_cache(maxsize=None)
+def brush_offsets(size, shape="square"):
+    offsets = np.arange(size) - (size - 1) // 2
+    dy, dx = np.meshgrid(offsets, offsets, indexing="ij")
+    keep = np.ones(dx.shape, dtype=bool)
+    if shape == "round" and size > 2:
+        center = (size - 1) / 2 - (size - 1) // 2
+        keep = (dx - center) ** 2 + (dy - center) ** 2 <= ((size - 1) / 2 + 0.25) ** 2
+    return np.stack([dx[keep], dy[keep]], axis=-1)
+
+
+def stamp(points, offsets, width, height):
+    cells = (np.asarray(points, dtype=np.int64).reshape(-1, 1, 2) + offsets[None]).reshape(-1, 2)
+    cells = cells[(cells[:, 0] >= 0) & (cells[:, 0] < width) & (cells[:, 1] >= 0) & (cells[:, 1] < height)]
+    if not len(cells):
+        return None
+    x0, y0 = cells.min(axis=0)
+    x1, y1 = cells.max(axis=0) + 1
+    mask = np.zeros((y1 - y0, x1 - x0), dtype=bool)
+    mask[cells[:, 1] - y0, cells[:, 0] - x0] = True
+    return int(x0), int(y0), mask
+
+
+def is_corner(a, b, c):
+    return abs(a[0] - c[0]) == 1 and abs(a[1] - c[1]) == 1 and (b[0] == a[0] or b[1] == a[1]) and (b[0] == c[0] or b[1] == c[1])
+
+
+class Stroke:
+    def __init__(self, size=1, shape="square", pixel_perfect=False):
+        self.offsets = brush_offsets(size, shape)
+        self.pixel_perfect = pixel_perfect and size == 1
+        self.path = []
+        self.cells = Counter()
+    
+    def extend(self, samples):
+        added, removed = [], []
+        for point in samples:
+            segment = line_points(self.path[-1], point)[1:] if self.path else [point]
+            for cell in segment:
+                self.path.append(cell)
+                self.cells[cell] += 1
+                added.append(cell)
+                if self.pixel_perfect and len(self.path) >= 3 and is_corner(*self.path[-3:]):
+                    corner = self.path.pop(-2)
+                    self.cells[corner] -= 1
+                    if len(added) >= 2:
+                        added.pop(-2)
+                    elif not self.cells[corner]:
+                        removed.append(corner)
+        return added, removed
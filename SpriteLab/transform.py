@@ -0,0 +1,223 @@
+import math
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from canvas import to_color
+from history import PixelChange
+
+SCOPES = ("frame", "range", "all")
+CHUNK_BYTES = 16 * 1024 * 1024
+
+
+def rect_mask(width, height, start, end):
+    x0, x1 = sorted((start[0], end[0]))
+    y0, y1 = sorted((start[1], end[1]))
+    mask = np.zeros((height, width), dtype=bool)
+    mask[max(y0, 0):max(y1 + 1, 0), max(x0, 0):max(x1 + 1, 0)] = True
+    return mask
+
+
+def lasso_mask(width, height, points):
+    image = Image.new("1", (width, height), 0)
+    if len(points) > 2:
+        ImageDraw.Draw(image).polygon([tuple(point) for point in points], fill=1, outline=1)
+    else:
+        ImageDraw.Draw(image).line([tuple(point) for point in points], fill=1)
+    return np.array(image, dtype=bool)
+
+
+def bounds(mask):
+    rows = np.flatnonzero(mask.any(axis=1))
+    if not len(rows):
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+
+
+def parse_range(text, count):
+    first, _, last = text.replace(" ", "").partition("-")
+    first = int(first)
+    last = int(last) if last else first
+    if not 1 <= first <= last <= count:
+        raise ValueError(f"Frame range must be within 1-{count}")
+    return list(range(first - 1, last))
+
+
+def parse_pair(text, cast=float):
+    values = [cast(part) for part in text.lower().replace("x", ",").split(",") if part.strip()]
+    if len(values) == 1:
+        values *= 2
+    if len(values) != 2:
+        raise ValueError(f"Expected one or two numbers, got '{text}'")
+    return values
+
+
+def nearest(values):
+    return np.floor(values + 0.5).astype(np.intp)
+
+
+def geometric(mask, target, mapper):
+    height, width = mask.shape
+    box = bounds(mask)
+    if box is None:
+        return None
+    tx0, ty0 = max(target[0], 0), max(target[1], 0)
+    tx1, ty1 = max(min(target[2], width), tx0), max(min(target[3], height), ty0)
+    if tx1 == tx0 or ty1 == ty0:
+        tx0, ty0, tx1, ty1 = box[0], box[1], box[0], box[1]
+    x0, y0 = min(box[0], tx0), min(box[1], ty0)
+    x1, y1 = max(box[2], tx1), max(box[3], ty1)
+    
+    ys, xs = np.mgrid[ty0:ty1, tx0:tx1]
+    sy, sx, valid = mapper(ys, xs)
+    valid = valid & (sy >= box[1]) & (sy < box[3]) & (sx >= box[0]) & (sx < box[2])
+    sy = np.where(valid, sy, box[1])
+    sx = np.where(valid, sx, box[0])
+    valid &= mask[sy, sx]
+    
+    dest = np.zeros((y1 - y0, x1 - x0), dtype=bool)
+    dest[ty0 - y0:ty1 - y0, tx0 - x0:tx1 - x0] = valid
+    source = (sy[valid] - y0) * (x1 - x0) + sx[valid] - x0
+    lifted = mask[y0:y1, x0:x1]
+    whole = lifted.all() and dest.all()
+    
+    def op(stack, background):
+        moved = np.take(stack.reshape(len(stack), -1, stack.shape[-1]), source, axis=1)
+        if whole:
+            return moved.reshape(stack.shape)
+        out = stack.copy()
+        out[:, lifted] = background
+        opaque = (moved != background).any(axis=-1, keepdims=True)
+        out[:, dest] = np.where(opaque, moved, out[:, dest])
+        return out
+    
+    selection = np.zeros_like(mask)
+    selection[y0:y1, x0:x1] = dest
+    return (x0, y0, x1, y1), op, selection
+
+
+def flip(mask, horizontal=True):
+    box = bounds(mask)
+    if box is None:
+        return None
+    x0, y0, x1, y1 = box
+    if horizontal:
+        return geometric(mask, box, lambda ys, xs: (ys, x0 + x1 - 1 - xs, True))
+    return geometric(mask, box, lambda ys, xs: (y0 + y1 - 1 - ys, xs, True))
+
+
+def rotate(mask, degrees):
+    box = bounds(mask)
+    if box is None:
+        return None
+    cx = (box[0] + box[2] - 1) / 2
+    cy = (box[1] + box[3] - 1) / 2
+    turns = degrees / 90
+    if float(turns).is_integer():
+        cos, sin = ((1, 0), (0, 1), (-1, 0), (0, -1))[int(turns) % 4]
+    else:
+        cos, sin = math.cos(math.radians(degrees)), math.sin(math.radians(degrees))
+    corners = np.array([(box[0], box[1]), (box[2] - 1, box[1]), (box[0], box[3] - 1), (box[2] - 1, box[3] - 1)], dtype=float) - (cx, cy)
+    xs = cx + corners[:, 0] * cos - corners[:, 1] * sin
+    ys = cy + corners[:, 0] * sin + corners[:, 1] * cos
+    target = (math.floor(xs.min()) - 1, math.floor(ys.min()) - 1, math.ceil(xs.max()) + 2, math.ceil(ys.max()) + 2)
+    
+    def mapper(ys, xs):
+        dx, dy = xs - cx, ys - cy
+        return nearest(cy - dx * sin + dy * cos), nearest(cx + dx * cos + dy * sin), True
+    return geometric(mask, target, mapper)
+
+
+def scale(mask, factor_x, factor_y=None):
+    factor_y = factor_x if factor_y is None else factor_y
+    box = bounds(mask)
+    if box is None or factor_x <= 0 or factor_y <= 0:
+        return None
+    x0, y0, x1, y1 = box
+    target = (x0, y0, x0 + math.ceil((x1 - x0) * factor_x), y0 + math.ceil((y1 - y0) * factor_y))
+    
+    def mapper(ys, xs):
+        return y0 + np.floor((ys - y0 + 0.5) / factor_y).astype(np.intp), x0 + np.floor((xs - x0 + 0.5) / factor_x).astype(np.intp), True
+    return geometric(mask, target, mapper)
+
+
+def shift(mask, dx, dy, wrap=False):
+    box = bounds(mask)
+    if box is None:
+        return None
+    x0, y0, x1, y1 = box
+    if wrap:
+        return geometric(mask, box, lambda ys, xs: (y0 + (ys - y0 - dy) % (y1 - y0), x0 + (xs - x0 - dx) % (x1 - x0), True))
+    return geometric(mask, (x0 + dx, y0 + dy, x1 + dx, y1 + dy), lambda ys, xs: (ys - dy, xs - dx, True))
+
+
+def outline(mask, color):
+    box = bounds(mask)
+    if box is None:
+        return None
+    height, width = mask.shape
+    x0, y0, x1, y1 = max(box[0] - 1, 0), max(box[1] - 1, 0), min(box[2] + 1, width), min(box[3] + 1, height)
+    inside = mask[y0:y1, x0:x1]
+    
+    def op(stack, background):
+        filled = (stack != background).any(axis=-1)
+        near = np.zeros_like(filled)
+        near[:, 1:] |= filled[:, :-1]
+        near[:, :-1] |= filled[:, 1:]
+        near[:, :, 1:] |= filled[:, :, :-1]
+        near[:, :, :-1] |= filled[:, :, 1:]
+        out = stack.copy()
+        out[near & ~filled & inside] = to_color(color, stack.shape[-1])
+        return out
+    return (x0, y0, x1, y1), op, mask
+
+
+def replace_color(mask, old, new, tolerance=0):
+    box = bounds(mask)
+    if box is None:
+        return None
+    x0, y0, x1, y1 = box
+    inside = mask[y0:y1, x0:x1]
+    
+    def op(stack, background):
+        channels = stack.shape[-1]
+        match = (np.abs(stack.astype(np.int16) - np.array(to_color(old, channels), dtype=np.int16)) <= tolerance).all(axis=-1)
+        out = stack.copy()
+        out[match & inside] = to_color(new, channels)
+        return out
+    return box, op, mask
+
+
+def target_layers(frames, frame_indices, layer_index):
+    groups, seen = {}, set()
+    for frame_index in frame_indices:
+        pixels = frames[frame_index].layers[layer_index].pixels
+        if id(pixels) not in seen:
+            seen.add(id(pixels))
+            groups.setdefault((pixels.channels, pixels.background), []).append((frame_index, pixels))
+    return groups
+
+
+def apply(frames, frame_indices, layer_index, region, op):
+    x0, y0, x1, y1 = region
+    changes = []
+    for (channels, background), targets in target_layers(frames, frame_indices, layer_index).items():
+        background = np.array(background, dtype=np.uint8)
+        chunk = max(1, CHUNK_BYTES // max(1, (x1 - x0) * (y1 - y0) * channels))
+        for start in range(0, len(targets), chunk):
+            group = targets[start:start + chunk]
+            stack = np.stack([pixels.read(x0, y0, x1, y1) for _, pixels in group])
+            out = op(stack, background)
+            changed = (out != stack).any(axis=-1).reshape(len(group), -1)
+            counts = changed.sum(axis=1)
+            flat = np.flatnonzero(changed)
+            old = stack.reshape(-1, channels)[flat]
+            new = out.reshape(-1, channels)[flat]
+            ys, xs = np.divmod(flat % changed.shape[1], x1 - x0)
+            splits = np.cumsum(counts)[:-1]
+            for (frame_index, pixels), frame, count, old_values, new_values, frame_ys, frame_xs in zip(group, out, counts, np.split(old, splits), np.split(new, splits), np.split(ys, splits), np.split(xs, splits)):
+                if count:
+                    pixels.write(x0, y0, frame)
+                    changes.append(PixelChange(frame_index, layer_index, (frame_ys + y0) * pixels.width + frame_xs + x0, old_values, new_values))
+    return changes
@@ -0,0 +1,141 @@
+from collections import OrderedDict
+
+import numpy as np
+import pygame
+
+ACTIVE_FPS = 60
+IDLE_FPS = 10
+UI_GRACE = 0.5
+MAX_RECTS = 32
+ZOOM_LEVELS = (1, 2, 3, 4, 6, 8, 12, 16, 20, 24, 32, 40, 48, 64)
+DISPLAY_CACHE_BUDGET = 192 * 1024 * 1024
+REGION_CACHE_BUDGET = 64 * 1024 * 1024
+ONION_PREV = (255, 64, 64)
+ONION_NEXT = (64, 128, 255)
+
+
+class TextCache:
+    def __init__(self, font, limit=128):
+        self.font = font
+        self.limit = limit
+        self.surfaces = {}
+    
+    def render(self, text, color):
+        key = (text, tuple(color))
+        surface = self.surfaces.get(key)
+        if surface is None:
+            if len(self.surfaces) >= self.limit:
+                self.surfaces.clear()
+            surface = self.font.render(text, True, color)
+            self.surfaces[key] = surface
+        return surface
+
+
+class SurfaceCache:
+    def __init__(self, budget=DISPLAY_CACHE_BUDGET):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.nbytes = 0
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def get(self, key, revision):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != revision:
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+    
+    def put(self, key, revision, surface):
+        self.discard(key)
+        size = surface.get_width() * surface.get_height() * surface.get_bytesize()
+        self.entries[key] = (revision, surface, size)
+        self.nbytes += size
+        while self.nbytes > self.budget and len(self.entries) > 1:
+            _, (_, _, size) = self.entries.popitem(last=False)
+            self.nbytes -= size
+        return surface
+    
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[2]
+    
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+
+class DirtyRenderer:
+    def __init__(self, screen):
+        self.screen = screen
+        self.rects = []
+        self.full = True
+    
+    def invalidate(self, rect=None):
+        if rect is None:
+            self.full = True
+        elif not self.full:
+            self.rects.append(pygame.Rect(rect))
+    
+    def present(self):
+        if self.full:
+            pygame.display.flip()
+        elif self.rects:
+            rects = self.rects
+            if len(rects) > MAX_RECTS:
+                rects = [rects[0].unionall(rects[1:])]
+            pygame.display.update(rects)
+        self.rects = []
+        self.full = False
+
+
+def make_grid(canvas_size, pixel_size, color):
+    width = canvas_size * pixel_size
+    grid = pygame.Surface((width + 1, width + 1), pygame.SRCALPHA)
+    for i in range(canvas_size + 1):
+        pygame.draw.line(grid, color, (i * pixel_size, 0), (i * pixel_size, width), 1)
+        pygame.draw.line(grid, color, (0, i * pixel_size), (width, i * pixel_size), 1)
+    return grid
+
+
+def make_region(region):
+    return pygame.surfarray.make_surface(region.swapaxes(0, 1))
+
+
+def make_ghost(region, tint):
+    ghost = pygame.Surface((region.shape[1], region.shape[0]), pygame.SRCALPHA)
+    rgb = pygame.surfarray.pixels3d(ghost)
+    rgb[:] = ((region.astype(np.uint16) + tint) // 2).astype(np.uint8).swapaxes(0, 1)
+    del rgb
+    alpha = pygame.surfarray.pixels_alpha(ghost)
+    alpha[:] = np.where(np.any(region != 255, axis=-1), 255, 0).astype(np.uint8).T
+    del alpha
+    return ghost
+
+
+def make_patch(region, mask):
+    patch = pygame.Surface((region.shape[1], region.shape[0]), pygame.SRCALPHA)
+    rgb = pygame.surfarray.pixels3d(patch)
+    rgb[:] = region.swapaxes(0, 1)
+    del rgb
+    alpha = pygame.surfarray.pixels_alpha(patch)
+    alpha[:] = np.where(mask, 255, 0).astype(np.uint8).T
+    del alpha
+    return patch
+
+
+def make_outline(mask, pixel_size):
+    big = mask.repeat(pixel_size, axis=0).repeat(pixel_size, axis=1)
+    padded = np.pad(big, 1, mode="edge")
+    edge = big & ~(padded[:-2, 1:-1] & padded[2:, 1:-1] & padded[1:-1, :-2] & padded[1:-1, 2:])
+    outline = pygame.Surface((big.shape[1], big.shape[0]), pygame.SRCALPHA)
+    ys, xs = np.indices(big.shape)
+    rgb = pygame.surfarray.pixels3d(outline)
+    rgb[:] = np.where((((xs + ys) // 4) % 2 == 0)[..., None], 255, 0).astype(np.uint8).swapaxes(0, 1)
+    del rgb
+    alpha = pygame.surfarray.pixels_alpha(outline)
+    alpha[:] = np.where(edge, 255, 0).astype(np.uint8).T
+    del alpha
+    return outline